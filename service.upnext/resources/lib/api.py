@@ -6,8 +6,10 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import os.path
+from heapq import nlargest
 
 import constants
+import similar_index
 import utils
 import xbmc
 
@@ -145,6 +147,31 @@ RECOMMENDATION_PROPERTIES = {
     })
 }
 
+# Properties of all library videos used to build the similar videos index
+SIMILAR_INDEX_PROPERTIES = {
+    'movies': [
+        'title',
+        'plot',
+        'genre',
+        'set',
+        'director',
+        'writer',
+        'cast',  # Slow, only requested for videos being added to index
+        'tag',  # Slow, only requested for videos being added to index
+        'playcount',
+        'rating',
+    ],
+    'tvshows': [
+        'title',
+        'plot',
+        'genre',
+        'cast',  # Slow, only requested for videos being added to index
+        'tag',  # Slow, only requested for videos being added to index
+        'playcount',
+        'rating',
+    ],
+}
+
 PLAYER_PLAYLIST = {
     'none': -1,
     'audio': xbmc.PLAYLIST_MUSIC,  # 0
@@ -211,30 +238,56 @@ JSON_MAP = {
     },
 }
 
-QUERY_LIMITS = {
-    'start': 0,
-    'end': constants.UNDEFINED
-}
+
+class _Param(object):
+    """Named placeholder for a value in a filter template. Templates are never
+       modified, use build_filter to create a filter with values substituted"""
+
+    __slots__ = ('name', )
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '{0}({1!r})'.format(self.__class__.__name__, self.name)
+
+
+def build_filter(template, **values):
+    """Returns a new filter built from template, with each named placeholder
+       replaced by the keyword argument of the same name. Safe to call
+       concurrently as the template is only read"""
+
+    def _build(item):
+        if isinstance(item, _Param):
+            return values[item.name]
+        if isinstance(item, dict):
+            return {key: _build(value) for key, value in item.items()}
+        if isinstance(item, list):
+            return [_build(value) for value in item]
+        return item
+
+    return _build(template)
+
 
 FILTER_TITLE = {
     'field': 'title',
     'operator': 'is',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('title')
 }
 FILTER_NOT_TITLE = {
     'field': 'title',
     'operator': 'isnot',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('title')
 }
 FILTER_NOT_FILE = {
     'field': 'filename',
     'operator': 'doesnotcontain',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('filename')
 }
 FILTER_NOT_PATH = {
     'field': 'path',
     'operator': 'doesnotcontain',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('path')
 }
 FILTER_NOT_FILEPATH = {
     'or': [
@@ -279,12 +332,12 @@ FILTER_REGULAR_SEASON_WATCHED = {
 FILTER_THIS_SEASON = {
     'field': 'season',
     'operator': 'is',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('season')
 }
 FILTER_NEXT_SEASON = {
     'field': 'season',
     'operator': 'greaterthan',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('season')
 }
 
 FILTER_FIRST_EPISODE = {
@@ -295,23 +348,23 @@ FILTER_FIRST_EPISODE = {
 FILTER_THIS_EPISODE = {
     'field': 'episode',
     'operator': 'is',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('episode')
 }
 FILTER_NEXT_EPISODE = {
     'field': 'episode',
     'operator': 'greaterthan',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('episode')
 }
 
 FILTER_AIRED = {
     'field': 'airdate',
     'operator': 'startswith',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('aired_date')
 }
 FILTER_NEXT_AIRED = {
     'field': 'airdate',
     'operator': 'after',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('aired')
 }
 FILTER_UPNEXT_AIRED = {
     'or': [
@@ -372,7 +425,7 @@ FILTER_UNWATCHED_UPNEXT_SEASON_EPISODE = {
 FILTER_GENRE = {
     'field': 'genre',
     'operator': 'contains',
-    'value': [constants.UNDEFINED_STR]
+    'value': _Param('genres')
 }
 FILTER_UNWATCHED_GENRE = {
     'and': [
@@ -384,13 +437,13 @@ FILTER_UNWATCHED_GENRE = {
 FILTER_SET = {
     'field': 'set',
     'operator': 'is',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('set_name')
 }
 
 FILTER_NEXT_MOVIE = {
     'field': 'year',
     'operator': 'after',
-    'value': constants.UNDEFINED_STR
+    'value': _Param('year')
 }
 FILTER_UPNEXT_MOVIE = {
     'and': [
@@ -830,15 +883,13 @@ def get_next_episode_from_library(episode=constants.UNDEFINED,
         return episode
 
     (path, filename) = os.path.split(episode['file'])
-    FILTER_NOT_FILE['value'] = filename
-    FILTER_NOT_PATH['value'] = path
     filters = [
         # Check that both next filename and path are different to current
         # to deal with different file naming schemes e.g.
         # Season 1/Episode 1.mkv
         # Season 1/Episode 1/video.mkv
         # Season 1/Episode 1-2-3.mkv
-        FILTER_NOT_FILEPATH
+        build_filter(FILTER_NOT_FILEPATH, filename=filename, path=path)
     ]
 
     if unwatched_only:
@@ -852,21 +903,25 @@ def get_next_episode_from_library(episode=constants.UNDEFINED,
         aired = episode['firstaired']
         if aired:
             aired = utils.iso_datetime(aired)
-            FILTER_AIRED['value'] = aired.split()[0]
-            FILTER_NEXT_AIRED['value'] = aired
-            FILTER_NEXT_EPISODE['value'] = str(episode['episode'])
-            filters.append(FILTER_UPNEXT_AIRED)
+            filters.append(build_filter(
+                FILTER_UPNEXT_AIRED,
+                aired_date=aired.split()[0],
+                aired=aired,
+                episode=str(episode['episode']),
+            ))
         else:
-            season = str(episode['season'])
-            FILTER_NEXT_SEASON['value'] = season
-            FILTER_THIS_SEASON['value'] = season
-            FILTER_NEXT_EPISODE['value'] = str(episode['episode'])
-            filters.append(FILTER_UPNEXT_SEASON_EPISODE)
+            filters.append(build_filter(
+                FILTER_UPNEXT_SEASON_EPISODE,
+                season=str(episode['season']),
+                episode=str(episode['episode']),
+            ))
     else:
         sort = SORT_EPISODE
-        FILTER_THIS_SEASON['value'] = str(episode['season'])
-        FILTER_NEXT_EPISODE['value'] = str(episode['episode'])
-        filters.append(FILTER_UPNEXT_EPISODE)
+        filters.append(build_filter(
+            FILTER_UPNEXT_EPISODE,
+            season=str(episode['season']),
+            episode=str(episode['episode']),
+        ))
 
     filters = {'and': filters}
 
@@ -908,12 +963,10 @@ def get_next_movie_from_library(movie=constants.UNDEFINED,
         return None
 
     (path, filename) = os.path.split(movie['file'])
-    FILTER_NOT_FILE['value'] = filename
-    FILTER_NOT_PATH['value'] = path
-    filters = [FILTER_NOT_FILEPATH]
-
-    FILTER_SET['value'] = set_name
-    filters.append(FILTER_SET)
+    filters = [
+        build_filter(FILTER_NOT_FILEPATH, filename=filename, path=path),
+        build_filter(FILTER_SET, set_name=set_name),
+    ]
 
     if unwatched_only:
         filters.append(FILTER_UNWATCHED)
@@ -922,8 +975,7 @@ def get_next_movie_from_library(movie=constants.UNDEFINED,
         sort = SORT_RANDOM
     else:
         sort = SORT_YEAR
-        FILTER_NEXT_MOVIE['value'] = str(movie['year'])
-        filters.append(FILTER_NEXT_MOVIE)
+        filters.append(build_filter(FILTER_NEXT_MOVIE, year=str(movie['year'])))
 
     filters = {'and': filters}
 
@@ -978,11 +1030,12 @@ def get_from_library(db_type=None, db_id=constants.UNDEFINED, item=None):
 def get_tvshowid(title):
     """Function to search Kodi library for tshowid by title"""
 
-    FILTER_TITLE['value'] = title
-    tvshow, _ = get_videos_from_library(db_type='tvshows',
-                                        limit=1,
-                                        properties=[],
-                                        filters=FILTER_TITLE)
+    tvshow, _ = get_videos_from_library(
+        db_type='tvshows',
+        limit=1,
+        properties=[],
+        filters=build_filter(FILTER_TITLE, title=title),
+    )
 
     if not tvshow:
         log('showtitle "{0}" not found in library'.format(title),
@@ -998,13 +1051,14 @@ def get_episode_info(tvshowid, season, episode):
     """Function to search Kodi library for episode info by tvshowid, season, and
        episode number"""
 
-    FILTER_THIS_SEASON['value'] = str(season)
-    FILTER_THIS_EPISODE['value'] = str(episode)
-
-    result, _ = get_videos_from_library(db_type='episodes',
-                                        limit=1,
-                                        filters=FILTER_EPISODE,
-                                        params={'tvshowid': tvshowid})
+    result, _ = get_videos_from_library(
+        db_type='episodes',
+        limit=1,
+        filters=build_filter(
+            FILTER_EPISODE, season=str(season), episode=str(episode)
+        ),
+        params={'tvshowid': tvshowid},
+    )
 
     if not result:
         log('Info for tvshowid {0} S{1}E{2} not found in library'.format(
@@ -1029,6 +1083,37 @@ def get_details_from_library(db_type=None,
         db_type = item['type']
         db_id = item['id']
 
+    request, detail_type = _get_details_request(db_type, db_id, properties)
+    if not request:
+        return None, None
+
+    result = utils.jsonrpc(**request)
+    return _get_details_result(result, request, detail_type), detail_type
+
+
+def get_details_batch_from_library(items, properties=None):
+    """Function to retrieve video info details of multiple videos, as a list
+    of (db_type, db_id) tuples, from Kodi library using a single JSONRPC call.
+    Returns a list of details in the same order, empty if not found"""
+
+    requests = [
+        _get_details_request(db_type, db_id, properties)
+        for db_type, db_id in items
+    ]
+    responses = iter(_jsonrpc_batch([
+        request for request, _ in requests if request
+    ]))
+    return [
+        _get_details_result(next(responses), request, detail_type)
+        if request else {}
+        for request, detail_type in requests
+    ]
+
+
+def _get_details_request(db_type, db_id, properties=None):
+    """Returns JSONRPC request to retrieve video info details from Kodi
+    library, and the detail type of the video, or (None, None)"""
+
     if not db_type or db_id == constants.UNDEFINED:
         return None, None
 
@@ -1043,14 +1128,20 @@ def get_details_from_library(db_type=None,
     elif isinstance(properties, (set, frozenset)):
         properties = detail_type['properties'] | properties
 
-    result = utils.jsonrpc(method=detail_type['get_method'],
-                           params={detail_type['id_name']: db_id,
-                                   'properties': properties})
+    request = {
+        'method': detail_type['get_method'],
+        'params': {detail_type['id_name']: db_id, 'properties': properties},
+    }
+    return request, detail_type
+
+
+def _get_details_result(response, request, detail_type):
+    """Returns video info details from JSONRPC response to request"""
 
-    result = result.get('result', {}).get(detail_type['result'], {})
-    if result and properties:
+    result = response.get('result', {}).get(detail_type['result'], {})
+    if result and request['params']['properties']:
         map_properties(result, mapping=detail_type['mapping'])
-    return result, detail_type
+    return result
 
 
 def handle_just_watched(item, reset_playcount=False, resume_from_end=0.1):
@@ -1155,45 +1246,76 @@ def get_upnext_episodes_from_library(limit=25,
                                         filter_by='tvshowid',
                                         exclude=tvshow_index)
 
-        for episode in episodes:
-            tvshowid = episode['tvshowid']
+        # Lookup next-up episodes in batches of the number of episodes still
+        # required, using one JSONRPC call for all next episodes in a batch
+        # and one call for details of all their tvshows
+        while episodes and len(upnext_episodes) < limit:
+            batch_size = limit - len(upnext_episodes)
+            batch, episodes = episodes[:batch_size], episodes[batch_size:]
+
+            requests = []
+            for episode in batch:
+                resume = episode['resume']
+                if 0 < resume['position'] < (1 - resume_from_end) * resume['total']:
+                    requests.append(None)
+                    continue
 
-            resume = episode['resume']
-            if 0 < resume['position'] < (1 - resume_from_end) * resume['total']:
-                upnext_episode = episode
-            else:
-                FILTER_THIS_SEASON['value'] = str(episode['season'])
-                FILTER_NEXT_EPISODE['value'] = str(episode['episode'])
                 aired = utils.iso_datetime(episode['firstaired'])
-                FILTER_AIRED['value'] = aired.split()[0]
-                FILTER_NEXT_AIRED['value'] = aired
-
-                upnext_episode, _ = get_videos_from_library(
+                request, detail_type = _get_videos_request(
                     db_type='episodes',
                     limit=1,
                     sort=sort,
-                    filters=filters[2],
-                    params={'tvshowid': tvshowid},
+                    filters=build_filter(
+                        filters[2],
+                        season=str(episode['season']),
+                        episode=str(episode['episode']),
+                        aired_date=aired.split()[0],
+                        aired=aired,
+                    ),
+                    params={'tvshowid': episode['tvshowid']},
                 )
+                requests.append(request)
+            responses = iter(_jsonrpc_batch(
+                [request for request in requests if request]
+            ))
+
+            batch_episodes = []
+            for episode, request in zip(batch, requests):
+                tvshow_index.add(episode['tvshowid'])
+
+                if request:
+                    upnext_episode = _get_videos_result(
+                        next(responses), request, detail_type, limit=1
+                    )
+                    if not upnext_episode:
+                        continue
+                else:
+                    upnext_episode = episode
 
-                if not upnext_episode:
-                    tvshow_index.add(tvshowid)
-                    continue
+                # Restore current episode lastplayed for sorting of next-up
+                # episode
+                upnext_episode['lastplayed'] = episode['lastplayed']
+                art_fallbacks(upnext_episode, EPISODE_ART_MAP)
+                batch_episodes.append(upnext_episode)
 
-            # Restore current episode lastplayed for sorting of next-up episode
-            upnext_episode['lastplayed'] = episode['lastplayed']
-            art_fallbacks(upnext_episode, EPISODE_ART_MAP)
             # Combine tvshow details with episode details
-            tvshow_details, _ = get_details_from_library(
-                db_type='tvshow', db_id=tvshowid,
-            )
-            tvshow_details.update(upnext_episode)
-            upnext_episodes.append(tvshow_details)
-            tvshow_index.add(tvshowid)
+            requests = [
+                _get_details_request(
+                    db_type='tvshow', db_id=upnext_episode['tvshowid']
+                )
+                for upnext_episode in batch_episodes
+            ]
+            responses = _jsonrpc_batch([request for request, _ in requests])
+            for upnext_episode, (request, detail_type), response in zip(
+                    batch_episodes, requests, responses
+            ):
+                tvshow_details = _get_details_result(
+                    response, request, detail_type
+                )
+                tvshow_details.update(upnext_episode)
+                upnext_episodes.append(tvshow_details)
 
-            if len(upnext_episodes) >= limit:
-                break
-        else:
+        if len(upnext_episodes) < limit:
             chunk_continue = False
 
             if chunk_size:
@@ -1256,13 +1378,14 @@ def get_upnext_movies_from_library(limit=25,
         if 0 < resume['position'] < (1 - resume_from_end) * resume['total']:
             upnext_movie = movie
         elif movie_sets and movie['set'] and set_id != constants.UNDEFINED:
-            FILTER_SET['value'] = movie['set']
-            FILTER_NEXT_MOVIE['value'] = str(movie['year'])
-
-            upnext_movie, _ = get_videos_from_library(db_type='movies',
-                                                      limit=1,
-                                                      sort=SORT_YEAR,
-                                                      filters=filters)
+            upnext_movie, _ = get_videos_from_library(
+                db_type='movies',
+                limit=1,
+                sort=SORT_YEAR,
+                filters=build_filter(
+                    filters, set_name=movie['set'], year=str(movie['year'])
+                ),
+            )
 
             if not upnext_movie:
                 set_index.add(set_id)
@@ -1288,9 +1411,28 @@ def get_videos_from_library(db_type,
                             params=None):
     """Function to get videos from Kodi library"""
 
+    request, detail_type = _get_videos_request(db_type, limit, sort,
+                                               properties, filters, params)
+    if not request:
+        return None
+
+    videos = utils.jsonrpc(**request)
+    return _get_videos_result(videos, request, detail_type, limit), detail_type
+
+
+# pylint: disable=too-many-arguments, too-many-positional-arguments
+def _get_videos_request(db_type,
+                        limit=25,
+                        sort=None,
+                        properties=None,
+                        filters=None,
+                        params=None):
+    """Returns JSONRPC request to get videos from Kodi library, and the detail
+    type of the videos, or (None, None)"""
+
     detail_type = JSON_MAP.get(db_type)
     if not detail_type:
-        return None
+        return None, None
 
     _params = {}
 
@@ -1306,8 +1448,7 @@ def get_videos_from_library(db_type,
     if isinstance(limit, dict):
         _params['limits'] = limit
     elif limit is not None:
-        QUERY_LIMITS['end'] = limit
-        _params['limits'] = QUERY_LIMITS
+        _params['limits'] = {'start': 0, 'end': limit}
 
     if sort is not None:
         _params['sort'] = sort
@@ -1315,16 +1456,207 @@ def get_videos_from_library(db_type,
     if params is not None:
         _params.update(params)
 
-    videos = utils.jsonrpc(method=detail_type['get_method'],
-                           params=_params)
-    videos = videos.get('result', {}).get(detail_type['result'], [])
+    return {'method': detail_type['get_method'], 'params': _params}, detail_type
+
+
+def _get_videos_result(response, request, detail_type, limit=25):
+    """Returns videos, or a single video if limit is 1, from JSONRPC response
+    to request"""
+
+    videos = response.get('result', {}).get(detail_type['result'], [])
 
     if videos and limit == 1:
         video = videos[0]
-        if properties:
+        if request['params']['properties']:
             map_properties(video, mapping=detail_type['mapping'])
-        return video, detail_type
-    return videos, detail_type
+        return video
+    return videos
+
+
+def _jsonrpc_batch(requests):
+    """Send requests as a single batched JSONRPC call, and return responses in
+    the same order as requests"""
+
+    if not requests:
+        return []
+
+    responses = utils.jsonrpc(batch=requests)
+    # Error response if the whole batch is invalid
+    if not isinstance(responses, list):
+        responses = [responses] if responses else []
+    responses = {response.get('id'): response for response in responses}
+    return [responses.get(request_id, {})
+            for request_id in range(len(requests))]
+
+
+def _similar_index_entry(db_id, video):
+    """Returns tuple of db_id, playcount, rating and tokens of video, as stored
+    in the similar videos index"""
+
+    return (
+        db_id,
+        utils.get_int(video, 'playcount', 0),
+        utils.get_float(video, 'rating', 0),
+        InfoTagComparator.get_tokens(video),
+    )
+
+
+def _add_similar_index_pages(index, db_type, db_ids, id_name, stop=None):
+    """Index videos by db_id, from details of all library videos requested in
+    pages, each stored in a separate transaction. Stops early if stop returns
+    True. Returns whether all pages were stored"""
+
+    db_ids = set(db_ids)
+    page_size = constants.SIMILAR_INDEX_PAGE_SIZE
+    start = 0
+    while not utils.abort_requested() and not (stop and stop()):
+        videos, _ = get_videos_from_library(
+            db_type=db_type,
+            limit={'start': start, 'end': start + page_size},
+            properties=SIMILAR_INDEX_PROPERTIES[db_type],
+        )
+        if not index.save(
+                db_type,
+                added=[
+                    _similar_index_entry(video[id_name], video)
+                    for video in videos if video[id_name] in db_ids
+                ],
+                synced=False,
+        ):
+            return False
+        if len(videos) < page_size:
+            return True
+        start += page_size
+    return False
+
+
+def update_similar_index(db_type, updates=None, sync=False, stop=None):
+    """Apply changes of library videos, as a dict of new playcount, or None if
+    other details changed, keyed by db_id, to the similar videos index. Also
+    adds new videos to, and removes deleted videos from, the index if sync is
+    True or if not checked within SIMILAR_INDEX_SYNC_PERIOD. Requesting
+    details of all videos is slow, so should only be run by the service, and
+    is stopped if stop returns True. Videos already indexed are kept and the
+    index is updated again on the next sync. Returns whether the index was
+    updated"""
+
+    index = similar_index.SimilarIndex()
+    stored = index.get_videos(
+        db_type, period=0 if sync else constants.SIMILAR_INDEX_SYNC_PERIOD
+    )
+    if stored is None:
+        return False
+
+    detail_type = JSON_MAP[db_type]
+    id_name = JSON_MAP[detail_type['mapping']['type']]['id_name']
+    updates = updates or {}
+
+    # Index is up to date, only apply notified changes
+    if stored is False:
+        changed = [
+            db_id for db_id, playcount in updates.items() if playcount is None
+        ]
+        updated = [
+            (db_id, playcount, None)
+            for db_id, playcount in updates.items() if playcount is not None
+        ]
+        removed = []
+    else:
+        videos, _ = get_videos_from_library(
+            db_type=db_type,
+            limit=None,
+            properties=['playcount', 'rating'],
+        )
+        current = {
+            video[id_name]: (
+                utils.get_int(video, 'playcount', 0),
+                utils.get_float(video, 'rating', 0),
+            )
+            for video in videos
+        }
+        changed = [
+            db_id for db_id in current
+            if db_id not in stored or updates.get(db_id, 0) is None
+        ]
+        updated = [
+            (db_id, ) + values
+            for db_id, values in current.items()
+            if db_id in stored and stored[db_id] != values
+        ]
+        removed = [db_id for db_id in stored if db_id not in current]
+
+    # Request details of all videos in pages, e.g. when the index is first
+    # built, rather than requesting details of each changed video
+    if len(changed) > constants.SIMILAR_INDEX_MAX_DETAILS:
+        if not _add_similar_index_pages(index, db_type, changed, id_name,
+                                        stop=stop):
+            return False
+        added = []
+    else:
+        videos = get_details_batch_from_library(
+            [(db_type, db_id) for db_id in changed],
+            properties=SIMILAR_INDEX_PROPERTIES[db_type],
+        )
+        added = [
+            _similar_index_entry(db_id, video)
+            for db_id, video in zip(changed, videos) if video
+        ]
+        removed += [
+            db_id for db_id, video in zip(changed, videos) if not video
+        ]
+
+    return index.save(
+        db_type,
+        added=added,
+        updated=updated,
+        removed=removed,
+        synced=stored is not False,
+    )
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def _search_similar_index(db_type, infotags, limit, unwatched_only=False,
+                          use_cast=False, exclude=()):
+    """Returns list of (similarity, rating, db_id) tuples of the limit most
+    similar videos, found using posting lists of the similar videos index, or
+    None if the index can not be used"""
+
+    # Index is built and kept up to date by the service, and can not be used
+    # until all videos have been indexed
+    index = similar_index.SimilarIndex()
+
+    # Cast of indexed videos is only compared if cast of the original video
+    # was requested
+    candidates = index.search(
+        db_type,
+        (infotags.genres,
+         infotags.cast_crew if use_cast else (),
+         infotags.cast_crew,
+         infotags.fuzz,
+         infotags.set_name,
+         infotags.tags),
+        unwatched_only=unwatched_only,
+    )
+    if candidates is None:
+        return None
+
+    scored = []
+    for db_id, rating, matches, sizes in candidates:
+        if db_id in exclude:
+            continue
+        genres, cast, crew, fuzz, set_name, tags = matches
+        similarity = infotags.score(
+            (genres, cast + crew, fuzz, set_name, tags),
+            (sizes[0],
+             (sizes[1] if use_cast else 0) + sizes[2],
+             sizes[3],
+             sizes[4],
+             sizes[5]),
+        )
+        if similarity:
+            scored.append((similarity, rating, db_id))
+
+    return nlargest(limit, scored)
 
 
 class InfoTagComparator(object):
@@ -1387,22 +1719,16 @@ class InfoTagComparator(object):
     del re_compile
 
     def __init__(self, infotags, limit=constants.UNDEFINED,
-                 cast_limit=constants.CAST_LIMIT,
-                 _get=dict.get,
-                 _set=set):
-
-        self.cast_crew = (
-                {cast['name']
-                 for cast in _get(infotags, 'cast', [])
-                 if cast['order'] <= cast_limit}
-                | _set(_get(infotags, 'director', []))
-                | _set(_get(infotags, 'writer', []))
+                 cast_limit=constants.CAST_LIMIT):
+
+        genres, cast, crew, fuzz, set_name, tags = self.get_tokens(
+            infotags, cast_limit
         )
-        self.fuzz = self.tokenise([_get(infotags, 'plot'),
-                                   _get(infotags, 'title')])
-        self.genres = _set(_get(infotags, 'genre', []))
-        self.set_name = self.tokenise([_get(infotags, 'set')])
-        self.tags = self.tokenise(_get(infotags, 'tag', []), split=False)
+        self.cast_crew = cast | crew
+        self.fuzz = fuzz
+        self.genres = genres
+        self.set_name = set_name
+        self.tags = tags
 
         self.count = dict.fromkeys(self.genres, 0)
         self.count['__len__'] = len(self.genres)
@@ -1417,90 +1743,111 @@ class InfoTagComparator(object):
             (self.K_TAGS + self.K_SET_NAME) / 5
         )
 
-    # pylint: disable=too-many-arguments, too-many-branches, too-many-locals
-    def compare(self,
-                infotags,
-                cast_limit=constants.CAST_LIMIT,
-                _get=dict.get,
-                _len=len,
-                _min=min,
-                _set=set):
-
-        cast_crew_stored = self.cast_crew
-        fuzz_stored = self.fuzz
-        genres_stored = self.genres
-        set_name_stored = self.set_name
-        tags_stored = self.tags
-        count = self.count
-        limit = self.limit
+    @classmethod
+    def get_tokens(cls, infotags,
+                   cast_limit=constants.CAST_LIMIT,
+                   _get=dict.get,
+                   _set=set):
+        """Returns tuple of genres, cast (excluding crew), crew, plot/title,
+           set name and tag token sets of infotags, in
+           similar_index.SimilarIndex.FIELDS order"""
+
+        crew = (_set(_get(infotags, 'director', []))
+                | _set(_get(infotags, 'writer', [])))
+        return (
+            _set(_get(infotags, 'genre', [])),
+            {cast['name']
+             for cast in _get(infotags, 'cast', [])
+             if cast['order'] <= cast_limit} - crew,
+            crew,
+            cls.tokenise([_get(infotags, 'plot'), _get(infotags, 'title')]),
+            cls.tokenise([_get(infotags, 'set')]),
+            cls.tokenise(_get(infotags, 'tag', []), split=False),
+        )
+
+    def score(self, matches, sizes, _min=min):
+        """Returns similarity from the number of genres, cast/crew, plot/title,
+           set name and tag tokens of a video, and the number of those that
+           match the stored tokens, or 0 if below the similarity threshold"""
+
+        genres, cast_crew, fuzz, set_name, tags = matches
+        genres_size, cast_crew_size, fuzz_size, set_name_size, tags_size = sizes
         threshold = self.threshold
 
-        genres = _set(_get(infotags, 'genre', []))
-        if not genres:
+        if not genres_size:
             return 0
 
         similarity = self.K_GENRES * (
-                _len(genres & genres_stored)
-                / _len(genres | genres_stored)
+                genres
+                / (genres_size + len(self.genres) - genres)
         )
 
-        if cast_crew_stored:
-            cast_crew = (
-                    {cast['name']
-                     for cast in _get(infotags, 'cast', [])
-                     if cast['order'] <= cast_limit}
-                    | _set(_get(infotags, 'director', []))
-                    | _set(_get(infotags, 'writer', []))
+        if self.cast_crew and cast_crew_size:
+            similarity += self.K_CAST_CREW * (
+                    cast_crew
+                    / (cast_crew_size + len(self.cast_crew) - cast_crew)
             )
-            if cast_crew:
-                similarity += self.K_CAST_CREW * (
-                        _len(cast_crew & cast_crew_stored)
-                        / _len(cast_crew | cast_crew_stored)
-                )
 
-        if fuzz_stored:
-            fuzz = self.tokenise([_get(infotags, 'plot'),
-                                  _get(infotags, 'title')])
-            if fuzz:
-                similarity += self.K_FUZZ * _min(1, (
-                        (2 * _len(fuzz & fuzz_stored)) ** 2
-                        / _len(fuzz | fuzz_stored)
-                ))
+        if self.fuzz and fuzz_size:
+            similarity += self.K_FUZZ * _min(1, (
+                    (2 * fuzz) ** 2
+                    / (fuzz_size + len(self.fuzz) - fuzz)
+            ))
 
-        if set_name_stored:
-            set_name = self.tokenise([_get(infotags, 'set')])
-            if set_name:
+        if self.set_name:
+            if set_name_size:
                 similarity += self.K_SET_NAME * (
-                        _len(set_name & set_name_stored)
-                        / _len(set_name | set_name_stored)
+                        set_name
+                        / (set_name_size + len(self.set_name) - set_name)
                 )
             else:
                 threshold -= self.K_SET_NAME / 5
 
-        if tags_stored:
-            tags = self.tokenise(_get(infotags, 'tag', []), split=False)
-            if tags:
+        if self.tags:
+            if tags_size:
                 similarity += self.K_TAGS * _min(1, (
-                        (2 * _len(tags & tags_stored)) ** 2
-                        / _len(tags | tags_stored)
+                        (2 * tags) ** 2
+                        / (tags_size + len(self.tags) - tags)
                 ))
             else:
                 threshold -= self.K_TAGS / 5
 
-        if similarity > threshold:
-            counted = False
-            for genre in genres:
-                if genre in count:
-                    count[genre] += 1
-                    count['__sum__'] += 1
-                    counted = True
-            if counted:
-                count['__num__'] += 1
-
-            if count['__sum__'] / count['__len__'] >= limit >= 0:
-                return None
-            return similarity if counted else 0
-        return 0
+        return similarity if similarity > threshold else 0
+
+    def compare(self, infotags, cast_limit=constants.CAST_LIMIT, _len=len):
+        genres, cast, crew, fuzz, set_name, tags = self.get_tokens(
+            infotags, cast_limit
+        )
+        cast_crew = cast | crew
+
+        similarity = self.score(
+            (_len(genres & self.genres),
+             _len(cast_crew & self.cast_crew),
+             _len(fuzz & self.fuzz),
+             _len(set_name & self.set_name),
+             _len(tags & self.tags)),
+            (_len(genres),
+             _len(cast_crew),
+             _len(fuzz),
+             _len(set_name),
+             _len(tags)),
+        )
+        if not similarity:
+            return 0
+
+        count = self.count
+        counted = False
+        for genre in genres:
+            if genre in count:
+                count[genre] += 1
+                count['__sum__'] += 1
+                counted = True
+        if counted:
+            count['__num__'] += 1
+
+        if count['__sum__'] / count['__len__'] >= self.limit >= 0:
+            return None
+        return similarity if counted else 0
 
     @staticmethod
     # pylint: disable-next=too-many-arguments, dangerous-default-value, too-many-positional-arguments
@@ -1590,11 +1937,12 @@ def get_similar_from_library(db_type,
         video_index.add(original[id_name])
 
     if infotags.set_name and db_type == 'movies':
-        FILTER_SET['value'] = original['set']
-        similar, _ = get_videos_from_library(db_type=db_type,
-                                             limit=None,
-                                             sort=SORT_YEAR,
-                                             filters=FILTER_SET)
+        similar, _ = get_videos_from_library(
+            db_type=db_type,
+            limit=None,
+            sort=SORT_YEAR,
+            filters=build_filter(FILTER_SET, set_name=original['set']),
+        )
         for video in similar:
             db_id = video[id_name]
             if db_id in video_index:
@@ -1607,14 +1955,36 @@ def get_similar_from_library(db_type,
     if not infotags.genres:
         return original, selected
 
+    similar = _search_similar_index(db_type=db_type,
+                                    infotags=infotags,
+                                    limit=limit,
+                                    unwatched_only=unwatched_only,
+                                    use_cast=use_cast,
+                                    exclude=video_index)
+    if similar is not None:
+        videos = get_details_batch_from_library(
+            [(db_type, db_id) for _, _, db_id in similar],
+            properties=properties,
+        )
+        for (similarity, _, _), video in zip(similar, videos):
+            if not video:
+                continue
+            art_fallbacks(video)
+            video['__similarity__'] = similarity
+            selected.append(video)
+        return original, selected if return_all else selected[:limit]
+
+    # Page through all videos with a matching genre if the index is unusable
     chunk_size = limit * 10
     chunk_limit = {
         'start': 0,
         'end': chunk_size,
     }
 
-    FILTER_GENRE['value'] = infotags.genres
-    unwatched_only = FILTER_UNWATCHED_GENRE if unwatched_only else FILTER_GENRE
+    unwatched_only = build_filter(
+        FILTER_UNWATCHED_GENRE if unwatched_only else FILTER_GENRE,
+        genres=infotags.genres,
+    )
     while True:
         similar, detail_type = get_videos_from_library(db_type=db_type,
                                                        limit=chunk_limit,
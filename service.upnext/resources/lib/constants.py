@@ -129,6 +129,50 @@ IDLE_STATE = {
     'active': 2,
 }
 
+DETECTOR_DB_FILENAME = 'hashes.db'
+DETECTOR_DB_MAX_GROUPS = 100
+# Minimum and maximum detector capture interval (in s)
+DETECTOR_CAPTURE_INTERVAL = 1
+DETECTOR_MAX_CAPTURE_INTERVAL = 4
+# Number of consecutive static frames before capture interval is doubled
+DETECTOR_STATIC_FRAMES = 5
+# Number of frames to process before changing capture resolution
+DETECTOR_RESIZE_FRAMES = 10
+# Fraction of capture interval that worker threads should be busy processing
+# frames. Capture resolution is reduced if the target can't be met at the max
+# capture interval, and increased if below the low threshold
+DETECTOR_TARGET_LOAD = 0.5
+DETECTOR_LOW_LOAD = 0.2
+
+SUBTITLE_CACHE_FILENAME = 'subtitles.db'
+SUBTITLE_CACHE_MAX_ENTRIES = 5000
+# Retry files where no subtitle end was found after 7 days (in s)
+SUBTITLE_CACHE_NEGATIVE_TTL = 7 * 24 * 60 * 60
+# Prefix of window properties used for subtitle end detection I/O statistics
+SUBTITLE_STATS_PROPERTY_NAME = 'UpNext.SubtitleStats'
+# Number of in-progress shows, and upcoming episodes per show, to pre-scan for
+# subtitle end times when idle
+SUBTITLE_PRESCAN_SHOWS = 25
+SUBTITLE_PRESCAN_EPISODES = 3
+# Minimum time between library pre-scans, and delay between files (in s)
+SUBTITLE_PRESCAN_PERIOD = 60 * 60
+SUBTITLE_PRESCAN_DELAY = 5
+
+# Maximum number of updated library items to refresh individually before the
+# whole library snapshot is reloaded instead
+LIBRARY_SNAPSHOT_MAX_UPDATES = 50
+
+SIMILAR_INDEX_FILENAME = 'similar.db'
+# Minimum time between checks for added/removed videos in the similar videos
+# index (in s), and maximum number of added/changed videos to request
+# individually rather than requesting all videos in pages of the given size
+SIMILAR_INDEX_SYNC_PERIOD = 15 * 60
+SIMILAR_INDEX_MAX_DETAILS = 100
+SIMILAR_INDEX_PAGE_SIZE = 250
+# Delay before applying changes from library notifications to the similar
+# videos index, to collect changes notified in quick succession (in s)
+SIMILAR_INDEX_UPDATE_DELAY = 5
+
 CAST_LIMIT = 5
 TOKEN_LENGTH = 3
 
@@ -4,9 +4,12 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import json
+import os
 import timeit
+from bisect import bisect_left, insort
 
 import constants
+import detector_db
 import file_utils
 import image_utils
 import utils
@@ -27,6 +30,79 @@ except ImportError:
     )
 
 
+try:
+    _popcount = int.bit_count
+except AttributeError:
+    def _popcount(val):
+        return bin(val).count('1')
+
+
+class UpNextHash(object):
+    """Class to represent an image hash as a pair of integer bitmasks. Pixels
+       that are set are stored in value, ignored pixels are stored in ignore.
+       First pixel of the hash is stored as the most significant bit"""
+
+    __slots__ = (
+        'value',
+        'ignore',
+        'blank',
+        'size',
+        'num_set',
+        'num_ignored',
+        'num_blank',
+    )
+
+    def __init__(self, value=0, ignore=0, size=0):
+        mask = (1 << size) - 1
+        self.ignore = ignore & mask
+        self.value = value & mask & ~self.ignore
+        self.blank = mask & ~(self.value | self.ignore)
+        self.size = size
+        self.num_set = _popcount(self.value)
+        self.num_ignored = _popcount(self.ignore)
+        self.num_blank = size - self.num_set - self.num_ignored
+
+    def __eq__(self, other):
+        if not isinstance(other, UpNextHash):
+            return NotImplemented
+        return (self.value == other.value
+                and self.ignore == other.ignore
+                and self.size == other.size)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    def __hash__(self):
+        return hash((self.value, self.ignore, self.size))
+
+    def __iter__(self):
+        for bit in range(self.size - 1, -1, -1):
+            bit = 1 << bit
+            yield 1 if self.value & bit else None if self.ignore & bit else 0
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_bits(cls, bits):
+        """Create hash from a sequence of 1 (set), 0 (blank) or None (ignored)
+           pixel values"""
+
+        value = 0
+        ignore = 0
+        for bit_val in bits:
+            value <<= 1
+            ignore <<= 1
+            if bit_val is None:
+                ignore |= 1
+            elif bit_val:
+                value |= 1
+        return cls(value, ignore, len(bits))
+
+
 class UpNextHashStore(object):
     """Class to store/save/load hashes used by UpNextDetector"""
 
@@ -36,36 +112,97 @@ class UpNextHashStore(object):
         'group_name',
         'group_idx',
         'data',
-        'timestamps'
+        'timestamps',
+        '_index',
+        '_pending',
     )
 
+    # Version of hash records stored in the hash database
+    VERSION = 0.3
+
     def __init__(self, **kwargs):
-        self.version = kwargs.get('version', 0.2)
+        self.version = kwargs.get('version', self.VERSION)
         self.hash_size = kwargs.get('hash_size', (8, 8))
         item = kwargs.get('item', {})
         self.group_name = item.get('group_name', '')
         self.group_idx = item.get('group_idx') or constants.UNDEFINED
-        self.data = kwargs.get('data', {})
+        self.data = {}
+        self._index = {}
+        self._pending = set()
+        self.update(kwargs.get('data', {}))
         self.timestamps = kwargs.get('timestamps', {self.group_idx: None})
 
     @staticmethod
     def int_to_hash(val, hash_size):
-        return tuple([  # pylint: disable=consider-using-generator
-            1 if bit_val == "1" else 0
-            for bit_val in bin(val)[2:].zfill(hash_size)
-        ])
+        return UpNextHash(val, size=hash_size)
 
     @staticmethod
     def hash_to_int(image_hash):
-        return sum(
-            (bit_val or 0) << i
-            for i, bit_val in enumerate(reversed(image_hash))
-        )
+        return image_hash.value
+
+    @staticmethod
+    def hash_to_bytes(image_hash, hash_size):
+        return image_hash.value.to_bytes((hash_size + 7) // 8, 'big')
+
+    @staticmethod
+    def bytes_to_hash(val, hash_size):
+        return UpNextHash(int.from_bytes(val, 'big'), size=hash_size)
+
+    @staticmethod
+    def _range(index, min_time, max_time,
+               _bisect=bisect_left, _int=int):
+        """Get hash indexes from a sorted list of (time, hash_index) entries
+           where time is between min_time and max_time, inclusive"""
+
+        return index[
+            _bisect(index, (min_time,)):_bisect(index, (_int(max_time) + 1,))
+        ]
 
     @classmethod
     def log(cls, msg, level=utils.LOGDEBUG):
         utils.log(msg, name=cls.__name__, level=level)
 
+    def _clear(self):
+        self.data = {}
+        self._index = {}
+        self._pending = set()
+
+    def _from_records(self, version, hash_size, records, timestamps):
+        """Replace stored data with hash records of (time_to_end,
+           time_from_start, group_idx, packed_hash)"""
+
+        self.version = version
+        self.hash_size = hash_size
+        num_bits = hash_size[0] * hash_size[1]
+
+        self._clear()
+        self.update({
+            tuple(record[:3]): self.bytes_to_hash(record[3], num_bits)
+            for record in records
+        })
+        self._pending.clear()
+        self.timestamps = timestamps
+
+    def add(self, hash_index, image_hash, _insort=insort):
+        """Store a hash and add its hash index to the sorted time indexes of
+           the episode that it was captured from"""
+
+        if hash_index not in self.data:
+            end_time, start_time, episode = hash_index
+            index = self._index.get(episode)
+            if index is None:
+                index = self._index.setdefault(episode, ([], []))
+            # Index by time from start of file and by time to end of file
+            _insort(index[0], (start_time, hash_index))
+            _insort(index[1], (end_time, hash_index))
+
+        self.data[hash_index] = image_hash
+        self._pending.add(hash_index)
+
+    def update(self, data):
+        for hash_index, image_hash in data.items():
+            self.add(hash_index, image_hash)
+
     def is_valid(self, item=None, for_saving=False):
         if item:
             group_name = item.get('group_name')
@@ -97,10 +234,7 @@ class UpNextHashStore(object):
         self.group_name = ''
         self.group_idx = constants.UNDEFINED
 
-    def load(self, identifier):
-        target = file_utils.get_legal_filename(
-            identifier, prefix=SETTINGS.detector_save_path, suffix='.json'
-        )
+    def _load_legacy(self, target):
         try:
             with open(target, mode='r', encoding='utf-8') as target_file:
                 hashes = json.load(target_file)
@@ -115,12 +249,13 @@ class UpNextHashStore(object):
         self.hash_size = hashes.get('hash_size', self.hash_size)
         if 'data' in hashes:
             hash_size = self.hash_size[0] * self.hash_size[1]
-            self.data = {
+            self._clear()
+            self.update({
                 # pylint: disable-next=consider-using-generator
                 tuple([utils.get_int(i) for i in key[1:-1].split(', ')]):
                     self.int_to_hash(hashes['data'][key], hash_size)
                 for key in hashes['data']
-            }
+            })
         if 'timestamps' in hashes:
             self.timestamps = {
                 utils.get_int(group_idx):
@@ -132,29 +267,56 @@ class UpNextHashStore(object):
         self.log('Hashes loaded from {0}'.format(target))
         return True
 
-    def save(self, identifier):
-        output = {
-            'version': self.version,
-            'hash_size': self.hash_size,
-            'data': {
-                str(hash_index): self.hash_to_int(self.data[hash_index])
-                for hash_index in self.data
-                if hash_index[-1] != constants.UNDEFINED
-            },
-            'timestamps': self.timestamps
-        }
+    def load(self, identifier):
+        stored = detector_db.UpNextDetectorDB().load(identifier)
+        if stored:
+            self._from_records(*stored)
+            self.log('Hashes loaded for {0}'.format(identifier))
+            return True
 
+        # Migrate hashes stored in legacy per group JSON file
         target = file_utils.get_legal_filename(
             identifier, prefix=SETTINGS.detector_save_path, suffix='.json'
         )
-        try:
-            with open(target, mode='w', encoding='utf-8') as target_file:
-                json.dump(output, target_file, indent=4)
-                self.log('Hashes saved to {0}'.format(target))
-        except (IOError, OSError, TypeError, ValueError):
-            self.log('Could not save hashes to {0}'.format(target),
-                     utils.LOGWARNING)
-        return output
+        if not os.path.exists(target) or not self._load_legacy(target):
+            self.log('No stored hashes found for {0}'.format(identifier))
+            return False
+
+        # Store all loaded hashes in database
+        self._pending.update(self.data)
+        self.version = self.VERSION
+        if self.save(identifier):
+            try:
+                os.remove(target)
+                self.log('Migrated legacy hashes {0}'.format(target))
+            except (IOError, OSError):
+                pass
+        return True
+
+    def save(self, identifier):
+        """Store hashes added since last load/save, and all timestamps, in the
+           hash database"""
+
+        hash_size = self.hash_size[0] * self.hash_size[1]
+        pending = [
+            hash_index for hash_index in self._pending
+            if hash_index[-1] != constants.UNDEFINED
+        ]
+        saved = detector_db.UpNextDetectorDB().save(
+            identifier,
+            self.version,
+            self.hash_size,
+            [
+                hash_index + (
+                    self.hash_to_bytes(self.data[hash_index], hash_size),
+                )
+                for hash_index in pending
+            ],
+            self.timestamps
+        )
+        if saved:
+            self._pending.difference_update(pending)
+        return saved
 
     def window(self, hash_index,
                size=SETTINGS.detect_matches, all_episodes=False):
@@ -165,29 +327,140 @@ class UpNextHashStore(object):
         end_time, start_time, episode = hash_index
 
         if all_episodes:
-            excluded_episodes = [constants.UNDEFINED]
-            selected_episodes = self.timestamps.keys()
+            excluded_episodes = {constants.UNDEFINED}
+            selected_episodes = set(self.timestamps.keys())
         else:
-            excluded_episodes = [constants.UNDEFINED, episode]
+            excluded_episodes = {constants.UNDEFINED, episode}
             selected_episodes = {min(self.timestamps), max(self.timestamps)}
 
-        # Matching time period from start of file
-        min_start_time = start_time - size
-        max_start_time = start_time + size
-        # Matching time period from end of file
-        min_end_time = end_time - size
-        max_end_time = end_time + size
-
-        return {
-            hash_index: self.data[hash_index]
-            for hash_index in self.data
-            if (hash_index[2] in selected_episodes
-                and hash_index[2] not in excluded_episodes
-                and (
-                        min_start_time <= hash_index[1] <= max_start_time
-                        or min_end_time <= hash_index[0] <= max_end_time
+        output = {}
+        for selected_episode in selected_episodes - excluded_episodes:
+            index = self._index.get(selected_episode)
+            if not index:
+                continue
+
+            # Matching time period from start of file
+            for _, hash_index in self._range(
+                    index[0], start_time - size, start_time + size
+            ):
+                output[hash_index] = self.data[hash_index]
+            # Matching time period from end of file
+            for _, hash_index in self._range(
+                    index[1], end_time - size, end_time + size
+            ):
+                output[hash_index] = self.data[hash_index]
+
+        return output
+
+
+class UpNextCaptureScheduler(object):
+    """Class to adjust the capture interval and capture resolution used by
+       UpNextDetector, based on the time taken to process each frame, the
+       similarity between consecutive frames, and the number of match hits"""
+
+    __slots__ = (
+        'data_limit',
+        'interval',
+        'limit',
+        'workers',
+        '_cost',
+        '_frames',
+        '_lock',
+        '_static',
+    )
+
+    def __init__(self):
+        self._lock = utils.create_lock()
+        # Max capture data limit (in kB), reduced if captures fail
+        self.limit = SETTINGS.detector_data_limit
+        self.reset()
+
+    @classmethod
+    def log(cls, msg, level=utils.LOGDEBUG):
+        utils.log(msg, name=cls.__name__, level=level)
+
+    def _reset_cost(self):
+        # Processing time of each frame changes with capture resolution
+        self._cost = None
+        self._frames = 0
+
+    def reset(self):
+        with self._lock:
+            self.data_limit = self.limit
+            self.interval = constants.DETECTOR_CAPTURE_INTERVAL
+            # Frames are captured in one thread and processed in the others
+            self.workers = max(1, SETTINGS.detector_threads - 1)
+            self._static = 0
+            self._reset_cost()
+
+    def capture_failed(self):
+        """Method to reduce capture resolution if a capture failed or was
+           skipped. Returns new capture data limit (in kB)"""
+
+        with self._lock:
+            if self.limit >= 16:
+                self.limit -= 8
+            self.data_limit = min(self.data_limit, self.limit)
+            self._reset_cost()
+            return self.data_limit
+
+    def update(self, cost, similarity, hits):
+        """Method to update capture interval and resolution using the time
+           taken to process a frame (in s), the similarity of the frame to the
+           previous frame, and the current number of match hits"""
+
+        min_interval = constants.DETECTOR_CAPTURE_INTERVAL
+        max_interval = constants.DETECTOR_MAX_CAPTURE_INTERVAL
+
+        with self._lock:
+            # Moving average of frame processing time
+            self._cost = cost if self._cost is None else (
+                0.8 * self._cost + 0.2 * cost
+            )
+            self._frames += 1
+
+            # Back off while frames are static, unless credits may be playing
+            if hits or similarity < SETTINGS.detect_level:
+                self._static = 0
+            else:
+                self._static += 1
+            backoff = min(
+                self._static // constants.DETECTOR_STATIC_FRAMES,
+                int(max_interval / min_interval).bit_length() - 1
+            )
+
+            # Min interval at which workers can keep up with captured frames
+            required = self._cost / (self.workers
+                                     * constants.DETECTOR_TARGET_LOAD)
+            interval = min(
+                max(min_interval * (1 if hits else 2 ** backoff), required),
+                max_interval
+            )
+
+            # Reduce capture resolution if frames can't be processed at the
+            # min interval, or increase if there is enough headroom, but not
+            # while the match count is increasing
+            data_limit = self.data_limit
+            if hits or self._frames < constants.DETECTOR_RESIZE_FRAMES:
+                pass
+            elif required > min_interval:
+                data_limit = max(8, data_limit - 8)
+            elif required < min_interval * (constants.DETECTOR_LOW_LOAD
+                                            / constants.DETECTOR_TARGET_LOAD):
+                data_limit = min(data_limit + 8, self.limit)
+
+            if data_limit != self.data_limit:
+                self._reset_cost()
+                self.log('Capture data limit: {0}kB -> {1}kB'.format(
+                    self.data_limit, data_limit
                 ))
-        }
+                self.data_limit = data_limit
+
+            if interval != self.interval:
+                self.log('Capture interval: {0:.2f}s -> {1:.2f}s'.format(
+                    self.interval, interval
+                ))
+                self.interval = interval
 
 
 class UpNextDetector(object):
@@ -203,9 +476,10 @@ class UpNextDetector(object):
         'match_number',
         'mismatch_number',
         # Variables
-        'capture_interval',
         'hash_index',
         'match_counts',
+        'pipelines',
+        'scheduler',
         # Worker pool
         'queue',
         'workers',
@@ -226,16 +500,18 @@ class UpNextDetector(object):
 
         self._lock = utils.create_lock()
 
-        # Set minimum capture interval to decrease capture rate
-        self.capture_interval = 1
-        # Number of consecutive frame matches required for a positive detection
-        # Set to 5s of captured frames as default
-        self.match_number = int(
-            SETTINGS.detect_matches / self.capture_interval
+        # Adjusts capture interval and resolution to match processing load
+        self.scheduler = UpNextCaptureScheduler()
+        # Play time (in s) of consecutive frame matches required for a positive
+        # detection. Counted in play time rather than frames as the capture
+        # interval varies. Set to 5s as default
+        self.match_number = SETTINGS.detect_matches
+        # Play time (in s) of consecutive frame mismatches required to reset
+        # match count. Set to 3 frames at the min capture interval as default
+        # to account for bad frame capture
+        self.mismatch_number = (
+            SETTINGS.detect_mismatches * constants.DETECTOR_CAPTURE_INTERVAL
         )
-        # Number of consecutive frame mismatches required to reset match count
-        # Set to 3 frames as default to account for bad frame capture
-        self.mismatch_number = SETTINGS.detect_mismatches
         self.match_counts = {
             'hits': 0,
             'misses': 0,
@@ -245,29 +521,12 @@ class UpNextDetector(object):
         self.hashes = None
         self.past_hashes = None
         self.hash_index = None
+        self.pipelines = None
 
         self._running = utils.create_event()
         self._sigstop = utils.create_event()
         self._sigterm = utils.create_event()
 
-    @staticmethod
-    def _and(bit1, bit2):
-        return 1 if (bit1 and bit2) else 0
-
-    @staticmethod
-    def _eq_biased(bit1, bit2):
-        return (bit1 == bit2) * (1 if bit2 else 0.5)
-
-    @staticmethod
-    def _mul(bit1, bit2):
-        return bit1 * bit2
-
-    @staticmethod
-    def _xor(bit1, bit2):
-        # bit1 and bit2 are bools
-        # bit1 may be None
-        return 0 if bit1 is None or bit1 == bit2 else 1
-
     @staticmethod
     def _generate_initial_hash(hash_width, hash_height, **kwargs):
         blank_token = (0,)
@@ -284,7 +543,7 @@ class UpNextDetector(object):
         pad_width_alt = (pad_width_alt * hash_width // 16) - (hash_width // 16)
 
         # noinspection IncorrectFormatting
-        return (
+        return UpNextHash.from_bits(
             border_token * hash_width * pad_height
             + (
                 border_token
@@ -321,80 +580,42 @@ class UpNextDetector(object):
         )
 
     @staticmethod
-    def _generate_mask(image_hash):
-        fuzzy_value = None
-        masked_value = 0
+    def _create_hash(image, hash_size, pipeline):
+        image_hash = pipeline(image)
 
-        mask = len(image_hash) / image_hash.count(masked_value)
-        fuzzy_mask = 0.25
-        min_mask = 0.25
-
-        return tuple(
-            mask if bit == masked_value else
-            fuzzy_mask if bit == fuzzy_value else
-            min_mask
-            for bit in image_hash
-        )
+        return UpNextHash(image_hash, size=hash_size[0] * hash_size[1])
 
     @staticmethod
-    def _create_hash(image, hash_size, output_file=None):
-        image_hash = image_utils.process(
-            image,
-            queue=[
-                [image_utils.resize, hash_size],
-                [image_utils.points_of_interest],
-                [image_utils.export_data],
-            ],
-            save_file=output_file
-        )
+    def _create_images(image_data, pipelines):
+        image = pipelines['image'](image_data)
 
-        return image_hash
-
-    @classmethod
-    def _create_images(cls, image_data, image_size):
-        image = image_utils.process(
-            image_data,
-            queue=[
-                [image_utils.import_data, image_size, False],
-                [image_utils.resize, cls._get_video_capture_resolution()],
-                [image_utils.saturation],
-                [image_utils.auto_level, 5, 95, (0.33, None)],
-            ],
-            save_file='1_image'
-        )
-
-        filtered_image = image_utils.process(
-            image,
-            queue=[
-                [image_utils.posterise, 3],
-                [image_utils.adaptive_filter, (8, 1, True),
-                 image_utils.auto_level, (5, 95, (0.33, None))],
-                [image_utils.apply_filter,
-                 'UnsharpMask,20,400,64', 'TRIM'],
-                [image_utils.apply_filter,
-                 'RankFilter,5,50', 'TRIM', None, 'difference'],
-                [image_utils.detail_reduce, image, 50],
-                [image_utils.apply_filter,
-                 'GaussianBlur,5', 'TRIM', None, 'multiply'],
-                [image_utils.auto_threshold],
-            ],
-            save_file='2_filter'
+        filtered_image = pipelines['filter'](
+            image, inputs=(image, )
         ) if SETTINGS.detector_filter else image
 
         return image, filtered_image
 
-    @classmethod
-    def _hash_fuzz(cls, image_hash, masking_hash, factor=5):
-        weights = cls._generate_mask(masking_hash)
+    @staticmethod
+    def _hash_fuzz(image_hash, masking_hash, factor=5, _popcount=_popcount):
+        # Set pixels that are blank in the masking hash are weighted by the
+        # inverse of the proportion of blank pixels in the masking hash, all
+        # other set pixels are given a fixed minimum weighting
+        mask = masking_hash.size / masking_hash.num_blank
+        min_mask = 0.25
 
-        significant_bits = sum(map(cls._mul, image_hash, weights))
-        significance = 100 * significant_bits / len(image_hash)
+        masked_bits = _popcount(image_hash.value & masking_hash.blank)
+        significant_bits = (
+            mask * masked_bits
+            + min_mask * (image_hash.num_set - masked_bits)
+        )
+        significance = 100 * significant_bits / image_hash.size
         delta = significance - SETTINGS.detect_significance
 
         return factor * delta / SETTINGS.detect_significance
 
     @classmethod
-    def _hash_similarity(cls, baseline_hash, image_hash, filtered_hash=None):
+    def _hash_similarity(cls, baseline_hash, image_hash, filtered_hash=None,
+                         _popcount=_popcount):
         """Method to compare the similarity between image hashes"""
 
         # Check that hashes are not empty and that dimensions are equal
@@ -403,20 +624,29 @@ class UpNextDetector(object):
 
         compare_hash = filtered_hash or image_hash
 
-        num_pixels = len(baseline_hash)
-        if num_pixels != len(compare_hash):
+        num_pixels = baseline_hash.size
+        if num_pixels != compare_hash.size:
             return 0
 
-        # Check whether each pixel is equal
-        bits_eq = sum(map(cls._eq_biased, baseline_hash, compare_hash))
-        bits_xor = tuple(map(cls._xor, baseline_hash, compare_hash))
-        bits_xor_baseline = sum(map(cls._and, bits_xor, baseline_hash))
-        bits_xor_compare = sum(map(cls._and, bits_xor, compare_hash))
+        # Check whether each pixel is equal. Equal set pixels are given full
+        # weighting, equal blank or ignored pixels are given half weighting
+        bits_eq = _popcount(baseline_hash.value & compare_hash.value) + (
+            _popcount(baseline_hash.blank & compare_hash.blank)
+            + _popcount(baseline_hash.ignore & compare_hash.ignore)
+        ) / 2
+        # Pixels set in one hash but not in the other, excluding pixels that
+        # are ignored in the baseline hash
+        bits_xor_baseline = _popcount(
+            baseline_hash.value & ~compare_hash.value
+        )
+        bits_xor_compare = _popcount(
+            baseline_hash.blank & compare_hash.value
+        )
 
         weighted_total = (
                 num_pixels
-                - baseline_hash.count(None)
-                - (min(baseline_hash.count(0), compare_hash.count(0)) / 2)
+                - baseline_hash.num_ignored
+                - (min(baseline_hash.num_blank, compare_hash.num_blank) / 2)
         )
         bit_compare = bits_eq - bits_xor_baseline - bits_xor_compare
 
@@ -451,6 +681,64 @@ class UpNextDetector(object):
 
         return width, height
 
+    def _get_pipelines(self, image_size):
+        """Method to return image processing pipelines, compiled for the
+           current capture size and hash size"""
+
+        hash_size = tuple(self.hashes.hash_size)
+        key = (tuple(image_size), hash_size)
+        pipelines = self.pipelines
+        if pipelines and pipelines[0] == key:
+            return pipelines[1]
+
+        pipelines = {
+            'image': image_utils.Pipeline(
+                queue=[
+                    [image_utils.import_data, image_size, False],
+                    [image_utils.resize,
+                     self._get_video_capture_resolution()],
+                    [image_utils.saturation],
+                    [image_utils.auto_level, 5, 95, (0.33, None)],
+                ],
+                save_file='1_image'
+            ),
+            'filter': image_utils.Pipeline(
+                queue=[
+                    [image_utils.posterise, 3],
+                    [image_utils.adaptive_filter, (8, 1, True),
+                     image_utils.auto_level, (5, 95, (0.33, None))],
+                    [image_utils.apply_filter,
+                     'UnsharpMask,20,400,64', 'TRIM'],
+                    [image_utils.apply_filter,
+                     'RankFilter,5,50', 'TRIM', None, 'difference'],
+                    [image_utils.detail_reduce, image_utils.image_input(0),
+                     50],
+                    [image_utils.apply_filter,
+                     'GaussianBlur,5', 'TRIM', None, 'multiply'],
+                    [image_utils.auto_threshold],
+                ],
+                save_file='2_filter'
+            ),
+            'expanded': image_utils.Pipeline(
+                queue=[
+                    [image_utils.entropy_compare, image_utils.image_input(0),
+                     1.10]
+                ],
+                save_file='3_expanded'
+            ),
+            'hash': image_utils.Pipeline(
+                queue=[
+                    [image_utils.resize, hash_size],
+                    [image_utils.points_of_interest],
+                    [image_utils.export_data],
+                ]
+            ),
+        }
+        # Only keep pipelines for the current capture size. Pipelines may be
+        # compiled concurrently by different workers, last one is kept
+        self.pipelines = (key, pipelines)
+        return pipelines
+
     @classmethod
     def _print_hashes(cls, hashes, size, prefix=''):
         """Method to print image hashes, side by side, to the Kodi log"""
@@ -462,8 +750,9 @@ class UpNextDetector(object):
         row_length = size[0]
 
         hashes = [image_hash if image_hash and len(image_hash) == num_bits
-                  else (0,) * num_bits
+                  else UpNextHash(size=num_bits)
                   for image_hash in hashes]
+        pixels = [tuple(image_hash) for image_hash in hashes]
 
         cls.log('\n\t\t\t'.join(
             [
@@ -481,9 +770,9 @@ class UpNextDetector(object):
                     '|'.join([
                         ' '.join([
                             '+' if bit else '-' if bit is None else ' '
-                            for bit in image_hash[row:row + row_length]
+                            for bit in image_pixels[row:row + row_length]
                         ])
-                        for image_hash in hashes
+                        for image_pixels in pixels
                     ])
                 ) for row in range(0, num_bits, row_length)
             ]
@@ -493,7 +782,8 @@ class UpNextDetector(object):
     def log(cls, msg, level=utils.LOGDEBUG):
         utils.log(msg, name=cls.__name__, level=level)
 
-    def _evaluate_similarity(self, image, filtered_image, hash_size):
+    def _evaluate_similarity(self, image, filtered_image, pipelines,
+                             current_index=None):
         stats = {
             # Similarity to representative end credits hash
             'credits': constants.UNDEFINED,
@@ -505,20 +795,22 @@ class UpNextDetector(object):
             'episodes': constants.UNDEFINED
         }
 
-        possible_credits, expanded_image = image_utils.process(
-            image,
-            queue=[
-                [image_utils.entropy_compare, filtered_image, 1.10]
-            ],
-            save_file='3_expanded'
+        possible_credits, expanded_image = pipelines['expanded'](
+            image, inputs=(filtered_image, )
         )
 
-        image_hash = self._create_hash(image, hash_size)
-        filtered_hash = self._create_hash(filtered_image, hash_size)
+        hash_size = self.hashes.hash_size
+        hash_pipeline = pipelines['hash']
+        image_hash = self._create_hash(image, hash_size, hash_pipeline)
+        filtered_hash = self._create_hash(
+            filtered_image, hash_size, hash_pipeline
+        )
         expanded_hash = None
 
         if possible_credits:
-            expanded_hash = self._create_hash(expanded_image, hash_size)
+            expanded_hash = self._create_hash(
+                expanded_image, hash_size, hash_pipeline
+            )
 
             # Calculate similarity between current hash and representative hash
             stats['credits'] = max(self._hash_similarity(
@@ -545,7 +837,7 @@ class UpNextDetector(object):
         # Match if current hash matches representative hash or if current hash
         # is blank
         is_match = (
-                not any(image_hash)
+                not image_hash.value
                 or stats['credits'] >= SETTINGS.detect_level
         )
         # Unless debugging, return if match found, otherwise continue checking
@@ -573,7 +865,9 @@ class UpNextDetector(object):
             self._hash_match_hit()
             return stats, (image_hash, filtered_hash, expanded_hash)
 
-        old_hashes = self.past_hashes.window(self.hash_index['current'])
+        old_hashes = self.past_hashes.window(
+            current_index or self.hash_index['current']
+        )
         for self.hash_index['episodes'], old_hash in old_hashes.items():
             stats['episodes'] = self._hash_similarity(
                 old_hash,
@@ -594,16 +888,19 @@ class UpNextDetector(object):
         return stats, (image_hash, filtered_hash, expanded_hash)
 
     def _hash_match_hit(self):
+        # Each frame accounts for the play time since the previous capture
+        interval = self.scheduler.interval
         with self._lock:
-            self.match_counts['hits'] += 1
+            self.match_counts['hits'] += interval
             self.match_counts['misses'] = 0
             self.match_counts['detected'] = self.match_counts['detected'] or (
                     self.match_counts['hits'] >= self.match_number
             )
 
     def _hash_match_miss(self):
+        interval = self.scheduler.interval
         with self._lock:
-            self.match_counts['misses'] += 1
+            self.match_counts['misses'] += interval
             if self.match_counts['misses'] < self.mismatch_number:
                 return
         self._hash_match_reset()
@@ -615,6 +912,8 @@ class UpNextDetector(object):
             self.match_counts['detected'] = False
 
     def _init_hashes(self):
+        # Pipelines will be recompiled for the new video resolution
+        self.pipelines = None
         self.hash_index = {
             # Hash indexes are tuples containing the following data:
             # (time_to_end, time_from_start, group_idx)
@@ -688,9 +987,11 @@ class UpNextDetector(object):
 
     def _queue_push(self, queue=None):
         queue = queue or self.queue
+        scheduler = self.scheduler
         try:
             capturer, size = self._queue_pull(queue)
             capturer.capture(*size)
+            data_limit = scheduler.data_limit
             abort = False
         except TypeError:
             abort = True
@@ -711,28 +1012,30 @@ class UpNextDetector(object):
             # Capture failed or was skipped, retry with less data
             if not image_data or image_data[-1] != 255:
                 self.log('Capture failed using {0}kB data limit'.format(
-                    SETTINGS.detector_data_limit
+                    data_limit
                 ), utils.LOGWARNING)
-                if SETTINGS.detector_data_limit >= 16:
-                    SETTINGS.detector_data_limit -= 8
+                scheduler.capture_failed()
 
                 image_data = None
-                size = self._get_video_capture_resolution(
-                    max_size=SETTINGS.detector_data_limit
-                )
-
                 del capturer
                 capturer = xbmc.RenderCapture()
 
+            # Capture resolution is changed by the scheduler if frames are
+            # taking too long to process, or if a capture failed
+            if scheduler.data_limit != data_limit:
+                data_limit = scheduler.data_limit
+                size = self._get_video_capture_resolution(max_size=data_limit)
+
+            interval = scheduler.interval
             try:
-                queue.put((image_data, size), timeout=self.capture_interval)
+                queue.put((image_data, size), timeout=interval)
                 capturer.capture(*size)
 
                 loop_time = timeit.default_timer() - loop_start
-                if loop_time >= self.capture_interval:
+                if loop_time >= interval:
                     raise QueueFull
 
-                abort = utils.wait(self.capture_interval - loop_time)
+                abort = utils.wait(interval - loop_time)
 
             except AttributeError:
                 self.log('Stop capture: detector stopped')
@@ -761,9 +1064,63 @@ class UpNextDetector(object):
 
         queue.task_done()
 
+    def _process_frame(self, image_data, size, play_time, current_index):
+        """Method to create image hashes from captured image data, compare to
+           previous/representative/other episode hashes, and update match
+           counts and detected timestamp. Returns similarity stats"""
+
+        pipelines = self._get_pipelines(size)
+        image, filtered_image = self._create_images(image_data, pipelines)
+
+        # Check if current hash matches with previous hash, typical end
+        # credits hash, or other episode hashes
+        stats, hashes = self._evaluate_similarity(
+            image, filtered_image, pipelines, current_index
+        )
+        image_hash, filtered_hash, expanded_hash = hashes
+
+        if SETTINGS.detector_debug:
+            self.log('Match: {0[hits]:.1f}s/{1}s, Miss: {0[misses]:.1f}s/{2}s'
+                     .format(self.match_counts,
+                             self.match_number,
+                             self.mismatch_number))
+
+            self._print_hashes(
+                [filtered_hash,
+                 expanded_hash,
+                 self.hashes.data.get(self.hash_index['credits_small']),
+                 self.hashes.data.get(self.hash_index['credits_large']),
+                 self.hashes.data.get(self.hash_index['credits_scroll'])],
+                size=self.hashes.hash_size,
+                prefix=(
+                    '{0:.1f}% similar to typical credits, '
+                    '{1:.1f}% similarity in detected credits'
+                ).format(stats['credits'], stats['detected'])
+            )
+
+            self._print_hashes(
+                [self.hashes.data.get(self.hash_index['previous']),
+                 image_hash,
+                 self.past_hashes.data.get(self.hash_index['episodes'])],
+                size=self.hashes.hash_size,
+                prefix=(
+                    '{0:.1f}% similar to previous hash, '
+                    '{1:.1f}% similar to other episodes'
+                ).format(stats['previous'], stats['episodes'])
+            )
+
+        # Store current hash for comparison with next video frame
+        self.hashes.add(current_index, image_hash)
+        self.hash_index['previous'] = current_index
+
+        # Store timestamps if credits are detected
+        self.update_timestamp(play_time, current_index)
+
+        return stats
+
     @utils.Profiler(enabled=SETTINGS.detector_debug, lazy=True)
     def _worker(self):
-        """Detection loop captures Kodi render buffer every 1s to create an
+        """Detection loop processes Kodi render buffer captures to create an
            image hash. Hash is compared to the previous hash to determine
            whether current frame of video is similar to the previous frame.
 
@@ -780,11 +1137,14 @@ class UpNextDetector(object):
                 if error is AttributeError:
                     raise error
                 play_time = player.getTime()
-                self.hash_index['current'] = (
+                # Keep a local copy of the current hash index as it will be
+                # updated by other workers while this frame is processed
+                current_index = (
                     int(player.getTotalTime() - play_time),
                     int(play_time),
                     self.hashes.group_idx
                 )
+                self.hash_index['current'] = current_index
                 # Only capture if playing at normal speed
                 error = player.get_speed() != 1
             if error:
@@ -803,50 +1163,17 @@ class UpNextDetector(object):
                 self.log('Queue empty - retry')
                 continue
 
-            image, filtered_image = self._create_images(image_data, size)
-
-            # Check if current hash matches with previous hash, typical end
-            # credits hash, or other episode hashes
-            stats, hashes = self._evaluate_similarity(
-                image, filtered_image, self.hashes.hash_size
+            frame_start = timeit.default_timer()
+            stats = self._process_frame(
+                image_data, size, play_time, current_index
             )
-            image_hash, filtered_hash, expanded_hash = hashes
 
-            if SETTINGS.detector_debug:
-                self.log('Match: {0[hits]}/{1}, Miss: {0[misses]}/{2}'.format(
-                    self.match_counts, self.match_number, self.mismatch_number
-                ))
-
-                self._print_hashes(
-                    [filtered_hash,
-                     expanded_hash,
-                     self.hashes.data.get(self.hash_index['credits_small']),
-                     self.hashes.data.get(self.hash_index['credits_large']),
-                     self.hashes.data.get(self.hash_index['credits_scroll'])],
-                    size=self.hashes.hash_size,
-                    prefix=(
-                        '{0:.1f}% similar to typical credits, '
-                        '{1:.1f}% similarity in detected credits'
-                    ).format(stats['credits'], stats['detected'])
-                )
-
-                self._print_hashes(
-                    [self.hashes.data.get(self.hash_index['previous']),
-                     image_hash,
-                     self.past_hashes.data.get(self.hash_index['episodes'])],
-                    size=self.hashes.hash_size,
-                    prefix=(
-                        '{0:.1f}% similar to previous hash, '
-                        '{1:.1f}% similar to other episodes'
-                    ).format(stats['previous'], stats['episodes'])
-                )
-
-            # Store current hash for comparison with next video frame
-            self.hashes.data[self.hash_index['current']] = image_hash
-            self.hash_index['previous'] = self.hash_index['current']
-
-            # Store timestamps if credits are detected
-            self.update_timestamp(play_time)
+            # Adjust capture rate and resolution for the next frames
+            self.scheduler.update(
+                timeit.default_timer() - frame_start,
+                stats['previous'],
+                self.match_counts['hits']
+            )
 
             self._queue_task_done(queue)
 
@@ -863,7 +1190,7 @@ class UpNextDetector(object):
                 except QueueFull:
                     pass
                 worker.join(
-                    2 * SETTINGS.detector_threads * self.capture_interval
+                    2 * SETTINGS.detector_threads * self.scheduler.interval
                 )
 
             if worker.is_alive():
@@ -915,7 +1242,7 @@ class UpNextDetector(object):
         """Method to run actual detection test loop in a separate thread"""
 
         resolution = self._get_video_capture_resolution(
-            max_size=SETTINGS.detector_data_limit
+            max_size=self.scheduler.limit
         )
         if None in resolution:
             self.log('No video playing')
@@ -942,6 +1269,7 @@ class UpNextDetector(object):
         # Otherwise run the detector in a new thread
         with self._lock:
             self.log('Started')
+            self.scheduler.reset()
             queue = self._queue_create()
             queue.put_nowait([
                 xbmc.RenderCapture(),
@@ -951,7 +1279,7 @@ class UpNextDetector(object):
                                                kwargs={'queue': queue})]
             self.workers += [
                 utils.run_threaded(self._worker,
-                                   delay=start_delay * self.capture_interval)
+                                   delay=start_delay * self.scheduler.interval)
                 for start_delay in range(SETTINGS.detector_threads - 1)
             ]
             self._running.set()
@@ -1002,21 +1330,23 @@ class UpNextDetector(object):
         self.past_hashes.timestamps.update(self.hashes.timestamps)
         # If credit were detected only store the previous +/- 5s of hashes to
         # reduce false positives when comparing to other episodes
-        self.past_hashes.data.update(self.hashes.window(
+        self.past_hashes.update(self.hashes.window(
             self.hash_index['detected_at'], all_episodes=True
         ) if self.match_counts['detected'] else self.hashes.data)
 
         if SETTINGS.detector_save_path:
             self.past_hashes.save(self.hashes.group_name)
 
-    def update_timestamp(self, play_time):
+    def update_timestamp(self, play_time, current_index=None):
         # Timestamp already stored or credits not detected
         if self.hash_index['detected_at'] or not self.credits_detected():
             return
 
         with self._lock:
             self.log('Credits detected')
-            self.hash_index['detected_at'] = self.hash_index['current']
+            self.hash_index['detected_at'] = (
+                current_index or self.hash_index['current']
+            )
             self.hashes.timestamps[self.hashes.group_idx] = play_time
             self.state.set_detected_popup_time(play_time)
             utils.event('upnext_credits_detected', internal=True)
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements a SQLite database used to store hashes and detected credits
+   timestamps for all groups (i.e. show seasons) used by UpNextDetector"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+import constants
+from settings import SETTINGS
+from sqlite_store import SQLiteStore
+
+
+class UpNextDetectorDB(SQLiteStore):
+    """Class to store/load hashes and timestamps in a single database"""
+
+    __slots__ = ()
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS groups ('
+        ' group_name TEXT PRIMARY KEY,'
+        ' version REAL NOT NULL,'
+        ' hash_width INTEGER NOT NULL,'
+        ' hash_height INTEGER NOT NULL,'
+        ' last_used REAL NOT NULL'
+        ')',
+        'CREATE INDEX IF NOT EXISTS groups_last_used'
+        ' ON groups (last_used)',
+        'CREATE TABLE IF NOT EXISTS hashes ('
+        ' group_name TEXT NOT NULL,'
+        ' group_idx INTEGER NOT NULL,'
+        ' time_to_end INTEGER NOT NULL,'
+        ' time_from_start INTEGER NOT NULL,'
+        ' hash BLOB NOT NULL,'
+        ' PRIMARY KEY (group_name, group_idx, time_to_end, time_from_start)'
+        ')',
+        'CREATE INDEX IF NOT EXISTS hashes_time_from_start'
+        ' ON hashes (group_name, group_idx, time_from_start)',
+        'CREATE TABLE IF NOT EXISTS timestamps ('
+        ' group_name TEXT NOT NULL,'
+        ' group_idx INTEGER NOT NULL,'
+        ' timestamp REAL,'
+        ' PRIMARY KEY (group_name, group_idx)'
+        ')',
+    )
+
+    def __init__(self, path=None):
+        super(UpNextDetectorDB, self).__init__(path or ''.join((
+            SETTINGS.detector_save_path, constants.DETECTOR_DB_FILENAME
+        )))
+
+    def load(self, group_name):
+        """Returns a tuple of version, hash size, list of hash records of
+           (time_to_end, time_from_start, group_idx, packed_hash) and dict of
+           timestamps, for the group_name, or None if nothing was stored"""
+
+        def _load(connection):
+            group = connection.execute(
+                'SELECT version, hash_width, hash_height'
+                ' FROM groups WHERE group_name = ?',
+                (group_name, )
+            ).fetchone()
+            if not group:
+                return None
+
+            # Mark group as recently used
+            connection.execute(
+                'UPDATE groups SET last_used = ? WHERE group_name = ?',
+                (time.time(), group_name)
+            )
+            records = connection.execute(
+                'SELECT time_to_end, time_from_start, group_idx, hash'
+                ' FROM hashes WHERE group_name = ?',
+                (group_name, )
+            ).fetchall()
+            timestamps = dict(connection.execute(
+                'SELECT group_idx, timestamp FROM timestamps'
+                ' WHERE group_name = ?',
+                (group_name, )
+            ).fetchall())
+
+            version, hash_width, hash_height = group
+            return version, [hash_width, hash_height], records, timestamps
+
+        return self._execute(
+            _load, 'Could not load hashes for {0}'.format(group_name)
+        )
+
+    def save(self, group_name, version, hash_size, records, timestamps,
+             max_groups=constants.DETECTOR_DB_MAX_GROUPS):
+        """Incrementally store new hash records of (time_to_end,
+           time_from_start, group_idx, packed_hash) and timestamps for the
+           group_name, then prune least recently used groups"""
+
+        def _save(connection):
+            connection.execute(
+                'INSERT OR REPLACE INTO groups (group_name, version,'
+                ' hash_width, hash_height, last_used)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (group_name, version, hash_size[0], hash_size[1], time.time())
+            )
+            connection.executemany(
+                'INSERT OR REPLACE INTO hashes (group_name, time_to_end,'
+                ' time_from_start, group_idx, hash) VALUES (?, ?, ?, ?, ?)',
+                [(group_name, ) + tuple(record) for record in records]
+            )
+            connection.executemany(
+                'INSERT OR REPLACE INTO timestamps (group_name, group_idx,'
+                ' timestamp) VALUES (?, ?, ?)',
+                [(group_name, group_idx, timestamp)
+                 for group_idx, timestamp in timestamps.items()
+                 if group_idx is not None]
+            )
+            self._prune(connection, max_groups)
+            return True
+
+        if not self._execute(
+                _save, 'Could not save hashes for {0}'.format(group_name)
+        ):
+            return False
+
+        self.log('Saved {0} new hashes for {1}'.format(
+            len(records), group_name
+        ))
+        return True
+
+    @staticmethod
+    def _prune(connection, max_groups):
+        if not max_groups:
+            return
+
+        pruned = connection.execute(
+            'DELETE FROM groups WHERE group_name NOT IN ('
+            ' SELECT group_name FROM groups'
+            ' ORDER BY last_used DESC LIMIT ?'
+            ')',
+            (max_groups, )
+        ).rowcount
+        if pruned <= 0:
+            return
+
+        for table in ('hashes', 'timestamps'):
+            connection.execute(
+                'DELETE FROM {0} WHERE group_name NOT IN ('
+                ' SELECT group_name FROM groups'
+                ')'.format(table)
+            )
@@ -66,6 +66,20 @@ def get_legal_path(path):
     return os.path.join(path, '')
 
 
+def get_local_path(path):
+    """Returns a real path, translated from a local or special:// path, as a
+       string, or None if the path is not an existing local file"""
+
+    scheme, separator, _ = path.partition('://')
+    if separator and scheme != 'special':
+        return None
+
+    path = _translate_path(path)
+    if not os.path.isfile(path):
+        return None
+    return path
+
+
 def make_legal_path(path):
     """Create a directory, from an arbitrary string input and return the legal
        path, with a trailing path separator, as a string or an empty string if
@@ -4,12 +4,21 @@
 
 from __future__ import absolute_import, division, unicode_literals
 
+import threading
+
 from PIL import Image, ImageChops, ImageDraw, ImageFilter
 from settings import SETTINGS
 
-_PRECOMPUTED = {
-    '_STACK': [],
-}
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_PRECOMPUTED = {}
+_PRECOMPUTED_LOCK = threading.Lock()
+
+# Translation table used to convert binary pixel data to a string of bits
+_BIT_STRING_TABLE = bytes(bytearray([48] + [49] * 255))
 
 
 try:
@@ -20,6 +29,429 @@ except NameError:
     _SPLIT = str.split
 
 
+class PipelineContext(object):
+    """Class to hold the state of a single run of an image processing pipeline
+       so that pipelines can be run concurrently from multiple threads"""
+
+    __slots__ = (
+        'inputs',
+        'save_file',
+        'stack',
+    )
+
+    def __init__(self, save_file=None, inputs=()):
+        self.inputs = inputs
+        self.save_file = None
+        self.stack = []
+        self.reset(save_file, inputs)
+
+    def reset(self, save_file=None, inputs=()):
+        # Add thread name to debug output file names to avoid concurrent
+        # pipelines overwriting each others intermediate images
+        self.save_file = _FORMAT(
+            '{0}_{1}', save_file, threading.current_thread().name
+        ) if save_file else None
+        self.inputs = inputs
+        self.stack = []
+
+
+class Pipeline(object):
+    """Class to compile a queue of image processing steps, in the form of
+       [[method, arg1, arg2, ...], ...], into a reusable callable. Arguments
+       are parsed and filters are created when compiled, and consecutive LUT
+       steps are fused into a single LUT unless debug output is enabled.
+       Images are passed between steps without being copied, other than for
+       steps that modify their input in place or when debug output is
+       enabled"""
+
+    __slots__ = (
+        'debug',
+        'save_file',
+        'steps',
+    )
+
+    _FETCH_METHODS = frozenset(('_image_input_fetch', '_image_stack_fetch'))
+
+    def __init__(self, queue, save_file=None,
+                 debug=SETTINGS.detector_debug_save):
+        self.save_file = save_file
+        self.debug = bool(debug and save_file)
+        self.steps = []
+
+        lut_steps = []
+        for step, args in enumerate(queue):
+            method = args[0]
+            args = list(args[1:])
+
+            fetch_args = tuple(
+                idx for idx, arg in enumerate(args)
+                if callable(arg)
+                and getattr(arg, '__name__', None) in self._FETCH_METHODS
+            )
+            debug_name, debug_args = self._debug_name(step, method, args)
+            args = self._compile_args(method, args)
+
+            lut_method = None if fetch_args else _LUT_METHODS.get(method)
+            if lut_method and not self.debug:
+                lut_steps.append(lut_method + (tuple(args), ))
+                continue
+
+            self._add_lut_steps(lut_steps)
+            self.steps.append((
+                method, tuple(args), fetch_args, 1,
+                method in _INPLACE_METHODS, debug_name, debug_args
+            ))
+        self._add_lut_steps(lut_steps)
+
+    def __call__(self, data, inputs=(), context=None,
+                 _copy=Image.Image.copy, _format=_FORMAT,
+                 _isinstance=isinstance, _list=list, _save=Image.Image.save):
+        if context is None:
+            context = PipelineContext(self.save_file, inputs)
+        else:
+            context.reset(self.save_file, inputs)
+        debug = self.debug and context.save_file
+        if debug and _isinstance(data, Image.Image):
+            data = _copy(data)
+        stack = context.stack
+
+        output = None
+        for (method, args, fetch_args, num_outputs, inplace,
+             debug_name, debug_args) in self.steps:
+            if fetch_args or debug:
+                args = _list(args)
+                for idx in fetch_args:
+                    args[idx] = args[idx](context)
+            if debug:
+                save_file = debug + debug_name
+                for idx in debug_args:
+                    args[idx] = save_file
+
+            # Input may also be referenced by the caller or by the stack
+            if inplace and _isinstance(data, Image.Image):
+                data = _copy(data)
+
+            output = method(data, *args)
+            # Fused LUT steps output a single image for all fused steps
+            stack.extend((output, ) * num_outputs)
+
+            if _isinstance(output, Image.Image):
+                # Only copy when debugging, so that saved output of each step
+                # is not modified by any following steps
+                data = _copy(output) if debug else output
+            elif output:
+                data = output
+                continue
+            else:
+                continue
+
+            if not debug:
+                continue
+
+            try:
+                _save(data, _format(
+                    '{0}{1}.bmp', SETTINGS.detector_save_path, save_file
+                ))
+            except (IOError, OSError):
+                pass
+
+        return output
+
+    def _add_lut_steps(self, lut_steps):
+        if not lut_steps:
+            return
+
+        self.steps.append(
+            (_apply_luts, (tuple(lut_steps), ), (), len(lut_steps), False,
+             '', ())
+        )
+        del lut_steps[:]
+
+    @staticmethod
+    def _compile_args(method, args):
+        # Parse filter specs when compiled rather than on every call
+        if method is apply_filter and args:
+            args[0] = _precompute(args[0])
+        return args
+
+    @staticmethod
+    def _debug_name(step, method, args,
+                    _callable=callable, _float=float, _format=_FORMAT,
+                    _int=int, _isinstance=isinstance, _list=list, _str=str,
+                    _tuple=tuple):
+        debug_name = _format('_{0}_{1}', step, method.__name__)
+        if args:
+            debug_name = _format('{1}{0}', [
+                arg if _isinstance(
+                    arg, (_int, _float, _list, _str, _tuple)
+                )
+                else arg.__name__ if _callable(arg)
+                else type(arg).__name__
+                for arg in args
+                if arg != 'DEBUG'
+            ], debug_name)
+        debug_args = _tuple(
+            idx for idx, arg in enumerate(args) if arg == 'DEBUG'
+        )
+        return debug_name, debug_args
+
+
+# Histogram, LUT and hash packing helpers are implemented using NumPy, if
+# available, with a pure Python fallback. Both implementations must return
+# identical results so that hashes remain compatible
+if numpy:
+    _ARANGE = numpy.arange(256)
+
+    def _histogram_rank(input_data, percentile, skip_levels=0,
+                        _cumsum=numpy.cumsum, _int=int,
+                        _searchsorted=numpy.searchsorted):
+        if isinstance(input_data, Image.Image):
+            input_data = input_data.histogram()
+
+        cumulative = _cumsum(input_data[skip_levels:])
+        if not len(cumulative):  # pylint: disable=len-as-condition
+            return 255
+
+        percentile = percentile / 100
+        target = _int(_int(cumulative[-1]) * percentile)
+        target = _int(_searchsorted(cumulative, target, side='right'))
+
+        if target < len(cumulative):
+            return target + skip_levels
+        return 255
+
+    def _histogram_levels(histogram):
+        return numpy.flatnonzero(histogram).tolist()
+
+    def _clip_lut(min_value, max_value):
+        return numpy.clip(_ARANGE, min_value, max_value).tolist()
+
+    def _deviation_lut(target):
+        return numpy.abs(_ARANGE - target).tolist()
+
+    def _scale_lut(scale, offset):
+        return (_ARANGE * scale - offset).astype(int).tolist()
+
+    def _threshold_lut(target):
+        return numpy.where(_ARANGE > target, 255, 0).tolist()
+
+    def _threshold_level(histogram, sum_total):
+        delta = numpy.array(histogram, dtype=numpy.float64) / sum_total
+        delta_reversed = delta[::-1]
+
+        cum_sum = numpy.cumsum(delta)
+        cum_sum_reversed = numpy.cumsum(delta_reversed)[::-1]
+        cum_integral = numpy.cumsum(delta * _ARANGE)
+        cum_integral_reversed = numpy.cumsum(
+            delta_reversed * (255 - _ARANGE)
+        )[::-1]
+
+        running_total = cum_sum[:-1]
+        running_total_reversed = cum_sum_reversed[1:]
+        running_integral = cum_integral[:-1]
+        running_integral_reversed = cum_integral_reversed[1:]
+
+        valid = (
+            (running_total != 0)
+            & (running_total_reversed != 0)
+            & (running_integral != 0)
+            & (running_integral_reversed != 0)
+        )
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            variance = numpy.where(
+                valid,
+                running_total * running_total_reversed * (
+                    (running_integral / running_total)
+                    - (running_integral_reversed / running_total_reversed)
+                ) ** 2,
+                0
+            )
+
+        # Use the last level with the maximum variance
+        return len(variance) - 1 - int(numpy.argmax(variance[::-1]))
+
+    def _remap_histogram(histogram, lut):
+        return numpy.bincount(
+            numpy.clip(lut, 0, 255), weights=histogram, minlength=256
+        ).astype(int).tolist()
+
+    def _pack_bits(image, _int=int):
+        # Pixels above the mid-level are set, equivalent to BIT_DEPTH_LUT,1
+        data = numpy.asarray(image).ravel() > 127
+        padding = -len(data) % 8
+        return _int.from_bytes(
+            numpy.packbits(data).tobytes(), 'big'
+        ) >> padding
+
+else:
+    def _histogram_rank(input_data, percentile, skip_levels=0):
+        if isinstance(input_data, Image.Image):
+            total = input_data.size[0] * input_data.size[1]
+            histogram = input_data.histogram()
+        else:
+            histogram = input_data
+            total = sum(histogram)
+
+        percentile = percentile / 100
+        target = int((total - sum(histogram[:skip_levels])) * percentile)
+        total = 0
+
+        for val, num in enumerate(histogram[skip_levels:], start=skip_levels):
+            if not num:
+                continue
+
+            total += num
+            if total > target:
+                target = val
+                break
+        else:
+            target = 255
+
+        return target
+
+    def _histogram_levels(histogram):
+        return [value for value, num in enumerate(histogram) if num]
+
+    def _clip_lut(min_value, max_value):
+        return [
+            min_value if i <= min_value else max_value if i >= max_value else i
+            for i in range(256)
+        ]
+
+    def _deviation_lut(target, _abs=abs):
+        return [_abs(i - target) for i in range(256)]
+
+    def _scale_lut(scale, offset, _int=int):
+        return [_int(scale * i - offset) for i in range(256)]
+
+    def _threshold_lut(target):
+        return [255 if (i > target) else 0 for i in range(256)]
+
+    def _threshold_level(histogram, sum_total):  # pylint: disable=too-many-locals
+        cum_sum = [0] * 256
+        cum_sum_reversed = [0] * 256
+        cum_integral = [0] * 256
+        cum_integral_reversed = [0] * 256
+
+        running_total = 0
+        running_total_reversed = 0
+        running_integral = 0
+        running_integral_reversed = 0
+
+        for idx, (num, num_reversed) in enumerate(
+                zip(histogram, histogram[::-1])
+        ):
+            delta = num / sum_total
+            running_total += delta
+            running_integral += delta * idx
+
+            delta_reversed = num_reversed / sum_total
+            running_total_reversed += delta_reversed
+            running_integral_reversed += delta_reversed * (255 - idx)
+
+            cum_sum[idx] = running_total
+            cum_sum_reversed[255 - idx] = running_total_reversed
+
+            cum_integral[idx] = running_integral
+            cum_integral_reversed[255 - idx] = running_integral_reversed
+
+        variance = [
+            running_total * running_total_reversed * (
+                (running_integral / running_total)
+                - (running_integral_reversed / running_total_reversed)
+            ) ** 2
+            if running_total and running_total_reversed
+            and running_integral and running_integral_reversed
+            else 0
+            for running_total, running_total_reversed,
+            running_integral, running_integral_reversed in
+            zip(cum_sum[:-1], cum_sum_reversed[1:],
+                cum_integral[:-1], cum_integral_reversed[1:])
+        ]
+
+        target = max(variance)
+        return max([idx for idx, val in enumerate(variance) if val == target])  # pylint: disable=consider-using-generator
+
+    def _remap_histogram(histogram, lut, _max=max, _min=min):
+        output = [0] * 256
+        for num, level in zip(histogram, lut):
+            output[_min(255, _max(0, level))] += num
+        return output
+
+    def _pack_bits(image, _int=int, _table=_BIT_STRING_TABLE):
+        lut = _precompute('BIT_DEPTH_LUT,1,0.0078125')
+
+        # Pack binary pixel data into an integer, first pixel as the MSB
+        return _int(image.point(lut).tobytes().translate(_table), 2)
+
+
+def _apply_luts(image, lut_steps):
+    histogram = None
+    lut = None
+
+    for lut_method, use_histogram, args in lut_steps:
+        if not use_histogram:
+            step_histogram = None
+        else:
+            if histogram is None:
+                histogram = image.histogram()
+            # Histogram of the image after preceding LUTs have been applied
+            step_histogram = (
+                _remap_histogram(histogram, lut) if lut else histogram
+            )
+
+        step_lut = lut_method(step_histogram, *args)
+        if not step_lut:
+            continue
+        lut = _compose_lut(lut, step_lut) if lut else step_lut
+
+    return image.point(lut) if lut else image
+
+
+def _auto_level_lut(histogram, min_value=0, max_value=100, clip=(0, None)):
+    levels = _histogram_levels(histogram)
+
+    if max_value - min_value == 100:
+        min_value, max_value = levels[0], levels[-1]
+
+    else:
+        percentage = len(levels) / 100
+
+        max_value = max(max_value, min_value + (1 / percentage))
+        max_value = int(max_value * percentage) - 1
+        max_value = levels[max_value]
+
+        min_value = int(min_value * percentage)
+        min_value = levels[min_value]
+
+    if min_value >= max_value:
+        return None
+
+    if clip[0] < 1:
+        offset = 0
+        if clip[1] == 0:
+            scale = max_value
+        elif clip[1] == 1:
+            scale = 255 - min_value
+            offset = min_value
+        else:
+            scale = 255
+
+        scale = 1 / max(clip[0], (max_value - min_value) / scale)
+        offset = scale * (min_value - offset)
+
+        return _scale_lut(scale, offset)
+
+    return _clip_lut(min_value, max_value)
+
+
+def _auto_threshold_lut(histogram):
+    target = _threshold_level(histogram, sum(histogram))
+    target = target + 1
+
+    return _threshold_lut(target)
+
+
 def _bit_depth_lut(bit_depth, scale=None, _int=int):
     num_levels = 2 ** bit_depth
     bit_mask = ~((2 ** (8 - bit_depth)) - 1)
@@ -81,6 +513,11 @@ def _border_mask(size, border_colour, fill_colour, *box):
 
 
 # pylint: disable=too-many-arguments, too-many-locals, too-many-positional-arguments
+def _compose_lut(lut, next_lut, _max=max, _min=min):
+    # Output levels of a LUT are clipped to 0-255 when it is applied
+    return [next_lut[_min(255, _max(0, level))] for level in lut]
+
+
 def _fade_mask(size, level_start, level_stop, steps, power, box,
                _format=_FORMAT, _int=int, _max=max,
                _paste=Image.Image.paste):
@@ -132,39 +569,36 @@ def _fade_mask(size, level_start, level_stop, steps, power, box,
     return element
 
 
-def _histogram_rank(input_data, percentile, skip_levels=0):
-    if isinstance(input_data, Image.Image):
-        total = input_data.size[0] * input_data.size[1]
-        histogram = input_data.histogram()
-    else:
-        histogram = input_data
-        total = sum(histogram)
-
-    percentile = percentile / 100
-    target = int((total - sum(histogram[:skip_levels])) * percentile)
-    total = 0
+def _points_of_interest_lut(histogram, percentile=50, skip_levels=0):
+    # Transform image to show absolute deviation from median pixel luma
+    target = _histogram_rank(histogram, 50)
+    lut = _deviation_lut(target)
 
-    for val, num in enumerate(histogram[skip_levels:], start=skip_levels):
-        if not num:
-            continue
+    # Calculate percentile of absolute deviation from the median to represent
+    # significant pixels and use transformed image as the hash of the
+    # current video frame
+    target = _histogram_rank(
+        _remap_histogram(histogram, lut), percentile, skip_levels
+    )
+    return _compose_lut(lut, _threshold_lut(target))
 
-        total += num
-        if total > target:
-            target = val
-            break
-    else:
-        target = 255
 
-    return target
+def _posterise_lut(_histogram, bit_depth):
+    return _precompute('BIT_DEPTH_LUT,{}'.format(bit_depth))
 
 
 def _precompute(method, size=None, debug=SETTINGS.detector_debug_save):
-    element = _PRECOMPUTED.get(method)
-    try:
-        if element and size == getattr(element, 'size', element.get('size')):
+    with _PRECOMPUTED_LOCK:
+        element = _PRECOMPUTED.get(method)
+    if element is not None:
+        if isinstance(element, dict):
+            element_size = element.get('size')
+        elif isinstance(element, Image.Image):
+            element_size = element.size
+        else:
+            element_size = None
+        if size == element_size:
             return element
-    except AttributeError:
-        pass
 
     element, _, args = method.partition(',')
     args = _to_numbers(args)
@@ -208,7 +642,11 @@ def _precompute(method, size=None, debug=SETTINGS.detector_debug_save):
             SETTINGS.detector_save_path, method
         ))
 
-    _PRECOMPUTED[method] = element
+    # Elements are not computed while holding the lock as computation of some
+    # elements requires other precomputed elements. Concurrent computation of
+    # the same element will produce the same result, so last one stored wins
+    with _PRECOMPUTED_LOCK:
+        _PRECOMPUTED[method] = element
     return element
 
 
@@ -307,110 +745,33 @@ def adaptive_filter(image, sampling, method, args=(), save_file=None,  # pylint:
     return image
 
 
-def auto_level(image, min_value=0, max_value=100, clip=(0, None), _int=int):
-    if max_value - min_value == 100:
-        min_value, max_value = image.getextrema()
-
-    else:
-        levels = [value for value, num in enumerate(image.histogram()) if num]
-        percentage = len(levels) / 100
-
-        max_value = max(max_value, min_value + (1 / percentage))
-        max_value = int(max_value * percentage) - 1
-        max_value = levels[max_value]
-
-        min_value = int(min_value * percentage)
-        min_value = levels[min_value]
-
-    if min_value >= max_value:
+def auto_level(image, min_value=0, max_value=100, clip=(0, None)):
+    lut = _auto_level_lut(image.histogram(), min_value, max_value, clip)
+    if not lut:
         return image
 
-    if clip[0] < 1:
-        offset = 0
-        if clip[1] == 0:
-            scale = max_value
-        elif clip[1] == 1:
-            scale = 255 - min_value
-            offset = min_value
-        else:
-            scale = 255
-
-        scale = 1 / max(clip[0], (max_value - min_value) / scale)
-        offset = scale * (min_value - offset)
-
-        return image.point([
-            _int(scale * i - offset)
-            for i in range(256)
-        ])
-
-    return image.point([
-        min_value if i <= min_value else max_value if i >= max_value else i
-        for i in range(256)
-    ])
-
-
-def auto_threshold(image):  # pylint: disable=too-many-locals
-    histogram = image.histogram()
-
-    cum_sum = [0] * 256
-    cum_sum_reversed = [0] * 256
-    cum_integral = [0] * 256
-    cum_integral_reversed = [0] * 256
-
-    sum_total = image.size[0] * image.size[1]
-    running_total = 0
-    running_total_reversed = 0
-    running_integral = 0
-    running_integral_reversed = 0
-
-    for idx, (num, num_reversed) in enumerate(zip(histogram, histogram[::-1])):
-        delta = num / sum_total
-        running_total += delta
-        running_integral += delta * idx
-
-        delta_reversed = num_reversed / sum_total
-        running_total_reversed += delta_reversed
-        running_integral_reversed += delta_reversed * (255 - idx)
-
-        cum_sum[idx] = running_total
-        cum_sum_reversed[255 - idx] = running_total_reversed
-
-        cum_integral[idx] = running_integral
-        cum_integral_reversed[255 - idx] = running_integral_reversed
-
-    variance = [
-        running_total * running_total_reversed * (
-            (running_integral / running_total)
-            - (running_integral_reversed / running_total_reversed)
-        ) ** 2
-        if running_total and running_total_reversed
-        and running_integral and running_integral_reversed
-        else 0
-        for running_total, running_total_reversed,
-        running_integral, running_integral_reversed in
-        zip(cum_sum[:-1], cum_sum_reversed[1:],
-            cum_integral[:-1], cum_integral_reversed[1:])
-    ]
-
-    target = max(variance)
-    target = max([idx for idx, val in enumerate(variance) if val == target])  # pylint: disable=consider-using-generator
-    target = target + 1
+    return image.point(lut)
 
-    image = image.point([255 if (i > target) else 0 for i in range(256)])
 
-    return image
+def auto_threshold(image):
+    return image.point(_auto_threshold_lut(image.histogram()))
 
 
 def apply_filter(image, method, extent=None, original=None, output_op=None):
     if output_op:
         original = original if original else image
 
-    if original:
-        original = original.copy()
-        filtered_image = original.filter(_precompute(method))
+    # Filter may have already been created by a compiled Pipeline
+    if isinstance(method, ImageFilter.Filter):
+        image_filter = method
     else:
-        filtered_image = image.filter(_precompute(method))
+        image_filter = _precompute(method)
+
+    # Filtering and ImageChops operations create new images, so the original
+    # image does not need to be copied
+    filtered_image = (original or image).filter(image_filter)
 
+    copied = False
     if not extent or extent == 'ALL':
         mask = None
 
@@ -426,6 +787,7 @@ def apply_filter(image, method, extent=None, original=None, output_op=None):
 
         if background == 'BLACK':
             image = Image.new('L', image.size, 0)
+            copied = True
 
         border = max(10, int(0.25 * min(image.size)))
         mask = (255, 0) if direction == 'IN' else (0, 255)
@@ -433,7 +795,9 @@ def apply_filter(image, method, extent=None, original=None, output_op=None):
             'FADE_MASK,{1},{2},{0},3,{0}'.format(border, *mask), image.size
         )
 
-    image = image.copy()
+    # Input image or cached mask must not be modified
+    if not copied:
+        image = image.copy()
     image.paste(filtered_image, mask=mask)
 
     if output_op:
@@ -577,9 +941,7 @@ def detail_reduce(image, base_image, reduction=25,
 
 
 def export_data(image):
-    lut = _precompute('BIT_DEPTH_LUT,1,0.0078125')
-
-    return tuple(image.point(lut).getdata())
+    return _pack_bits(image)
 
 
 def entropy_compare(image, filtered_image, threshold=1.10, save_file=None):
@@ -610,9 +972,15 @@ def entropy_compare(image, filtered_image, threshold=1.10, save_file=None):
     return False, None
 
 
+def image_input(index):
+    def _image_input_fetch(context):
+        return context.inputs[index]
+    return _image_input_fetch
+
+
 def image_stack(index):
-    def _image_stack_fetch():
-        return _PRECOMPUTED['_STACK'][index]
+    def _image_stack_fetch(context):
+        return context.stack[index]
     return _image_stack_fetch
 
 
@@ -667,84 +1035,19 @@ def output_histogram(input_data, scale_to_max=False, save_file=None):
     return image
 
 
-def points_of_interest(image, percentile=50, skip_levels=0, _abs=abs):
-    # Transform image to show absolute deviation from median pixel luma
-    target = _histogram_rank(image, 50)
-    image = image.point([_abs(i - target) for i in range(256)])
-
-    # Calculate percentile of absolute deviation from the median to represent
-    # significant pixels and use transformed image as the hash of the
-    # current video frame
-    target = _histogram_rank(image, percentile, skip_levels)
-    image = image.point([255 if (i > target) else 0 for i in range(256)])
+def points_of_interest(image, percentile=50, skip_levels=0):
+    lut = _points_of_interest_lut(image.histogram(), percentile, skip_levels)
 
-    return image
+    return image.point(lut)
 
 
 def posterise(image, bit_depth):
-    lut = _precompute('BIT_DEPTH_LUT,{}'.format(bit_depth))
-
-    return image.point(lut)
+    return image.point(_posterise_lut(None, bit_depth))
 
 
 def process(data, queue, save_file=None, debug=SETTINGS.detector_debug_save,
-            _append=list.append, _callable=callable, _copy=Image.Image.copy,
-            _enumerate=enumerate, _float=float, _format=_FORMAT, _int=int,
-            _isinstance=isinstance, _list=list, _pop=list.pop, _str=str,
-            _save=Image.Image.save, _tuple=tuple):
-    _PRECOMPUTED['_STACK'] = []
-    if _isinstance(data, Image.Image):
-        data = data.copy()
-    debug = debug and save_file
-
-    for step, args in _enumerate(queue):
-        method = _pop(args, 0)
-
-        args_enum = _enumerate(args)
-        if debug:
-            args_enum = _tuple(args_enum)
-            save_file = _format('{0}_{1}_{2}', debug, step, method.__name__)
-            if args:
-                save_file = _format('{1}{0}', [
-                    arg if _isinstance(
-                        arg, (_int, _float, _list, _str, _tuple)
-                    )
-                    else arg.__name__ if _callable(arg)
-                    else type(arg).__name__
-                    for _, arg in args_enum
-                    if arg != 'DEBUG'
-                ], save_file)
-
-                for idx in [idx for idx, arg in args_enum if arg == 'DEBUG']:
-                    args[idx] = save_file
-
-        for idx in [idx for idx, arg in args_enum  # pylint: disable=undefined-loop-variable
-                    if _callable(arg)
-                    and arg.__name__ == '_image_stack_fetch']:
-            args[idx] = args[idx]()
-
-        output = method(data, *args)
-        _append(_PRECOMPUTED['_STACK'], output)
-
-        if _isinstance(output, Image.Image):
-            data = _copy(output)
-        elif output:
-            data = output
-            continue
-        else:
-            continue
-
-        if not debug:
-            continue
-
-        try:
-            _save(data, _format(
-                '{0}{1}.bmp', SETTINGS.detector_save_path, save_file
-            ))
-        except (IOError, OSError):
-            pass
-
-    return output
+            context=None):
+    return Pipeline(queue, save_file, debug)(data, context=context)
 
 
 def replace_with_copy(image, replacement_image=None):
@@ -772,3 +1075,20 @@ def trim_to_bounding_box(image):
     image = image.crop(box)
 
     return image
+
+
+# Methods that can be fused into a single LUT by a compiled Pipeline, mapped to
+# the method used to create the LUT and whether it requires an image histogram
+_LUT_METHODS = {
+    auto_level: (_auto_level_lut, True),
+    auto_threshold: (_auto_threshold_lut, True),
+    points_of_interest: (_points_of_interest_lut, True),
+    posterise: (_posterise_lut, False),
+}
+
+# Methods that modify their input image in place, which a compiled Pipeline
+# will copy beforehand as it does not otherwise copy images between steps
+_INPLACE_METHODS = frozenset((
+    adaptive_filter,
+    conditional_filter,
+))
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements an in-memory snapshot of episodes and movie sets in the Kodi
+   library, used by the service to find the next video to play without
+   running filtered library queries"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import os.path
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import partial
+from itertools import islice
+from operator import attrgetter
+from random import choice as randchoice
+
+import api
+import constants
+import utils
+
+
+Episode = namedtuple('Episode', (
+    'episodeid',
+    'tvshowid',
+    'season',
+    'episode',
+    'firstaired',
+    'playcount',
+    'lastplayed',
+    'resume',
+    'file',
+))
+
+Movie = namedtuple('Movie', (
+    'movieid',
+    'setid',
+    'year',
+    'playcount',
+    'lastplayed',
+    'resume',
+    'file',
+))
+
+_EPISODE_PROPERTIES = [
+    'tvshowid',
+    'season',
+    'episode',
+    'firstaired',
+    'playcount',
+    'lastplayed',
+    'resume',
+    'file',
+]
+
+_MOVIE_PROPERTIES = [
+    'setid',
+    'year',
+    'playcount',
+    'lastplayed',
+    'resume',
+    'file',
+]
+
+
+# Sort orders matching api.SORT_EPISODE, api.SORT_DATE and api.SORT_YEAR
+_EPISODE_ORDER = attrgetter('season', 'episode')
+_DATE_ORDER = attrgetter('firstaired', 'season', 'episode')
+_YEAR_ORDER = attrgetter('year', 'movieid')
+
+
+def _resume(video):
+    resume = video.get('resume') or {}
+    return resume.get('position', 0), resume.get('total', 0)
+
+
+def _episode_record(episode):
+    return Episode(
+        episodeid=episode['episodeid'],
+        tvshowid=utils.get_int(episode, 'tvshowid'),
+        season=utils.get_int(episode, 'season'),
+        episode=utils.get_int(episode, 'episode'),
+        firstaired=(episode.get('firstaired') or '')[:10],
+        playcount=utils.get_int(episode, 'playcount', 0),
+        lastplayed=episode.get('lastplayed') or '',
+        resume=_resume(episode),
+        file=episode.get('file') or '',
+    )
+
+
+def _movie_record(movie):
+    return Movie(
+        movieid=movie['movieid'],
+        setid=utils.get_int(movie, 'setid', 0),
+        year=utils.get_int(movie, 'year', 0),
+        playcount=utils.get_int(movie, 'playcount', 0),
+        lastplayed=movie.get('lastplayed') or '',
+        resume=_resume(movie),
+        file=movie.get('file') or '',
+    )
+
+
+def _is_other_file(record, path, filename):
+    # Same checks as api.FILTER_NOT_FILEPATH, to deal with different file
+    # naming schemes, and to skip other episodes in a multi-episode file
+    record_path, record_filename = os.path.split(record.file)
+    return filename not in record_filename or path not in record_path
+
+
+class _ShowIndex(object):
+    """Episodes of a tvshow ordered by aired date, and by season and episode
+       number, used to find the next episode with a binary search"""
+
+    __slots__ = (
+        'by_date',
+        'by_episode',
+        'date_keys',
+        'episode_keys',
+    )
+
+    def __init__(self, records):
+        self.by_date = sorted(records, key=_DATE_ORDER)
+        self.date_keys = [_DATE_ORDER(record) for record in self.by_date]
+        self.by_episode = sorted(records, key=_EPISODE_ORDER)
+        self.episode_keys = [_EPISODE_ORDER(record)
+                             for record in self.by_episode]
+
+    def next_aired(self, aired, number, accept):
+        """Returns first accepted episode aired after the aired date, or on
+           the same date with a higher episode number"""
+
+        position = bisect_left(self.date_keys, (aired, ))
+        for record in islice(self.by_date, position, None):
+            if record.firstaired == aired and record.episode <= number:
+                continue
+            if accept(record):
+                return record
+        return None
+
+    def next_episode(self, season, number, accept):
+        """Returns first accepted episode in the same season with a higher
+           episode number"""
+
+        position = bisect_right(self.episode_keys, (season, number))
+        for record in islice(self.by_episode, position, None):
+            if record.season != season:
+                break
+            if accept(record):
+                return record
+        return None
+
+    def next_season(self, season, accept):
+        """Returns first accepted episode 0 or 1 of a later season"""
+
+        position = bisect_left(self.episode_keys, (season + 1, ))
+        while position < len(self.by_episode):
+            record = self.by_episode[position]
+            if record.episode > 1:
+                # Skip to start of following season
+                position = bisect_left(self.episode_keys,
+                                       (record.season + 1, ),
+                                       position)
+            elif accept(record):
+                return record
+            else:
+                position += 1
+        return None
+
+
+class LibrarySnapshot(object):
+    """Compact copy of library episodes and movies in sets, loaded when
+       enabled and kept up to date from library notifications"""
+
+    __slots__ = (
+        '_enabled',
+        '_indexes',
+        '_loaded',
+        '_lock',
+        '_pending_lock',
+        '_updates',
+        'episodes',
+        'movies',
+        'sets',
+        'tvshows',
+    )
+
+    def __init__(self):
+        self._enabled = False
+        self._indexes = {}
+        self._loaded = False
+        self._lock = utils.create_lock()
+        # Separate lock for pending updates, so that notification callbacks
+        # are not blocked while the snapshot is being loaded
+        self._pending_lock = utils.create_lock()
+        self._updates = set()
+
+        # Map of episodeid to tvshowid, and tvshowid to dict of episode records
+        self.episodes = {}
+        self.tvshows = {}
+        # Map of movieid to setid, and setid to dict of movie records
+        self.movies = {}
+        self.sets = {}
+
+    @classmethod
+    def log(cls, msg, level=utils.LOGDEBUG):
+        utils.log(msg, name=cls.__name__, level=level)
+
+    def enable(self):
+        self._enabled = True
+        self.invalidate()
+
+    def disable(self):
+        self._enabled = False
+        with self._pending_lock:
+            self._loaded = False
+            self._updates = set()
+        with self._lock:
+            self._indexes = {}
+            self.episodes = {}
+            self.tvshows = {}
+            self.movies = {}
+            self.sets = {}
+
+    def invalidate(self, db_type=None, db_id=None):
+        """Mark a single episode or movie as changed, or the whole snapshot as
+           outdated if db_type is not provided. Snapshot is updated when next
+           used, so this can be called from notification callbacks"""
+
+        max_updates = constants.LIBRARY_SNAPSHOT_MAX_UPDATES
+        with self._pending_lock:
+            if (db_type in ('episode', 'movie') and db_id
+                    and len(self._updates) < max_updates):
+                self._updates.add((db_type, db_id))
+                return
+
+            self._loaded = False
+
+    def update(self):
+        """Load snapshot if outdated, or refresh changed videos. Returns
+           whether the snapshot can be used"""
+
+        with self._lock:
+            return self._update()
+
+    def _update(self):
+        if not self._enabled:
+            return False
+
+        # Set before loading so that any notifications received while
+        # loading will cause the snapshot to be loaded again
+        with self._pending_lock:
+            loaded, self._loaded = self._loaded, True
+            updates, self._updates = self._updates, set()
+
+        if not loaded:
+            self._load()
+        elif updates:
+            self._refresh(updates)
+
+        return True
+
+    def _load(self):
+        episodes, _ = api.get_videos_from_library(
+            db_type='episodes',
+            limit=None,
+            properties=_EPISODE_PROPERTIES,
+        )
+        movies, _ = api.get_videos_from_library(
+            db_type='movies',
+            limit=None,
+            properties=_MOVIE_PROPERTIES,
+        )
+
+        self._indexes = {}
+        self.episodes = {}
+        self.tvshows = {}
+        for episode in episodes:
+            self._set_episode(_episode_record(episode))
+
+        self.movies = {}
+        self.sets = {}
+        for movie in movies:
+            self._set_movie(_movie_record(movie))
+
+        self.log('Loaded {0} episodes in {1} tvshows, {2} movies in {3} sets'
+                 .format(len(self.episodes), len(self.tvshows),
+                         len(self.movies), len(self.sets)))
+
+    def _refresh(self, updates):
+        for db_type, properties, record, set_record, remove_record in (
+                ('episode', _EPISODE_PROPERTIES, _episode_record,
+                 self._set_episode, self._remove_episode),
+                ('movie', _MOVIE_PROPERTIES, _movie_record,
+                 self._set_movie, self._remove_movie),
+        ):
+            db_ids = [db_id for _db_type, db_id in updates
+                      if _db_type == db_type]
+            if not db_ids:
+                continue
+
+            results = api.get_details_batch_from_library(
+                [(db_type, db_id) for db_id in db_ids],
+                properties=properties,
+            )
+            for db_id, details in zip(db_ids, results):
+                if details:
+                    details['{0}id'.format(db_type)] = db_id
+                    set_record(record(details))
+                else:
+                    remove_record(db_id)
+
+        self.log('Refreshed {0} videos'.format(len(updates)))
+
+    def _set_episode(self, record):
+        self._remove_episode(record.episodeid)
+        self.episodes[record.episodeid] = record.tvshowid
+        self.tvshows.setdefault(record.tvshowid, {})[record.episodeid] = record
+        self._indexes.pop((record.tvshowid, False), None)
+        self._indexes.pop((record.tvshowid, True), None)
+
+    def _remove_episode(self, episodeid):
+        tvshowid = self.episodes.pop(episodeid, None)
+        if tvshowid is None:
+            return
+        self._indexes.pop((tvshowid, False), None)
+        self._indexes.pop((tvshowid, True), None)
+        episodes = self.tvshows[tvshowid]
+        del episodes[episodeid]
+        if not episodes:
+            del self.tvshows[tvshowid]
+
+    def _set_movie(self, record):
+        self._remove_movie(record.movieid)
+        # Only movies in sets are needed
+        if not record.setid:
+            return
+        self.movies[record.movieid] = record.setid
+        self.sets.setdefault(record.setid, {})[record.movieid] = record
+
+    def _remove_movie(self, movieid):
+        setid = self.movies.pop(movieid, None)
+        if setid is None:
+            return
+        movies = self.sets[setid]
+        del movies[movieid]
+        if not movies:
+            del self.sets[setid]
+
+    def _get_index(self, tvshowid, unwatched_only):
+        """Returns index of all or only unwatched episodes of the tvshow,
+           built when first used after the tvshow episodes have changed"""
+
+        index = self._indexes.get((tvshowid, unwatched_only))
+        if index is None:
+            episodes = self.tvshows[tvshowid].values()
+            if unwatched_only:
+                episodes = [record for record in episodes
+                            if record.playcount < 1]
+            index = _ShowIndex(episodes)
+            self._indexes[(tvshowid, unwatched_only)] = index
+        return index
+
+    def _get_next_episodeid(self, episode, next_season, unwatched_only, random):
+        """Returns episodeid of next episode, None if there is no next episode,
+           or constants.UNDEFINED if the tvshow is not in the snapshot"""
+
+        tvshowid = utils.get_int(episode, 'tvshowid')
+        if tvshowid not in self.tvshows:
+            return constants.UNDEFINED
+        index = self._get_index(tvshowid, unwatched_only)
+
+        path, filename = os.path.split(episode['file'])
+        accept = partial(_is_other_file, path=path, filename=filename)
+
+        if random:
+            candidates = [
+                record for record in index.by_date if accept(record)
+            ]
+            return randchoice(candidates).episodeid if candidates else None
+
+        season = utils.get_int(episode, 'season')
+        number = utils.get_int(episode, 'episode')
+        aired = episode.get('firstaired')
+
+        if not next_season:
+            record = index.next_episode(season, number, accept)
+        elif aired:
+            aired = utils.iso_datetime(aired).split()[0]
+            record = index.next_aired(aired, number, accept)
+        else:
+            candidates = [
+                record for record in (
+                    index.next_episode(season, number, accept),
+                    index.next_season(season, accept),
+                ) if record
+            ]
+            record = min(candidates, key=_DATE_ORDER) if candidates else None
+
+        return record.episodeid if record else None
+
+    def _get_next_movieid(self, movie, unwatched_only, random):
+        """Returns movieid of next movie, None if there is no next movie, or
+           constants.UNDEFINED if the movie set is not in the snapshot"""
+
+        movies = self.sets.get(utils.get_int(movie, 'setid'))
+        if not movies:
+            return constants.UNDEFINED
+
+        path, filename = os.path.split(movie['file'])
+        year = utils.get_int(movie, 'year', 0)
+
+        candidates = [
+            record for record in movies.values()
+            if _is_other_file(record, path, filename)
+            and not (unwatched_only and record.playcount > 0)
+        ]
+
+        if random:
+            return randchoice(candidates).movieid if candidates else None
+
+        candidates = [record for record in candidates if record.year > year]
+        return min(candidates, key=_YEAR_ORDER).movieid if candidates else None
+
+    def get_next_from_library(self, item,
+                              next_season=True,
+                              unwatched_only=False,
+                              random=False):
+        """Returns details of next episode in tvshow, or next movie in set,
+           using the snapshot to find the next video. Falls back to searching
+           the Kodi library if the snapshot can not be used"""
+
+        db_type = item['type']
+        details = item['details']
+        next_id = constants.UNDEFINED
+
+        if self._enabled and details and db_type in ('episode', 'movie'):
+            with self._lock:
+                if not self._update():
+                    next_id = constants.UNDEFINED
+                elif db_type == 'episode':
+                    next_id = self._get_next_episodeid(
+                        details, next_season, unwatched_only, random
+                    )
+                else:
+                    next_id = self._get_next_movieid(
+                        details, unwatched_only, random
+                    )
+
+        if next_id is None:
+            self.log('No next {0} found in library snapshot'.format(db_type))
+            return None
+
+        if next_id != constants.UNDEFINED:
+            video, _ = api.get_details_from_library(db_type=db_type,
+                                                    db_id=next_id)
+            if video:
+                # Episode details are combined with current tvshow details
+                if db_type == 'episode':
+                    video = dict(details, **video)
+                self.log('Next {0} from library snapshot: {1}'.format(
+                    db_type, video
+                ))
+                return video
+
+        return api.get_next_from_library(item=item,
+                                         next_season=next_season,
+                                         unwatched_only=unwatched_only,
+                                         random=random)
+
+
+SNAPSHOT = LibrarySnapshot()
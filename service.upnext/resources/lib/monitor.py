@@ -8,9 +8,11 @@ from time import time
 import api
 import constants
 import detector
+import library
 import subtitle_end_detector
 import player
 import popuphandler
+import similar_index
 import simulation
 import state
 import statichelper
@@ -29,9 +31,15 @@ class UpNextMonitor(xbmc.Monitor, object):
         '_started',
         '_detector',
         '_popuphandler',
+        '_played_item',
+        '_prescan',
+        '_prescan_time',
+        '_similar_update',
         'detector',
+        'library',
         'player',
         'popuphandler',
+        'similar_updates',
         'state',
     )
 
@@ -48,10 +56,16 @@ class UpNextMonitor(xbmc.Monitor, object):
 
         self._detector = None
         self._popuphandler = None
+        self._played_item = None
+        self._prescan = None
+        self._prescan_time = 0
+        self._similar_update = None
 
         self.detector = None
+        self.library = library.SNAPSHOT
         self.player = None
         self.popuphandler = None
+        self.similar_updates = similar_index.UPDATES
         self.state = None
 
         super(UpNextMonitor, self).__init__()
@@ -187,6 +201,8 @@ class UpNextMonitor(xbmc.Monitor, object):
         self.state.playing_next = False
 
         data, _ = utils.decode_data(serialised_json=kwargs.get('data'))
+        item = data.get('item') if isinstance(data, dict) else None
+        self._played_item = item and (item.get('type'), item.get('id'))
         # Check whether UpNext can start tracking
         self._check_video(player_data=data)
 
@@ -238,6 +254,53 @@ class UpNextMonitor(xbmc.Monitor, object):
         else:
             self.state.reset_item()
 
+    def _event_handler_library_remove(self, **kwargs):
+        data, _ = utils.decode_data(serialised_json=kwargs.get('data'))
+        if not data or not isinstance(data, dict):
+            return
+        item = data.get('item', data)
+
+        # Removal of a tvshow or set reloads the whole snapshot
+        self.library.invalidate(item.get('type'), item.get('id'))
+        if item.get('type') in ('movie', 'tvshow') and item.get('id'):
+            self.similar_updates.invalidate(item['type'] + 's', item['id'])
+            self._launch_similar_update()
+
+    def _event_handler_library_scan(self, **_kwargs):
+        self.library.invalidate()
+        # Reload snapshot now, rather than when the next video is required
+        utils.run_threaded(self.library.update)
+        # Check for added/removed videos when similar videos index is updated
+        for db_type in ('movies', 'tvshows'):
+            self.similar_updates.invalidate(db_type)
+        self._launch_similar_update()
+
+    def _event_handler_library_update(self, **kwargs):
+        data, _ = utils.decode_data(serialised_json=kwargs.get('data'))
+        if not data or not isinstance(data, dict):
+            return
+        item = data.get('item', data)
+
+        # Only episode and movie details are stored in the snapshot
+        if item.get('type') in ('episode', 'movie'):
+            self.library.invalidate(item['type'], item.get('id'))
+        # Videos added by a library scan are indexed when the scan finishes
+        if (item.get('type') not in ('movie', 'tvshow') or not item.get('id')
+                or data.get('added')):
+            return
+        playcount = data.get('playcount')
+        # Resume point of the last played video is updated when playback is
+        # stopped, which does not change any indexed details
+        if (playcount is None
+                and (item['type'], item['id']) == self._played_item):
+            self._played_item = None
+            return
+        # Only update playcount in similar videos index if that is all that
+        # changed, otherwise index the video again
+        self.similar_updates.invalidate(item['type'] + 's', item['id'],
+                                        playcount=playcount)
+        self._launch_similar_update()
+
     def _event_handler_screensaver_off(self, **kwargs):
         # Don't handle event if Kodi is shutting down
         data, _ = utils.decode_data(serialised_json=kwargs.get('data'))
@@ -355,6 +418,109 @@ class UpNextMonitor(xbmc.Monitor, object):
         )
         sub_detector.detect(file_path)
 
+    def _launch_subtitle_prescan(self):
+        if not SETTINGS.detect_subtitles_prescan:
+            return
+        # Exit if pre-scan is already running or ran recently
+        if self._prescan and self._prescan.is_alive():
+            return
+        now = int(time())
+        if now - self._prescan_time < constants.SUBTITLE_PRESCAN_PERIOD:
+            return
+        if not self.player or self.player.isPlaying():
+            return
+
+        self._prescan_time = now
+        self._prescan = utils.run_threaded(self._subtitle_prescan)
+
+    def _subtitle_prescan_wait(self, delay):
+        # Wait for the delay, then pause while anything is playing. Returns
+        # False if pre-scan should be stopped
+        while not self.waitForAbort(delay):
+            if not self._started or not SETTINGS.detect_subtitles_prescan:
+                return False
+            if not self.player or not self.player.isPlaying():
+                return True
+        return False
+
+    def _subtitle_prescan(self):
+        self.log('Subtitle pre-scan started', utils.LOGINFO)
+
+        # Get next-up episode of each in-progress show, then the following
+        # episodes of the same show, using the same queries as widgets
+        episodes = api.get_upnext_episodes_from_library(
+            limit=constants.SUBTITLE_PRESCAN_SHOWS,
+            next_season=SETTINGS.next_season,
+            unwatched_only=True,
+            resume_from_end=SETTINGS.resume_from_end
+        )
+
+        scanned = 0
+        for episode in episodes:
+            for _ in range(constants.SUBTITLE_PRESCAN_EPISODES):
+                file_path = episode.get('file')
+                if file_path and not file_path.startswith(
+                        ('plugin://', 'stack://')
+                ):
+                    if not self._subtitle_prescan_wait(
+                            constants.SUBTITLE_PRESCAN_DELAY
+                    ):
+                        self.log('Subtitle pre-scan stopped', utils.LOGINFO)
+                        return
+                    # Result is stored in the subtitle cache for later use
+                    subtitle_end_detector.find_last_subtitle_timestamp(
+                        file_path
+                    )
+                    scanned += 1
+
+                episode = api.get_next_episode_from_library(
+                    episode=episode,
+                    next_season=SETTINGS.next_season,
+                    unwatched_only=True
+                )
+                if not episode:
+                    break
+
+        self.log('Subtitle pre-scan finished: {0} files'.format(scanned),
+                 utils.LOGINFO)
+
+    def _launch_similar_update(self):
+        # Exit if update is already scheduled or running, as it will apply
+        # any changes notified before it finishes
+        if self._similar_update and self._similar_update.is_alive():
+            return
+
+        # Delay update to collect changes notified in quick succession
+        self._similar_update = utils.run_threaded(
+            self._update_similar_index,
+            delay=constants.SIMILAR_INDEX_UPDATE_DELAY
+        )
+
+    def _update_similar_index(self):
+        # Indexing added videos is slow, so only update the index while
+        # nothing is playing. Pending changes are kept for the next update
+        while self._started:
+            player = self.player
+            if not player or player.isPlaying():
+                break
+            updates, sync = self.similar_updates.pop()
+            for db_type in ('movies', 'tvshows'):
+                db_updates = updates.get(db_type)
+                db_sync = db_type in sync
+                # Stop requesting details of videos if playback starts
+                if not player.isPlaying() and api.update_similar_index(
+                        db_type,
+                        updates=db_updates,
+                        sync=db_sync,
+                        stop=player.isPlaying,
+                ):
+                    continue
+                # Keep changes that were not applied for the next update
+                if player.isPlaying():
+                    self.similar_updates.restore(db_type, db_updates, db_sync)
+            if not self.similar_updates.pending():
+                break
+
     def _launch_detector(self):
         del self._detector
         self._detector = None
@@ -558,6 +724,10 @@ class UpNextMonitor(xbmc.Monitor, object):
 
         self._started = True
 
+        # Load library snapshot used to find the next video to play
+        self.library.enable()
+        utils.run_threaded(self.library.update)
+
         # Re-trigger player play/start event if addon started mid playback
         if SETTINGS.start_trigger and self.player.isPlaying():
             # This is a fake event, use Other.OnAVStart
@@ -569,11 +739,16 @@ class UpNextMonitor(xbmc.Monitor, object):
 
         # Set initial idle state for widget refresh
         delta = self._widget_reload(init=True)
+        self._launch_similar_update()
+        self._launch_subtitle_prescan()
 
         # Wait indefinitely until addon is terminated, but periodically
-        # update widgets
+        # update widgets, build or sync the similar videos index, and pre-scan
+        # upcoming episodes
         while not self.waitForAbort(SETTINGS.widget_refresh_period - delta):
             delta = self._widget_reload()
+            self._launch_similar_update()
+            self._launch_subtitle_prescan()
 
         # Cleanup when abort requested
         self.stop()
@@ -584,6 +759,7 @@ class UpNextMonitor(xbmc.Monitor, object):
         # Free references/resources
         self._stop_detector(terminate=True)
         self._stop_popuphandler(terminate=True)
+        self.library.disable()
         self.waitForAbort(1)
 
         del self.state
@@ -621,7 +797,11 @@ class UpNextMonitor(xbmc.Monitor, object):
             else _event_handler_player_start if SETTINGS.early_queue_reset
             else None
         ),
-        'Player.OnStop': _event_handler_player_stop
+        'Player.OnStop': _event_handler_player_stop,
+        'VideoLibrary.OnCleanFinished': _event_handler_library_scan,
+        'VideoLibrary.OnRemove': _event_handler_library_remove,
+        'VideoLibrary.OnScanFinished': _event_handler_library_scan,
+        'VideoLibrary.OnUpdate': _event_handler_library_update,
     }
 
     # pylint: disable=invalid-name
@@ -640,6 +820,12 @@ class UpNextMonitor(xbmc.Monitor, object):
         if not handler:
             return
 
+        # Library events only update the library snapshot, and are not counted
+        # in the queue so that they do not cause player events to be skipped
+        if method.startswith('VideoLibrary.'):
+            handler(self, sender=sender, data=data)
+            return
+
         # Player events can fire in quick succession, increment queue length to
         # allow event handlers to skip through the queue
         self._queue_length += 1
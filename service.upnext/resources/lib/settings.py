@@ -26,6 +26,9 @@ class UpNextSettings(object):
         'detect_chapters_threshold',
         'detect_subtitles_threshold',
         'detect_subtitles_max_pct',
+        'detect_subtitles_prescan',
+        'detect_subtitles_languages',
+        'detect_subtitles_keywords',
         'detect_subtitles',
         'detect_enabled',
         'detect_level',
@@ -71,6 +74,7 @@ class UpNextSettings(object):
         'skin_popup',
         'start_delay',
         'start_trigger',
+        'subtitle_stats',
         'unwatched_only',
         'widget_debug',
         'widget_enable_cast',
@@ -253,6 +257,19 @@ class UpNextSettings(object):
         self.detect_chapters_threshold = self.get_int('detectChaptersThreshold')
         self.detect_subtitles_threshold = self.get_int('detectSubtitlesThreshold')
         self.detect_subtitles_max_pct = self.get_int('detectSubtitlesMaxPercent')
+        self.detect_subtitles_prescan = (
+            self.detect_subtitles and self.get_bool('detectSubtitlesPrescan')
+        )
+        self.detect_subtitles_languages = tuple(
+            language.strip().lower() for language
+            in self.get_string('detectSubtitlesLanguages').split(',')
+            if language.strip()
+        )
+        self.detect_subtitles_keywords = tuple(
+            keyword.strip().lower() for keyword
+            in self.get_string('detectSubtitlesKeywords').split(',')
+            if keyword.strip()
+        )
 
         self.enable_queue = self.get_bool('enableQueue')
         self.early_queue_reset = self.get_bool('earlyQueueReset')
@@ -301,6 +318,7 @@ class UpNextSettings(object):
         self.widget_debug = self.get_bool('widgetDebug')
 
         self.start_trigger = self.get_bool('startTrigger')
+        self.subtitle_stats = self.get_bool('subtitleStats')
 
         self._store = None
 
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements a SQLite database used to store an inverted index of genres,
+   cast/crew, plot/title, set name and tag tokens of library videos, used to
+   find similar videos without querying and comparing every library video"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import time
+
+import constants
+import utils
+from sqlite_store import SQLiteStore
+
+
+class SimilarIndex(SQLiteStore):
+    """Class to store video tokens, as posting lists per token, and to search
+       for videos matching the tokens of an original video"""
+
+    __slots__ = ()
+
+    _FILENAME = constants.SIMILAR_INDEX_FILENAME
+
+    # Order of token fields, as stored in postings and videos tables
+    FIELDS = ('genres', 'cast', 'crew', 'fuzz', 'set_name', 'tags')
+
+    # Increment when tokenisation changes to rebuild existing indexes
+    VERSION = 1
+
+    # Maximum number of variables in a single SQLite statement
+    _MAX_VARIABLES = 500
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS synced ('
+        ' db_type TEXT PRIMARY KEY,'
+        ' version INTEGER NOT NULL,'
+        ' checked REAL NOT NULL'
+        ')',
+        'CREATE TABLE IF NOT EXISTS videos ('
+        ' db_type TEXT NOT NULL,'
+        ' db_id INTEGER NOT NULL,'
+        ' playcount INTEGER NOT NULL,'
+        ' rating REAL NOT NULL,'
+        ' genres_len INTEGER NOT NULL,'
+        ' cast_len INTEGER NOT NULL,'
+        ' crew_len INTEGER NOT NULL,'
+        ' fuzz_len INTEGER NOT NULL,'
+        ' set_name_len INTEGER NOT NULL,'
+        ' tags_len INTEGER NOT NULL,'
+        ' PRIMARY KEY (db_type, db_id)'
+        ')',
+        'CREATE TABLE IF NOT EXISTS postings ('
+        ' db_type TEXT NOT NULL,'
+        ' field INTEGER NOT NULL,'
+        ' token TEXT NOT NULL,'
+        ' db_id INTEGER NOT NULL,'
+        ' PRIMARY KEY (db_type, field, token, db_id)'
+        ') WITHOUT ROWID',
+        'CREATE INDEX IF NOT EXISTS postings_video'
+        ' ON postings (db_type, db_id)',
+    )
+
+    @staticmethod
+    def _remove(connection, db_type, db_ids):
+        connection.executemany(
+            'DELETE FROM postings WHERE db_type = ? AND db_id = ?',
+            [(db_type, db_id) for db_id in db_ids]
+        )
+        connection.executemany(
+            'DELETE FROM videos WHERE db_type = ? AND db_id = ?',
+            [(db_type, db_id) for db_id in db_ids]
+        )
+
+    def get_videos(self, db_type, period=constants.SIMILAR_INDEX_SYNC_PERIOD):
+        """Returns a dict of (playcount, rating) tuples of indexed videos,
+           keyed by db_id, False if the index was synced within period seconds
+           and does not need to be updated, or None if index is unusable"""
+
+        def _get_videos(connection):
+            result = connection.execute(
+                'SELECT version, checked FROM synced WHERE db_type = ?',
+                (db_type, )
+            ).fetchone()
+            if result and result[0] != self.VERSION:
+                self._remove(connection, db_type, [
+                    db_id for db_id, in connection.execute(
+                        'SELECT db_id FROM videos WHERE db_type = ?',
+                        (db_type, )
+                    )
+                ])
+            elif result and time.time() - result[1] < period:
+                return False
+
+            return {
+                db_id: (playcount, rating)
+                for db_id, playcount, rating in connection.execute(
+                    'SELECT db_id, playcount, rating FROM videos'
+                    ' WHERE db_type = ?',
+                    (db_type, )
+                )
+            }
+
+        return self._execute(_get_videos)
+
+    def save(self, db_type, added=(), updated=(), removed=(), synced=True):
+        """Add videos, as (db_id, playcount, rating, tokens) tuples where tokens
+           is a tuple of token sets in FIELDS order, update playcount and
+           rating of videos, as (db_id, playcount, rating) tuples where rating
+           is None if unchanged, and remove videos by db_id. Marks the index as
+           synced if all added/removed videos were checked"""
+
+        def _save(connection):
+            self._remove(connection, db_type, removed)
+            self._remove(connection, db_type, [video[0] for video in added])
+            connection.executemany(
+                'INSERT INTO videos (db_type, db_id, playcount, rating,'
+                ' genres_len, cast_len, crew_len, fuzz_len, set_name_len,'
+                ' tags_len)'
+                ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(db_type, db_id, playcount, rating)
+                 + tuple(len(values) for values in tokens)
+                 for db_id, playcount, rating, tokens in added]
+            )
+            connection.executemany(
+                'INSERT OR IGNORE INTO postings (db_type, field, token, db_id)'
+                ' VALUES (?, ?, ?, ?)',
+                [(db_type, field, token, db_id)
+                 for db_id, _, _, tokens in added
+                 for field, values in enumerate(tokens)
+                 for token in values]
+            )
+            connection.executemany(
+                'UPDATE videos'
+                ' SET playcount = ?, rating = COALESCE(?, rating)'
+                ' WHERE db_type = ? AND db_id = ?',
+                [(playcount, rating, db_type, db_id)
+                 for db_id, playcount, rating in updated]
+            )
+            if synced:
+                connection.execute(
+                    'INSERT OR REPLACE INTO synced (db_type, version, checked)'
+                    ' VALUES (?, ?, ?)',
+                    (db_type, self.VERSION, time.time())
+                )
+            return True
+
+        if not self._execute(_save):
+            return False
+        self.log('Indexed {0}: {1} added, {2} updated, {3} removed'.format(
+            db_type, len(added), len(updated), len(removed)
+        ))
+        return True
+
+    def search(self, db_type, tokens, unwatched_only=False):
+        """Returns list of (db_id, rating, matches, sizes) tuples for videos
+           with at least one matching genre, where matches is the number of
+           tokens of each field matching tokens and sizes is the number of
+           tokens of each field of the video, or None if index is unusable or
+           has not been built yet"""
+
+        def _search(connection):
+            # Index can only be searched once all videos have been indexed
+            synced = connection.execute(
+                'SELECT version FROM synced WHERE db_type = ?',
+                (db_type, )
+            ).fetchone()
+            if not synced or synced[0] != self.VERSION:
+                return None
+
+            matches = {}
+            for field, values in enumerate(tokens):
+                values = list(values)
+                for idx in range(0, len(values), self._MAX_VARIABLES):
+                    chunk = values[idx:idx + self._MAX_VARIABLES]
+                    for db_id, count in connection.execute(
+                            'SELECT db_id, COUNT(*) FROM postings'
+                            ' WHERE db_type = ? AND field = ?'
+                            ' AND token IN ({0}) GROUP BY db_id'.format(
+                                ', '.join('?' * len(chunk))
+                            ),
+                            [db_type, field] + chunk
+                    ):
+                        # Genres are searched first, and only videos with a
+                        # matching genre are candidates
+                        if not field:
+                            matches[db_id] = [count, 0, 0, 0, 0, 0]
+                        elif db_id in matches:
+                            matches[db_id][field] += count
+
+                if not field and not matches:
+                    return []
+
+            return [
+                (video[0], video[2], matches[video[0]], video[3:])
+                for video in connection.execute(
+                    'SELECT db_id, playcount, rating, genres_len, cast_len,'
+                    ' crew_len, fuzz_len, set_name_len, tags_len'
+                    ' FROM videos WHERE db_type = ?',
+                    (db_type, )
+                )
+                if video[0] in matches
+                and not (unwatched_only and video[1] > 0)
+            ]
+
+        return self._execute(_search)
+
+
+class SimilarIndexUpdates(object):
+    """Changes to library videos, collected by the service from library
+       notifications, and applied to the similar videos index in a single
+       transaction when the index is next updated"""
+
+    __slots__ = (
+        '_lock',
+        '_sync',
+        '_updates',
+    )
+
+    def __init__(self):
+        self._lock = utils.create_lock()
+        # Set of db_types to check for added/removed videos
+        self._sync = set()
+        # Map of db_type to dict of new playcount, or None if other details
+        # changed, keyed by db_id
+        self._updates = {}
+
+    def invalidate(self, db_type, db_id=None, playcount=None):
+        """Mark playcount or other details of a video as changed, or all videos
+           of db_type as possibly added/removed if db_id is not provided"""
+
+        with self._lock:
+            if db_id is None:
+                self._sync.add(db_type)
+                return
+
+            updates = self._updates.setdefault(db_type, {})
+            # New playcount does not replace a pending update of all details
+            if playcount is None or updates.get(db_id, 0) is not None:
+                updates[db_id] = playcount
+
+    def pending(self):
+        return bool(self._sync or self._updates)
+
+    def restore(self, db_type, updates=None, sync=False):
+        """Add back popped updates of db_type that could not be applied,
+           without replacing changes notified since they were popped"""
+
+        with self._lock:
+            if sync:
+                self._sync.add(db_type)
+            if not updates:
+                return
+
+            pending = self._updates.setdefault(db_type, {})
+            for db_id, playcount in updates.items():
+                if playcount is None or db_id not in pending:
+                    pending[db_id] = playcount
+
+    def pop(self):
+        """Returns and clears dict of pending updates and set of db_types to
+           check for added/removed videos"""
+
+        with self._lock:
+            updates, self._updates = self._updates, {}
+            sync, self._sync = self._sync, set()
+        return updates, sync
+
+
+UPDATES = SimilarIndexUpdates()
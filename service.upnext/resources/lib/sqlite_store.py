@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements a base class for the SQLite databases stored by the addon"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import sqlite3
+
+import file_utils
+import utils
+
+
+class SQLiteStore(object):
+    """Base class to open a connection to a SQLite database, create the tables
+       defined in _SCHEMA, and run queries in a single transaction"""
+
+    __slots__ = (
+        'path',
+    )
+
+    # Filename of database in addon profile directory, if path not provided
+    _FILENAME = None
+    # Statements used to create tables and indexes
+    _SCHEMA = ()
+
+    # Lock for each database path, shared by all instances to serialise access
+    # from different threads, and paths where the schema has been created
+    _locks = {}
+    _initialised = set()
+    _shared_lock = utils.create_lock()
+
+    def __init__(self, path=None):
+        if not path and self._FILENAME:
+            path = file_utils.make_legal_path(utils.get_addon_info('profile'))
+            path = path and ''.join((path, self._FILENAME))
+        self.path = path
+
+    @classmethod
+    def log(cls, msg, level=utils.LOGDEBUG):
+        utils.log(msg, name=cls.__name__, level=level)
+
+    def _get_lock(self):
+        with self._shared_lock:
+            lock = self._locks.get(self.path)
+            if lock is None:
+                lock = self._locks.setdefault(self.path, utils.create_lock())
+        return lock
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute('PRAGMA synchronous = NORMAL')
+        # Only create tables on first use of the database by this process
+        if self.path not in self._initialised:
+            with connection:
+                for statement in self._SCHEMA:
+                    connection.execute(statement)
+            self._initialised.add(self.path)
+        return connection
+
+    def _execute(self, function, msg='Database error'):
+        """Run function with an open connection in a single transaction, and
+           return the result, or None if the database could not be used"""
+
+        if not self.path:
+            return None
+
+        try:
+            with self._get_lock():
+                connection = self._connect()
+                try:
+                    with connection:
+                        return function(connection)
+                finally:
+                    connection.close()
+        except sqlite3.Error as error:
+            # Create tables again on next use in case database was removed
+            self._initialised.discard(self.path)
+            self.log('{0}: {1}'.format(msg, error), utils.LOGWARNING)
+            return None
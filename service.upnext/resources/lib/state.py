@@ -5,6 +5,7 @@ from __future__ import absolute_import, division, unicode_literals
 
 import api
 import constants
+import library
 import upnext
 import utils
 from settings import SETTINGS
@@ -152,7 +153,7 @@ class UpNextState(object):  # pylint: disable=too-many-public-methods
 
         # Next video from Kodi library
         else:
-            next_video = api.get_next_from_library(
+            next_video = library.SNAPSHOT.get_next_from_library(
                 item=self.current_item,
                 next_season=SETTINGS.next_season,
                 unwatched_only=SETTINGS.unwatched_only,
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Implements a SQLite database used to store subtitle end detection results
+   for video files, so that files do not need to be parsed again when
+   resumed or rewatched"""
+
+from __future__ import absolute_import, division, unicode_literals
+
+import json
+import time
+
+import constants
+import xbmcvfs
+from sqlite_store import SQLiteStore
+
+
+class SubtitleEndCache(SQLiteStore):
+    """Class to store/load subtitle end detection results for a file path,
+       invalidated when the file size or modification time changes"""
+
+    __slots__ = ()
+
+    _FILENAME = constants.SUBTITLE_CACHE_FILENAME
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS subtitle_ends ('
+        ' file_path TEXT PRIMARY KEY,'
+        ' file_size INTEGER NOT NULL,'
+        ' file_mtime INTEGER NOT NULL,'
+        ' version INTEGER NOT NULL,'
+        ' end_time REAL,'
+        ' duration REAL,'
+        ' tracks TEXT,'
+        ' checked REAL NOT NULL,'
+        ' last_used REAL NOT NULL'
+        ')',
+        'CREATE INDEX IF NOT EXISTS subtitle_ends_last_used'
+        ' ON subtitle_ends (last_used)',
+    )
+
+    @staticmethod
+    def fingerprint(file_path):
+        """Returns a tuple of file size and modification time, used to check
+           whether cached results are still valid, or None if not available"""
+
+        try:
+            stat = xbmcvfs.Stat(file_path)
+            size = stat.st_size()
+            mtime = stat.st_mtime()
+        except (AttributeError, RuntimeError, TypeError):
+            size = mtime = 0
+
+        # Stat is not supported by all VFS implementations, e.g. http://
+        if not size:
+            file_obj = None
+            try:
+                file_obj = xbmcvfs.File(file_path)
+                size = file_obj.size()
+            except (AttributeError, RuntimeError, TypeError):
+                size = 0
+            finally:
+                if file_obj:
+                    file_obj.close()
+
+        if not size:
+            return None
+        return int(size), int(mtime or 0)
+
+    def load(self, file_path, fingerprint, version,
+             negative_ttl=constants.SUBTITLE_CACHE_NEGATIVE_TTL):
+        """Returns a dict of end_time, duration and tracks for the file_path,
+           or None if nothing valid was stored. Results where no end time was
+           found are only used for negative_ttl seconds"""
+
+        if not fingerprint:
+            return None
+
+        def _load(connection):
+            now = time.time()
+            result = connection.execute(
+                'SELECT end_time, duration, tracks, checked'
+                ' FROM subtitle_ends WHERE file_path = ?'
+                ' AND file_size = ? AND file_mtime = ? AND version = ?',
+                (file_path, fingerprint[0], fingerprint[1], version)
+            ).fetchone()
+            if not result:
+                return None
+            if result[0] is None and now - result[3] > negative_ttl:
+                return None
+
+            # Mark result as recently used
+            connection.execute(
+                'UPDATE subtitle_ends SET last_used = ? WHERE file_path = ?',
+                (now, file_path)
+            )
+
+            end_time, duration, tracks, _ = result
+            return {
+                'end_time': end_time,
+                'duration': duration,
+                'tracks': json.loads(tracks) if tracks else [],
+            }
+
+        return self._execute(
+            _load, 'Could not load result for {0}'.format(file_path)
+        )
+
+    def save(self, file_path, fingerprint, version, end_time, duration,
+             tracks, max_entries=constants.SUBTITLE_CACHE_MAX_ENTRIES):
+        """Store end_time (or None if not found), duration and list of tracks
+           used for the file_path, then prune least recently used results"""
+
+        if not fingerprint:
+            return False
+
+        def _save(connection):
+            now = time.time()
+            connection.execute(
+                'INSERT OR REPLACE INTO subtitle_ends (file_path, file_size,'
+                ' file_mtime, version, end_time, duration, tracks, checked,'
+                ' last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (file_path, fingerprint[0], fingerprint[1], version,
+                 end_time, duration, json.dumps(list(tracks or [])), now, now)
+            )
+            if max_entries:
+                connection.execute(
+                    'DELETE FROM subtitle_ends WHERE file_path NOT IN ('
+                    ' SELECT file_path FROM subtitle_ends'
+                    ' ORDER BY last_used DESC LIMIT ?'
+                    ')',
+                    (max_entries, )
+                )
+            return True
+
+        if not self._execute(
+                _save, 'Could not save result for {0}'.format(file_path)
+        ):
+            return False
+
+        self.log('Saved result for {0}: {1}'.format(file_path, end_time))
+        return True
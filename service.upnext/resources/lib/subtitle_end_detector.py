@@ -1,11 +1,23 @@
 from __future__ import absolute_import, division, unicode_literals
 
+import codecs
+import heapq
+import mmap
+import os
+import re
 import struct
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
+import constants
+import file_utils
+import subtitle_end_cache
 import utils
 import xbmc
 import xbmcvfs
 import time
+import zlib
 from settings import SETTINGS
 
 # EBML element IDs
@@ -17,6 +29,7 @@ _SEEK_ID = 0x53AB
 _SEEK_POSITION = 0x53AC
 _INFO = 0x1549A966
 _TIMECODE_SCALE = 0x2AD7B1
+_DURATION = 0x4489
 _TRACKS = 0x1654AE6B
 _TRACK_ENTRY = 0xAE
 _TRACK_NUMBER = 0xD7
@@ -37,13 +50,94 @@ _BLOCK_GROUP = 0xA0
 _BLOCK = 0xA1
 _BLOCK_DURATION = 0x9B
 
+_EMPTY = memoryview(b'')
+
 _TRACK_TYPE_SUBTITLE = 17
 _SUPPORTED_CODECS = frozenset({
-    'S_TEXT/UTF8', 'S_TEXT/ASS', 'S_TEXT/SSA', 'S_TEXT/WEBVTT',
+    'S_TEXT/UTF8', 'S_TEXT/ASS', 'S_TEXT/SSA', 'S_TEXT/WEBVTT', 'TX3G', 'WVTT',
 })
 
 # Number of last clusters to examine when looking for the final subtitle
 _LAST_N_CLUSTERS = 10
+# Number of last subtitles of each track to search for end keywords
+_LAST_N_BLOCKS = 5
+
+# Keywords used to find end-of-episode subtitles e.g. subtitle credits, for
+# all languages and for each language that can be selected in settings
+_END_KEYWORDS = ('♪', )
+_LANGUAGE_END_KEYWORDS = {
+    'en': (
+        'subtitles', 'subtitling', 'adaptation', 'captioning', 'caption',
+        'captioned', 'credits', 'music', 'end', 'ending', 'outro',
+    ),
+    'fr': ('sous-titres', 'traduction', 'adaptation', 'fin'),
+    'es': ('subtitulado', 'traducción', 'fin'),
+    'ru': ('перевод субтитров', ),
+}
+
+# Number of bytes at the end of the file to scan for clusters if there are no
+# Cues, and the Cluster element ID used to find the start of each cluster
+_TAIL_SCAN_SIZE = 8 * 1024 * 1024
+_CLUSTER_ID = struct.pack('>I', _CLUSTER)
+
+# Max number of concurrent reads, and max size of each read, used to prefetch
+# the last clusters of network files
+_PREFETCH_THREADS = 4
+_PREFETCH_MAX_SIZE = 8 * 1024 * 1024
+
+# Version of stored results, increment when detection logic changes
+_CACHE_VERSION = 1
+
+# Codec IDs of sidecar subtitle file extensions, and file name tags used for
+# SDH subtitles e.g. video.en.sdh.srt
+_SIDECAR_CODECS = {
+    '.srt': 'S_TEXT/UTF8',
+    '.ass': 'S_TEXT/ASS',
+    '.ssa': 'S_TEXT/SSA',
+    '.vtt': 'S_TEXT/WEBVTT',
+}
+_SIDECAR_SDH_TAGS = frozenset({'sdh', 'hi', 'cc'})
+# Number of bytes at the end of sidecar subtitle files to read
+_SIDECAR_TAIL_SIZE = 64 * 1024
+# Key used to store results of the sidecar files of a video file
+_SIDECAR_CACHE_KEY = '{0}#sidecars'
+
+_CUE_TIMING_RE = re.compile(
+    r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})\s*-->\s*'
+    r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})'
+)
+_ASS_TIME_RE = re.compile(r'(\d+):(\d{2}):(\d{2})[.:](\d{1,3})')
+_MARKUP_RE = re.compile(r'<[^>]*>|\{[^}]*\}')
+
+# MP4 handler types and sample entry formats of text subtitle tracks
+_MP4_HANDLERS = frozenset({b'sbtl', b'text', b'subt'})
+_MP4_TEXT_FORMATS = frozenset({b'tx3g', b'wvtt'})
+_MP4_MAX_MOOV_SIZE = 64 * 1024 * 1024
+# Number of last samples per track to read, and max size of empty samples
+_MP4_LAST_N_SAMPLES = 10
+_MP4_EMPTY_SAMPLE_SIZE = 8
+
+
+# pylint: disable-next=dangerous-default-value
+def _get_end_keyword_matcher(_cache={}):
+    """Return a compiled regex matching any end keyword for the languages and
+    additional keywords set in settings. Rebuilt only if settings change."""
+    key = (SETTINGS.detect_subtitles_languages, SETTINGS.detect_subtitles_keywords)
+    matcher = _cache.get(key)
+    if matcher is None:
+        keywords = set(_END_KEYWORDS)
+        keywords.update(SETTINGS.detect_subtitles_keywords)
+        for language in SETTINGS.detect_subtitles_languages:
+            keywords.update(_LANGUAGE_END_KEYWORDS.get(language, ()))
+        # Longest keywords first so that alternation matches as much as
+        # possible, although only whether there is a match is used
+        matcher = re.compile('|'.join(
+            re.escape(keyword)
+            for keyword in sorted(keywords, key=len, reverse=True)
+        ), re.IGNORECASE | re.UNICODE)
+        _cache.clear()
+        _cache[key] = matcher
+    return matcher
 
 
 # ── EBML utility functions ────────────────────────────────────────────────────
@@ -127,6 +221,24 @@ def _peek_block_track(reader, block_size):
     return None
 
 
+def _push_largest(heap, values, value, limit):
+    """Add value to heap, a min-heap of the largest distinct values, and to the
+    values set of heap items, keeping at most limit items. Returns a tuple of
+    whether value was added and the value removed from the heap, or None."""
+    if value in values:
+        return False, None
+    removed = None
+    if len(heap) < limit:
+        heapq.heappush(heap, value)
+    elif value > heap[0]:
+        removed = heapq.heapreplace(heap, value)
+        values.discard(removed)
+    else:
+        return False, None
+    values.add(value)
+    return True, removed
+
+
 def _read_block_header(data):
     if len(data) < 4:
         return None, 0, 0, 0
@@ -151,74 +263,325 @@ def _read_block_header(data):
 # ── Buffered reader ───────────────────────────────────────────────────────────
 
 class _BufferedReader(object):
-    def __init__(self, file_obj, buffer_size=65536):
+    """
+    Read a file in fixed size blocks, keeping a small LRU cache of recently
+    read blocks so that seeking back to a nearby position does not require
+    another request.
+
+    Reads within a block are returned as memoryview slices of the block data,
+    without copying. Reads spanning blocks return a new bytearray.
+    """
+
+    def __init__(self, file_obj, buffer_size=65536, cache_blocks=8):
         self._file = file_obj
-        self._buffer = b''
-        self._buffer_pos = 0
+        self._block_size = buffer_size
+        self._cache_blocks = cache_blocks
+        self._blocks = OrderedDict()
+        self._block = _EMPTY
+        self._block_start = 0
         self._file_pos = 0
-        self._buffer_start = 0
-        self._buffer_size = buffer_size
-        self._eof = False
+        self._raw_pos = 0
+        # Number of bytes read and requests made to the underlying file
+        self.bytes_read = 0
+        self.read_requests = 0
+        self.seek_requests = 0
+        # Number of reads that returned less data than requested before the
+        # end of the file, as failed requests return no data rather than raise
+        self.short_reads = 0
+        self._size = None
 
     def tell(self):
         return self._file_pos
 
     def seek(self, offset):
-        if self._buffer_start <= offset < self._buffer_start + len(self._buffer):
-            self._buffer_pos = offset - self._buffer_start
-            self._file_pos = offset
-            return True
-        self._buffer = b''
-        self._buffer_pos = 0
-        self._buffer_start = offset
+        # Underlying file is only seeked when a block needs to be read
         self._file_pos = offset
-        self._eof = False
+        return True
+
+    def size(self):
+        if self._size is None:
+            try:
+                self._size = self._file.size()
+            except Exception:
+                self._size = 0
+        return self._size
+
+    def _check_read(self, pos, size, length):
+        if length < size and pos + length < self.size():
+            self.short_reads += 1
+
+    def _read_block(self, index):
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+            return block
+
+        block_start = index * self._block_size
+        if self._raw_pos != block_start:
+            try:
+                self._file.seek(block_start, 0)
+            except Exception:
+                return _EMPTY
+            self.seek_requests += 1
+            self._raw_pos = block_start
+
+        data = self._file.readBytes(self._block_size)
+        self.read_requests += 1
+        # Fill block if fewer bytes were returned than requested
+        while data and len(data) < self._block_size:
+            more = self._file.readBytes(self._block_size - len(data))
+            self.read_requests += 1
+            if not more:
+                break
+            data += more
+
+        block = memoryview(data) if data else _EMPTY
+        self.bytes_read += len(block)
+        self._raw_pos += len(block)
+
+        self._blocks[index] = block
+        if len(self._blocks) > self._cache_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def read(self, size):
+        pos = self._file_pos
+        block = self._block
+        offset = pos - self._block_start
+
+        # Fast path: read from current block
+        if 0 <= offset and offset + size <= len(block):
+            self._file_pos = pos + size
+            return block[offset:offset + size]
+
+        # Large reads are made using a single request, bypassing the cache
+        if size > 2 * self._block_size:
+            return self._read_direct(pos, size)
+
+        index, offset = divmod(pos, self._block_size)
+        block = self._read_block(index)
+        self._block = block
+        self._block_start = index * self._block_size
+
+        if offset + size <= len(block):
+            self._file_pos = pos + size
+            return block[offset:offset + size]
+
+        # Read spans multiple blocks, or reaches the end of the file
+        result = bytearray(block[offset:])
+        while len(result) < size and len(block) == self._block_size:
+            index += 1
+            block = self._read_block(index)
+            if not block:
+                break
+            self._block = block
+            self._block_start = index * self._block_size
+            result += block[:size - len(result)]
+
+        self._file_pos = pos + len(result)
+        self._check_read(pos, size, len(result))
+        return result
+
+    def _read_direct(self, pos, size):
+        if self._raw_pos != pos:
+            try:
+                self._file.seek(pos, 0)
+            except Exception:
+                self._check_read(pos, size, 0)
+                return _EMPTY
+            self.seek_requests += 1
+            self._raw_pos = pos
+
+        data = self._file.readBytes(size)
+        self.read_requests += 1
+        data = data or _EMPTY
+        self.bytes_read += len(data)
+        self._raw_pos += len(data)
+        self._file_pos = pos + len(data)
+        self._check_read(pos, size, len(data))
+        return data
+
+    def close(self):
+        self._blocks.clear()
+        self._block = _EMPTY
+        self._file.close()
+
+
+class _MappedReader(object):
+    """
+    Read a local file using a read-only memory map, with the same interface
+    as _BufferedReader, so that reads do not require any system calls.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
         try:
-            self._file.seek(offset, 0)
-            return True
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
         except Exception:
-            return False
+            self._file.close()
+            raise
+        self._file_pos = 0
+        self.bytes_read = 0
+        self.read_requests = 0
+        self.seek_requests = 0
+        # Mapped local files are always read in full
+        self.short_reads = 0
+
+    def tell(self):
+        return self._file_pos
+
+    def seek(self, offset):
+        self._file_pos = offset
+        return True
+
+    def size(self):
+        return len(self._map)
 
     def read(self, size):
-        result = b''
-        remaining = size
-        while remaining > 0:
-            available = len(self._buffer) - self._buffer_pos
-            if available > 0:
-                chunk_size = min(available, remaining)
-                result += self._buffer[self._buffer_pos:self._buffer_pos + chunk_size]
-                self._buffer_pos += chunk_size
-                self._file_pos += chunk_size
-                remaining -= chunk_size
-            if remaining > 0:
-                if self._eof:
-                    break
-                read_size = max(self._buffer_size, remaining)
-                data = self._file.readBytes(read_size)
-                if not data:
-                    self._eof = True
-                    break
-                self._buffer = bytes(data)
-                self._buffer_start = self._file_pos
-                self._buffer_pos = 0
-        return result
+        pos = self._file_pos
+        # Slicing copies data, but avoids memoryviews preventing the map from
+        # being closed
+        data = self._map[pos:pos + size]
+        self._file_pos = pos + len(data)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class _MemoryReader(object):
+    """
+    Read data that has already been read into memory, with the same interface
+    as _BufferedReader, using file positions starting from offset.
+    """
+
+    def __init__(self, data, offset=0):
+        self._data = memoryview(data)
+        self._offset = offset
+        self._file_pos = offset
+
+    def tell(self):
+        return self._file_pos
+
+    def seek(self, offset):
+        self._file_pos = offset
+        return True
+
+    def size(self):
+        return self._offset + len(self._data)
+
+    def read(self, size):
+        start = max(0, self._file_pos - self._offset)
+        data = self._data[start:start + size]
+        self._file_pos += len(data)
+        return data
+
+
+def _open_reader(file_path):
+    """Return a memory mapped reader for local files, otherwise a buffered
+    reader using xbmcvfs.File for network or other VFS paths."""
+    local_path = file_utils.get_local_path(file_path)
+    if local_path:
+        try:
+            return _MappedReader(local_path)
+        # Empty file or file too large to map on 32bit platforms
+        except (EnvironmentError, OverflowError, ValueError):
+            pass
+    return _BufferedReader(xbmcvfs.File(file_path))
+
+
+class _IOStats(object):
+    """
+    Time taken, bytes read and number of read/seek requests of each phase of
+    subtitle end detection. Counters are totals of all readers added to the
+    stats object, so readers opened during a phase are also counted.
+    """
+
+    PHASES = ('cache', 'header', 'seekhead', 'cues', 'clusters', 'tail',
+              'moov', 'samples', 'sidecar', 'select')
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = OrderedDict()  # phase -> [seconds, bytes, reads, seeks]
+        self._readers = []
+
+    def add_reader(self, reader):
+        if self.enabled:
+            self._readers.append(reader)
+        return reader
+
+    def _counters(self):
+        return [
+            sum(reader.bytes_read for reader in self._readers),
+            sum(reader.read_requests for reader in self._readers),
+            sum(reader.seek_requests for reader in self._readers),
+        ]
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        start_counters = self._counters()
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start_time
+            totals = self.phases.setdefault(name, [0, 0, 0, 0])
+            totals[0] += elapsed
+            for idx, (start, end) in enumerate(zip(start_counters, self._counters()), 1):
+                totals[idx] += end - start
+
+    def totals(self):
+        return [sum(values) for values in zip(*self.phases.values())] or [0, 0, 0, 0]
+
+    def publish(self, file_path, log):
+        """Log stats and set them as window properties, e.g.
+        UpNext.SubtitleStats.Bytes or UpNext.SubtitleStats.Cues.Time"""
+        if not self.enabled:
+            return
+
+        prefix = constants.SUBTITLE_STATS_PROPERTY_NAME
+        utils.set_property(prefix + '.File', file_path)
+        for name, values in [(None, self.totals())] + [
+                (name, self.phases.get(name)) for name in self.PHASES
+        ]:
+            key = prefix + ('.' + name.capitalize() if name else '')
+            if values is None:
+                for suffix in ('.Time', '.Bytes', '.Reads', '.Seeks'):
+                    utils.clear_property(key + suffix)
+                continue
+            seconds, bytes_read, reads, seeks = values
+            utils.set_property(key + '.Time', '{0:.3f}'.format(seconds))
+            utils.set_property(key + '.Bytes', str(bytes_read))
+            utils.set_property(key + '.Reads', str(reads))
+            utils.set_property(key + '.Seeks', str(seeks))
+            log('I/O stats {0}: {1:.3f}s, {2} bytes, {3} read(s), {4} seek(s)'.format(
+                name or 'total', seconds, bytes_read, reads, seeks
+            ), utils.LOGINFO)
 
 
 # ── MKV end parser ────────────────────────────────────────────────────────────
 
-class MKVEndParser(object):
+class SubtitleEndParser(object):
     """
-    Parse an MKV file to find the timestamp of the last subtitle entry.
+    Base class for parsers that find the timestamp of the last subtitle entry.
 
-    Uses Cues for efficient random access; when Cues are absent returns None
-    to avoid scanning the entire file over the network.
+    Subclasses implement _find_last_subtitle to collect subtitle blocks of
+    self._tracks, then use _select_tracks and _select_end_time so that track
+    priority, end keywords and thresholds are applied the same way for all
+    subtitle sources.
     """
 
     def __init__(self):
-        self._timecode_scale = 1000000  # default: 1 ns/unit → 1 ms per unit
-        self._segment_start = 0
         self._tracks = []  # list of (track_number, codec_id, track_name, forced_flag)
-        self._cues = []    # list of (cue_time, cue_track_or_None, cluster_pos)
+        self._duration = None
+        self._selected_tracks = []
+        self._complete = False
+        self._stats = _IOStats(SETTINGS.subtitle_stats)
 
     def _get_track_priority(self, track_info):
         """Return a priority tuple for sorting: (type_priority, track_number).
@@ -234,7 +597,7 @@ class MKVEndParser(object):
         return (type_priority, track_number)
 
     def _log(self, msg, level=utils.LOGINFO):
-        utils.log(msg, name='MKVEndParser', level=level)
+        utils.log(msg, name=self.__class__.__name__, level=level)
 
     def _get_max_end_percent(self):
         """Return max subtitle end percent (90-99%) as decimal"""
@@ -258,246 +621,293 @@ class MKVEndParser(object):
         rejected = timestamp_sec > duration_sec * max_percent
         return rejected, pct
 
-    def get_last_subtitle_timestamp(self, file_path):
+    def get_last_subtitle_timestamp(self, file_path, use_cache=True, duration=None):
         """
         Return the end timestamp in seconds of the last subtitle block, or None.
 
-        Only works when the MKV file contains a Cues element (which most
-        modern encoders produce).  For files without Cues, returns None so
-        that the caller can fall back to other detection methods.
+        Results are stored in a persistent cache, keyed by file path, size and
+        modification time, which is checked before the file is opened.
 
         Args:
-            file_path:    Path accepted by xbmcvfs.File (local, smb://, …).
-            stream_index: 0-based index of the subtitle stream to use.
+            file_path: Path accepted by xbmcvfs.File (local, smb://, …).
+            use_cache: Whether to load/store results from/to the cache.
+            duration:  Video duration in seconds, used for the max percent
+                       threshold if the parser can't determine it.
 
         Returns:
             float (seconds) or None.
         """
-        file_obj = None
-        try:
-            file_obj = xbmcvfs.File(file_path)
-            reader = _BufferedReader(file_obj)
-
-            if not self._read_ebml_header(reader):
-                self._log('Not a valid EBML/MKV file', utils.LOGWARNING)
-                return None
-            self._log('EBML header OK (pos={0})'.format(reader.tell()))
+        cache = subtitle_end_cache.SubtitleEndCache() if use_cache else None
+        with self._stats.phase('cache'):
+            key, fingerprint = self._cache_entry(cache, file_path) if cache else (None, None)
+            cached = cache.load(key, fingerprint, _CACHE_VERSION) if cache else None
+
+        if cached:
+            end_seconds = cached['end_time']
+            self._duration = cached['duration']
+            self._selected_tracks = cached['tracks']
+            self._log('Using stored result for {0}: {1} (tracks: {2})'.format(
+                file_path, end_seconds, self._selected_tracks
+            ))
+        else:
+            end_seconds = self._find_last_subtitle(file_path)
+            # Don't store results of failed reads, only of parsed files
+            if cache and self._complete:
+                with self._stats.phase('cache'):
+                    cache.save(key, fingerprint, _CACHE_VERSION, end_seconds,
+                               self._duration, self._selected_tracks)
+        self._stats.publish(file_path, self._log)
+
+        if end_seconds is None:
+            return None
 
-            seg_start, seg_size = self._find_segment(reader)
-            if seg_start is None:
-                self._log('Segment element not found', utils.LOGWARNING)
+        # Validate timestamp against max percent threshold
+        duration = self._duration or duration
+        max_percent = self._get_max_end_percent()
+        if duration:
+            rejected, pct = self._should_reject_timestamp_by_threshold(end_seconds, duration, max_percent)
+            if rejected and pct is not None:
+                msg = 'Subtitle detected at {:.1f}% (max={:.0f}%) - {:.1f}s > {:.1f}s. Fallback to default detection'.format(
+                    pct, max_percent * 100, end_seconds, duration * max_percent
+                )
+                self._log(msg, utils.LOGINFO)
                 return None
-            self._segment_start = seg_start
-
-            seek_positions = {}
-            self._parse_segment_headers(reader, seg_start, seg_size, seek_positions)
-            self._log('SeekHead entries: {0}'.format(list(hex(k) for k in seek_positions)))
 
-            if not self._tracks:
-                tracks_pos = seek_positions.get(_TRACKS)
-                if tracks_pos is not None:
-                    self._log('Tracks not inline, seeking via SeekHead pos={0}'.format(tracks_pos))
-                    reader.seek(self._segment_start + tracks_pos)
-                    elem_id, _ = _read_element_id(reader)
-                    elem_size, _ = _read_vint(reader)
-                    if elem_id == _TRACKS and elem_size is not None:
-                        self._parse_tracks(reader, elem_size)
-
-            if not self._tracks:
-                self._log('No subtitle tracks found', utils.LOGWARNING)
-                return None
+        return end_seconds
+
+    def _cache_entry(self, cache, file_path):
+        """Return the key and fingerprint used to store results of file_path"""
+        return file_path, cache.fingerprint(file_path)
+
+    def _find_last_subtitle(self, file_path):
+        """Return the end timestamp in seconds of the last subtitle block, or
+        None. Must set self._complete to False if the file couldn't be read."""
+        raise NotImplementedError
+
+    def _select_tracks(self):
+        """Select the best tracks from self._tracks. Returns a tuple of a
+        frozenset of track numbers and a dict of track metadata."""
+        self._log('All tracks: {0}'.format(
+            [(num, name or 'unnamed', 'sdh' if 'sdh' in (name or '').lower() else ('forced' if forced else 'full')) 
+             for num, codec, name, forced in self._tracks]
+        ))
+
+        # Sort tracks by priority: SDH (0) > FULL (1) > FORCED (2)
+        sorted_tracks = sorted(self._tracks, key=self._get_track_priority)
+        best_tracks = sorted_tracks[:2]  # Take top 2 priority tracks
+        best_track_numbers = [num for num, _, _, _ in best_tracks]
+        self._selected_tracks = best_track_numbers
+        self._log('Selected best {0} tracks by priority (SDH>FULL>FORCED): {1}'.format(
+            len(best_track_numbers), best_track_numbers
+        ), utils.LOGINFO)
+
+        subtitle_track_numbers = frozenset(best_track_numbers)
+
+        # Build track metadata: (type_name, is_text_codec)
+        track_meta = {}
+        for num, codec, name, forced in self._tracks:
+            if num in subtitle_track_numbers:
+                is_text = (codec or '').upper() in _SUPPORTED_CODECS
+                if 'sdh' in (name or '').lower():
+                    track_meta[num] = ('SDH', is_text)
+                elif forced:
+                    track_meta[num] = ('FORCED', is_text)
+                else:
+                    track_meta[num] = ('FULL', is_text)
+
+        return subtitle_track_numbers, track_meta
+
+    def _select_end_time(self, all_blocks, subtitle_track_numbers, track_meta):
+        """Return the end time in seconds of the last subtitle from all_blocks,
+        a list of (track_num, timestamp_ms, end_ms, text) in order of time,
+        preferring subtitles that contain end keywords."""
+        duration = self._duration
+
+        matcher = _get_end_keyword_matcher()
+
+        # Group blocks by track, in order of time
+        track_blocks = {}
+        for block in all_blocks:
+            track_blocks.setdefault(block[0], []).append(block)
+
+        # Find END-marked subtitles in last blocks of each track
+        end_blocks = []
+        last_keyword_blocks = []
+        for num in subtitle_track_numbers:
+            track_type, is_text = track_meta.get(num, ('UNK', False))
+            last_blocks = track_blocks.get(num, [])[-_LAST_N_BLOCKS:]
+            if not last_blocks:
+                continue
+
+            # Search for END keyword in last blocks
+            keyword_blocks = [
+                block for block in last_blocks
+                if block[3] and matcher.search(block[3])
+            ]
+            if keyword_blocks:
+                log_block = keyword_blocks[0]
+                end_blocks.append(log_block)
+                # If the last subtitle of a track contains a keyword, prefer
+                # that subtitle
+                if keyword_blocks[-1] is last_blocks[-1]:
+                    last_keyword_blocks.append(last_blocks[-1])
+                label = 'END'
+            # Log last subtitle if no END keyword found
+            else:
+                log_block = last_blocks[-1]
+                label = ''
+
+            _, ts_ms, end_ms, text = log_block
+            pct_str = self._format_percentage(end_ms / 1000.0, duration)
+            if is_text:
+                display_text = (text or '').replace('\n', ' ').replace('\x00', ' ')
+                self._log('Track {0} ({1}){2}: {3:.1f}s - {4:.1f}s | "{5}"{6}'.format(
+                    num, track_type, ' ' + label if label else '',
+                    ts_ms / 1000.0, end_ms / 1000.0, display_text, pct_str
+                ), utils.LOGINFO)
+            else:
+                self._log('Track {0} ({1}){2}: {3:.1f}s - {4:.1f}s{5}'.format(
+                    num, track_type, ' ' + label if label else '',
+                    ts_ms / 1000.0, end_ms / 1000.0, pct_str
+                ), utils.LOGINFO)
+
+        # Prefer last subtitles containing a keyword, choosing the one that is
+        # least close to the very end
+        if last_keyword_blocks:
+            best_block = min(last_keyword_blocks, key=lambda b: b[2])
+            end_seconds = best_block[2] / 1000.0
+        else:
+            if end_blocks:
+                # If no track's last subtitle matched a keyword, fall back to
+                # END-marked blocks and choose the least-close-to-end one.
+                best_block = min(end_blocks, key=lambda b: b[2])
+                end_seconds = best_block[2] / 1000.0
+            else:
+                # Final fallback: last subtitle seen in any track
+                last_block = max(all_blocks, key=lambda b: b[1])
+                end_seconds = last_block[2] / 1000.0
 
-            self._log('All tracks: {0}'.format(
-                [(num, name or 'unnamed', 'sdh' if 'sdh' in (name or '').lower() else ('forced' if forced else 'full')) 
-                 for num, codec, name, forced in self._tracks]
-            ))
+        # Max percent threshold is applied to both END and fallback
+        # detection by get_last_subtitle_timestamp
+        return end_seconds
 
-            # Sort tracks by priority: SDH (0) > FULL (1) > FORCED (2)
-            sorted_tracks = sorted(self._tracks, key=self._get_track_priority)
-            best_tracks = sorted_tracks[:2]  # Take top 2 priority tracks
-            best_track_numbers = [num for num, _, _, _ in best_tracks]
-            self._log('Selected best {0} tracks by priority (SDH>FULL>FORCED): {1}'.format(
-                len(best_track_numbers), best_track_numbers
-            ), utils.LOGINFO)
 
-            subtitle_track_numbers = frozenset(best_track_numbers)
+class MKVEndParser(SubtitleEndParser):
+    """
+    Parse an MKV file to find the timestamp of the last subtitle entry.
 
-            cues_pos = seek_positions.get(_CUES)
-            if cues_pos is None:
-                self._log('No Cues element; skipping subtitle end detection', utils.LOGWARNING)
-                return None
+    Uses Cues for efficient random access; when Cues are absent only the end
+    of the file is scanned, to avoid reading the entire file over the network.
+    """
 
-            reader.seek(self._segment_start + cues_pos)
-            elem_id, _ = _read_element_id(reader)
-            elem_size, _ = _read_vint(reader)
-            if elem_id != _CUES or elem_size is None:
-                self._log('Cues element unreadable', utils.LOGWARNING)
-                return None
+    def __init__(self):
+        super(MKVEndParser, self).__init__()
+        self._timecode_scale = 1000000  # default: 1 ns/unit → 1 ms per unit
+        self._info_duration = None  # in timecode scale units
+        self._segment_start = 0
+        # Max cue time, and heap/set of highest cluster positions, of all tracks
+        # and of subtitle tracks, read from Cues. Position of the following
+        # cluster of each subtitle cluster is stored to estimate cluster size
+        self._cue_max_time = None
+        self._cue_positions = ([], set())
+        self._cue_subtitle_positions = ([], set())
+        self._cue_next_positions = {}
+        self._cue_last_position = None
+
+    def _find_last_subtitle(self, file_path):
+        """
+        Return the end timestamp in seconds of the last subtitle block, or None.
 
-            self._parse_cues(reader, elem_size)
+        Uses the Cues element (which most modern encoders produce) to find the
+        last clusters. For files without Cues, clusters are found by scanning
+        the last _TAIL_SCAN_SIZE bytes of the file.
 
-            if not self._cues:
-                self._log('Cues list empty after parse', utils.LOGWARNING)
-                return None
+        Args:
+            file_path:    Path accepted by xbmcvfs.File (local, smb://, …).
 
-            # Calculate duration from cues for percentage checks
-            cue_ms_times = [(c[0] * self._timecode_scale) // 1000000 for c in self._cues]
-            duration = (max(cue_ms_times) / 1000.0) if cue_ms_times else None
+        Returns:
+            float (seconds) or None.
+        """
+        reader = None
+        self._complete = True
+        try:
+            with self._stats.phase('header'):
+                reader = self._stats.add_reader(_open_reader(file_path))
+
+                # Don't store results if the file header couldn't be parsed,
+                # as it may not have been read completely
+                if not self._read_ebml_header(reader):
+                    self._complete = False
+                    self._log('Not a valid EBML/MKV file', utils.LOGWARNING)
+                    return None
+                self._log('EBML header OK (pos={0})'.format(reader.tell()))
 
-            # Filter cluster positions to only those of subtitle tracks
-            subtitle_cluster_offsets = sorted(set(
-                pos for _, track, pos in self._cues
-                if track in subtitle_track_numbers
-            ))
-            if not subtitle_cluster_offsets:
-                subtitle_cluster_offsets = sorted(set(pos for _, _, pos in self._cues))
+                seg_start, seg_size = self._find_segment(reader)
+                if seg_start is None:
+                    self._complete = False
+                    self._log('Segment element not found', utils.LOGWARNING)
+                    return None
+                self._segment_start = seg_start
+
+            with self._stats.phase('seekhead'):
+                seek_positions = {}
+                self._parse_segment_headers(reader, seg_start, seg_size, seek_positions)
+                self._log('SeekHead entries: {0}'.format(list(hex(k) for k in seek_positions)))
+
+                if not self._tracks:
+                    tracks_pos = seek_positions.get(_TRACKS)
+                    if tracks_pos is not None:
+                        self._log('Tracks not inline, seeking via SeekHead pos={0}'.format(tracks_pos))
+                        reader.seek(self._segment_start + tracks_pos)
+                        elem_id, _ = _read_element_id(reader)
+                        elem_size, _ = _read_vint(reader)
+                        if elem_id == _TRACKS and elem_size is not None:
+                            self._parse_tracks(reader, elem_size)
 
-            if not subtitle_cluster_offsets:
+            if not self._tracks:
+                self._log('No subtitle tracks found', utils.LOGWARNING)
                 return None
 
-            last_clusters = subtitle_cluster_offsets[-_LAST_N_CLUSTERS:]
-            self._log('Examining last {0} cluster(s) (offsets: {1})'.format(
-                len(last_clusters), last_clusters
-            ))
+            subtitle_track_numbers, track_meta = self._select_tracks()
 
-            # Collect subtitle blocks from clusters
-            all_blocks = []
-            for cluster_pos in last_clusters:
-                abs_offset = self._segment_start + cluster_pos
-                reader.seek(abs_offset)
-                elem_id, _ = _read_element_id(reader)
-                if elem_id != _CLUSTER:
-                    self._log('Expected CLUSTER at {0}, got {1}'.format(
-                        abs_offset, hex(elem_id) if elem_id else 'None'
-                    ), utils.LOGWARNING)
-                    continue
-                elem_size, _ = _read_vint(reader)
-                if elem_size is None:
-                    continue
-                blocks = self._parse_cluster_any_subtitle(reader, elem_size, subtitle_track_numbers)
-                all_blocks.extend(blocks)
+            cues_pos = seek_positions.get(_CUES)
+            if cues_pos is not None:
+                all_blocks = self._read_cue_clusters(
+                    reader, cues_pos, subtitle_track_numbers, file_path
+                )
+            else:
+                self._log('No Cues element; scanning last {0}MB of file'.format(
+                    _TAIL_SCAN_SIZE // (1024 * 1024)
+                ), utils.LOGINFO)
+                with self._stats.phase('tail'):
+                    all_blocks = self._scan_tail(reader, subtitle_track_numbers)
 
             if not all_blocks:
-                self._log('No subtitle blocks found in last {0} clusters'.format(
-                    len(last_clusters)
-                ), utils.LOGWARNING)
+                self._log('No subtitle blocks found in last clusters', utils.LOGWARNING)
                 return None
 
-            # Build track metadata: (type_name, is_text_codec)
-            track_meta = {}
-            for num, codec, name, forced in self._tracks:
-                if num in subtitle_track_numbers:
-                    is_text = (codec or '').upper() in _SUPPORTED_CODECS
-                    if 'sdh' in (name or '').lower():
-                        track_meta[num] = ('SDH', is_text)
-                    elif forced:
-                        track_meta[num] = ('FORCED', is_text)
-                    else:
-                        track_meta[num] = ('FULL', is_text)
-
-
-            # Keywords for end-of-episode detection
-            END_KEYWORDS = [
-                'subtitles', 'sous-titres', 'перевод субтитров', 'traduction',
-                'subtitling', 'adaptation', 'captioning', 'caption', 'captioned', 'subtitulado',
-                'traducción', 'credits', 'music', 'end', 'fin', 'outro', 'ending', '♪'
-            ]
-
-            # Find END-marked subtitles in last blocks of each track
-            end_blocks = []
-            logged_blocks = set()
-            for num in subtitle_track_numbers:
-                track_type, is_text = track_meta.get(num, ('UNK', False))
-                last_blocks = [b for b in all_blocks if b[0] == num][-5:]
-                
-                # Search for END keyword in last blocks
-                found_end = False
-                for ts_ms, end_ms, text in [(b[1], b[2], b[3]) for b in last_blocks]:
-                    if text and any(kw in text.lower() for kw in END_KEYWORDS):
-                        block_id = (num, ts_ms, end_ms, text)
-                        if block_id not in logged_blocks:
-                            pct_str = self._format_percentage(end_ms / 1000.0, duration)
-                            if is_text:
-                                display_text = (text or '').replace('\n', ' ').replace('\x00', ' ')
-                                self._log('Track {0} ({1}) END: {2:.1f}s - {3:.1f}s | "{4}"{5}'.format(
-                                    num, track_type, ts_ms / 1000.0, end_ms / 1000.0, display_text, pct_str
-                                ), utils.LOGINFO)
-                            else:
-                                self._log('Track {0} ({1}) END: {2:.1f}s - {3:.1f}s{4}'.format(
-                                    num, track_type, ts_ms / 1000.0, end_ms / 1000.0, pct_str
-                                ), utils.LOGINFO)
-                            logged_blocks.add(block_id)
-                            end_blocks.append((num, ts_ms, end_ms, text))
-                            found_end = True
-                            break
-                
-                # Log last subtitle if no END keyword found
-                if not found_end and last_blocks:
-                    ts_ms, end_ms, text = last_blocks[-1][1], last_blocks[-1][2], last_blocks[-1][3]
-                    block_id = (num, ts_ms, end_ms, text)
-                    if block_id not in logged_blocks:
-                        pct_str = self._format_percentage(end_ms / 1000.0, duration)
-                        if is_text:
-                            display_text = (text or '').replace('\n', ' ').replace('\x00', ' ')
-                            self._log('Track {0} ({1}): {2:.1f}s - {3:.1f}s | "{4}"{5}'.format(
-                                num, track_type, ts_ms / 1000.0, end_ms / 1000.0, display_text, pct_str
-                            ), utils.LOGINFO)
-                        else:
-                            self._log('Track {0} ({1}): {2:.1f}s - {3:.1f}s{4}'.format(
-                                num, track_type, ts_ms / 1000.0, end_ms / 1000.0, pct_str
-                            ), utils.LOGINFO)
-                        logged_blocks.add(block_id)
-
-            # Apply max percent threshold check to both END and fallback detection
-            max_percent = self._get_max_end_percent()
-
-            # If the last subtitle of a track contains a keyword, prefer that
-            # subtitle — choosing the one that is least close to the very end
-            last_keyword_blocks = []
-            for num in subtitle_track_numbers:
-                blocks_for_num = [b for b in all_blocks if b[0] == num]
-                if not blocks_for_num:
-                    continue
-                last_blk = blocks_for_num[-1]
-                text = (last_blk[3] or '').lower()
-                if any(kw in text for kw in END_KEYWORDS):
-                    last_keyword_blocks.append(last_blk)
-
-            if last_keyword_blocks:
-                best_block = min(last_keyword_blocks, key=lambda b: b[2])
-                end_seconds = best_block[2] / 1000.0
-            else:
-                if end_blocks:
-                    # If no track's last subtitle matched a keyword, fall back to
-                    # END-marked blocks and choose the least-close-to-end one.
-                    best_block = min(end_blocks, key=lambda b: b[2])
-                    end_seconds = best_block[2] / 1000.0
-                else:
-                    # Final fallback: last subtitle seen in any track
-                    last_block = max(all_blocks, key=lambda b: b[1])
-                    end_seconds = last_block[2] / 1000.0
-
-            # Validate timestamp against max percent threshold
-            if duration:
-                rejected, pct = self._should_reject_timestamp_by_threshold(end_seconds, duration, max_percent)
-                if rejected and pct is not None:
-                    msg = 'Subtitle detected at {:.1f}% (max={:.0f}%) - {:.1f}s > {:.1f}s. Fallback to default detection'.format(
-                        pct, max_percent * 100, end_seconds, duration * max_percent
-                    )
-                    self._log(msg, utils.LOGINFO)
-                    return None
-
-            return end_seconds
+            with self._stats.phase('select'):
+                return self._select_end_time(all_blocks, subtitle_track_numbers, track_meta)
 
         except Exception as exc:
+            self._complete = False
             self._log('Error: {0}'.format(exc), utils.LOGERROR)
             import traceback
             self._log(traceback.format_exc(), utils.LOGERROR)
             return None
         finally:
-            if file_obj:
+            if reader:
+                self._log('Read {0} bytes using {1} read(s) and {2} seek(s)'.format(
+                    reader.bytes_read, reader.read_requests, reader.seek_requests
+                ), utils.LOGDEBUG)
+                # Failed reads return no data, don't store results of a
+                # partially read file
+                if reader.short_reads:
+                    self._complete = False
+                    self._log('{0} read(s) failed'.format(reader.short_reads),
+                              utils.LOGWARNING)
                 try:
-                    file_obj.close()
+                    reader.close()
                 except Exception:
                     pass
 
@@ -510,7 +920,7 @@ class MKVEndParser(object):
         elem_size, _ = _read_vint(reader)
         if elem_size is None:
             return False
-        reader.read(elem_size)
+        reader.seek(reader.tell() + elem_size)
         return True
 
     def _find_segment(self, reader):
@@ -603,6 +1013,10 @@ class MKVEndParser(object):
             data_start = reader.tell()
             if elem_id == _TIMECODE_SCALE:
                 self._timecode_scale = _read_uint(reader.read(elem_size))
+            elif elem_id == _DURATION and elem_size in (4, 8):
+                self._info_duration = struct.unpack(
+                    '>f' if elem_size == 4 else '>d', reader.read(elem_size)
+                )[0]
             reader.seek(data_start + elem_size)
 
     # ── Tracks ────────────────────────────────────────────────────────────────
@@ -645,11 +1059,11 @@ class MKVEndParser(object):
             elif elem_id == _TRACK_TYPE:
                 track_type = _read_uint(reader.read(elem_size))
             elif elem_id == _TRACK_NAME:
-                track_name = reader.read(elem_size).decode('utf-8', errors='replace')
+                track_name = bytes(reader.read(elem_size)).decode('utf-8', errors='replace')
             elif elem_id == _TRACK_FLAG_FORCED:
                 forced_flag = bool(_read_uint(reader.read(elem_size)))
             elif elem_id == _CODEC_ID:
-                codec_id = reader.read(elem_size).decode('ascii', errors='replace')
+                codec_id = bytes(reader.read(elem_size)).decode('ascii', errors='replace')
             reader.seek(data_start + elem_size)
 
         if track_type != _TRACK_TYPE_SUBTITLE:
@@ -666,7 +1080,9 @@ class MKVEndParser(object):
 
     # ── Cues ──────────────────────────────────────────────────────────────────
 
-    def _parse_cues(self, reader, size):
+    def _parse_cues(self, reader, size, target_track_nums):
+        """Parse CuePoints one at a time, only keeping the max cue time and the
+        highest cluster positions, rather than a list of all CuePoints."""
         end_pos = reader.tell() + size
         while reader.tell() < end_pos:
             elem_id, _ = _read_element_id(reader)
@@ -677,10 +1093,10 @@ class MKVEndParser(object):
                 break
             data_start = reader.tell()
             if elem_id == _CUE_POINT:
-                self._parse_cue_point(reader, elem_size)
+                self._parse_cue_point(reader, elem_size, target_track_nums)
             reader.seek(data_start + elem_size)
 
-    def _parse_cue_point(self, reader, size):
+    def _parse_cue_point(self, reader, size, target_track_nums):
         end_pos = reader.tell() + size
         cue_time = 0
         while reader.tell() < end_pos:
@@ -696,9 +1112,33 @@ class MKVEndParser(object):
             elif elem_id == _CUE_TRACK_POSITIONS:
                 cue_track, cluster_pos = self._parse_cue_track_positions(reader, elem_size)
                 if cluster_pos is not None:
-                    self._cues.append((cue_time, cue_track, cluster_pos))
+                    if self._cue_max_time is None or cue_time > self._cue_max_time:
+                        self._cue_max_time = cue_time
+                    self._add_cue_position(cue_track, cluster_pos, target_track_nums)
             reader.seek(data_start + elem_size)
 
+    def _add_cue_position(self, cue_track, cluster_pos, target_track_nums):
+        # Cues are in order of time, so the next larger cluster position is
+        # usually the position of the following cluster
+        last_pos = self._cue_last_position
+        if (last_pos is not None and last_pos < cluster_pos
+                and last_pos in self._cue_next_positions):
+            next_pos = self._cue_next_positions[last_pos]
+            if next_pos is None or cluster_pos < next_pos:
+                self._cue_next_positions[last_pos] = cluster_pos
+        self._cue_last_position = cluster_pos
+
+        _push_largest(*self._cue_positions, value=cluster_pos, limit=_LAST_N_CLUSTERS)
+        if cue_track not in target_track_nums:
+            return
+        added, removed = _push_largest(
+            *self._cue_subtitle_positions, value=cluster_pos, limit=_LAST_N_CLUSTERS
+        )
+        if removed is not None:
+            self._cue_next_positions.pop(removed, None)
+        if added:
+            self._cue_next_positions[cluster_pos] = None
+
     def _parse_cue_track_positions(self, reader, size):
         end_pos = reader.tell() + size
         cue_track = None
@@ -718,6 +1158,207 @@ class MKVEndParser(object):
             reader.seek(data_start + elem_size)
         return cue_track, cluster_pos
 
+    # ── Last clusters ─────────────────────────────────────────────────────────
+
+    def _read_cue_clusters(self, reader, cues_pos, target_track_nums, file_path=None):
+        """Return subtitle blocks from the last clusters referenced by Cues.
+
+        For network files, data for all the clusters is prefetched before
+        parsing, using concurrent reads if clusters are not contiguous."""
+        with self._stats.phase('cues'):
+            reader.seek(self._segment_start + cues_pos)
+            elem_id, _ = _read_element_id(reader)
+            elem_size, _ = _read_vint(reader)
+            if elem_id != _CUES or elem_size is None:
+                self._log('Cues element unreadable', utils.LOGWARNING)
+                return []
+
+            self._parse_cues(reader, elem_size, target_track_nums)
+
+        if self._cue_max_time is None:
+            self._log('Cues list empty after parse', utils.LOGWARNING)
+            return []
+
+        # Calculate duration from cues for percentage checks
+        self._duration = (self._cue_max_time * self._timecode_scale) // 1000000 / 1000.0
+
+        # Use cluster positions of subtitle tracks if they have Cues,
+        # otherwise the last clusters of any track
+        cluster_positions = self._cue_positions[0]
+        subtitle_cluster_offsets = sorted(self._cue_subtitle_positions[0])
+        if not subtitle_cluster_offsets:
+            subtitle_cluster_offsets = sorted(cluster_positions)
+
+        if not subtitle_cluster_offsets:
+            return []
+
+        last_clusters = subtitle_cluster_offsets[-_LAST_N_CLUSTERS:]
+        self._log('Examining last {0} cluster(s) (offsets: {1})'.format(
+            len(last_clusters), last_clusters
+        ))
+
+        with self._stats.phase('clusters'):
+            prefetched = []
+            if file_path and isinstance(reader, _BufferedReader):
+                prefetched = self._prefetch_clusters(
+                    reader, file_path, last_clusters,
+                    cluster_positions + last_clusters + [cues_pos] + [
+                        pos for pos in self._cue_next_positions.values() if pos
+                    ]
+                )
+
+            # Collect subtitle blocks from clusters
+            all_blocks = []
+            for cluster_pos in last_clusters:
+                abs_offset = self._segment_start + cluster_pos
+                cluster_reader = reader
+                for start, memory_reader in prefetched:
+                    if start <= abs_offset < memory_reader.size():
+                        cluster_reader = memory_reader
+                        break
+                cluster_reader.seek(abs_offset)
+                elem_id, _ = _read_element_id(cluster_reader)
+                if elem_id != _CLUSTER:
+                    self._log('Expected CLUSTER at {0}, got {1}'.format(
+                        abs_offset, hex(elem_id) if elem_id else 'None'
+                    ), utils.LOGWARNING)
+                    continue
+                elem_size, _ = _read_vint(cluster_reader)
+                if elem_size is None:
+                    continue
+                # Cluster was larger than the prefetched data, read it directly
+                if cluster_reader.tell() + elem_size > cluster_reader.size():
+                    cluster_reader = reader
+                    cluster_reader.seek(abs_offset)
+                    _read_element_id(cluster_reader)
+                    _read_vint(cluster_reader)
+                blocks = self._parse_cluster_any_subtitle(cluster_reader, elem_size, target_track_nums)
+                all_blocks.extend(blocks)
+
+        return all_blocks
+
+    def _prefetch_clusters(self, reader, file_path, cluster_offsets, element_offsets):
+        """Read data for clusters at cluster_offsets into memory and return a
+        list of (start, _MemoryReader) tuples. The end of each cluster is estimated
+        using the next offset in element_offsets. Contiguous ranges are read
+        using a single request, and other ranges are read concurrently using
+        separate file handles."""
+        file_size = reader.size()
+        element_offsets = sorted(set(element_offsets))
+
+        ranges = []
+        for cluster_pos in sorted(cluster_offsets):
+            start = self._segment_start + cluster_pos
+            end = next((
+                self._segment_start + pos for pos in element_offsets
+                if pos > cluster_pos
+            ), file_size)
+            if not end:
+                continue
+            end = min(end, start + _PREFETCH_MAX_SIZE)
+            # Coalesce contiguous or overlapping ranges
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end)
+            else:
+                ranges.append([start, end])
+
+        if not ranges:
+            return []
+        self._log('Prefetching {0} range(s) for {1} cluster(s)'.format(
+            len(ranges), len(cluster_offsets)
+        ))
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            reader.seek(start)
+            return [(start, _MemoryReader(reader.read(end - start), start))]
+
+        def _read_range(data_range):
+            start, end = data_range
+            file_obj = xbmcvfs.File(file_path)
+            try:
+                file_obj.seek(start, 0)
+                return start, file_obj.readBytes(end - start)
+            finally:
+                file_obj.close()
+
+        prefetched = []
+        try:
+            with ThreadPoolExecutor(max_workers=min(_PREFETCH_THREADS, len(ranges))) as executor:
+                for start, data in executor.map(_read_range, ranges):
+                    if not data:
+                        continue
+                    reader.bytes_read += len(data)
+                    reader.read_requests += 1
+                    prefetched.append((start, _MemoryReader(data, start)))
+        except Exception as exc:
+            self._log('Prefetch failed: {0}'.format(exc), utils.LOGWARNING)
+        return prefetched
+
+    def _scan_tail(self, reader, target_track_nums):
+        """Return subtitle blocks from the last clusters in the last
+        _TAIL_SCAN_SIZE bytes of the file, for files without Cues.
+
+        The start of each cluster is found by searching for the Cluster
+        element ID, and is only accepted if it is followed by a valid size
+        and a cluster Timestamp element. Following clusters are read in
+        sequence, searching again if the next element is not a cluster."""
+        file_size = reader.size()
+        if not file_size:
+            self._log('File size unknown, unable to scan end of file', utils.LOGWARNING)
+            return []
+
+        start = max(self._segment_start, file_size - _TAIL_SCAN_SIZE)
+        reader.seek(start)
+        data = reader.read(file_size - start)
+        # Large reads already return a new buffer that can be searched, only
+        # small files are returned as a view of a cached block
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        tail = _MemoryReader(data, start)
+        end = start + len(data)
+
+        cluster_blocks = []
+        last_timestamp = None
+        num_clusters = 0
+        pos = data.find(_CLUSTER_ID)
+        while pos != -1:
+            tail.seek(start + pos + len(_CLUSTER_ID))
+            elem_size, _ = _read_vint(tail)
+            data_start = tail.tell()
+            elem_id, _ = _read_element_id(tail)
+            timestamp_size, _ = _read_vint(tail)
+            if (elem_size is None or elem_id != _CLUSTER_TIMESTAMP
+                    or timestamp_size is None
+                    or data_start + elem_size > end):
+                pos = data.find(_CLUSTER_ID, pos + 1)
+                continue
+
+            num_clusters += 1
+            last_timestamp = _read_uint(tail.read(timestamp_size))
+            tail.seek(data_start)
+            blocks = self._parse_cluster_any_subtitle(tail, elem_size, target_track_nums)
+            if blocks:
+                cluster_blocks.append(blocks)
+
+            pos = data_start + elem_size - start
+            if data[pos:pos + len(_CLUSTER_ID)] != _CLUSTER_ID:
+                pos = data.find(_CLUSTER_ID, pos)
+
+        self._log('Found {0} cluster(s), {1} with subtitles, in last {2} bytes'.format(
+            num_clusters, len(cluster_blocks), len(data)
+        ))
+
+        if self._info_duration:
+            self._duration = self._info_duration * self._timecode_scale / 1e9
+        elif last_timestamp is not None:
+            self._duration = last_timestamp * self._timecode_scale / 1e9
+
+        all_blocks = []
+        for blocks in cluster_blocks[-_LAST_N_CLUSTERS:]:
+            all_blocks.extend(blocks)
+        return all_blocks
+
     # ── Cluster ───────────────────────────────────────────────────────────────
 
     def _parse_cluster_any_subtitle(self, reader, size, target_track_nums):
@@ -807,17 +1448,549 @@ class MKVEndParser(object):
         # The subtitle payload starts after the header
         if len(data) > header_size:
             try:
-                text = data[header_size:].decode('utf-8', errors='replace').strip()
+                text = bytes(data[header_size:]).decode('utf-8', errors='replace').strip()
             except Exception:
                 text = None
         return (timestamp_ms, end_ms, text)
 
 
+# ── Sidecar subtitle files ───────────────────────────────────────────────────
+
+def _time_to_ms(hours, minutes, seconds, fraction):
+    return (
+        ((int(hours or 0) * 60 + int(minutes)) * 60 + int(seconds)) * 1000
+        + int(fraction.ljust(3, '0')[:3])
+    )
+
+
+def _parse_text_cues(text):
+    """Return list of (timestamp_ms, end_ms, text) from SRT or WebVTT data."""
+    cues = []
+    cue = None
+    for line in text.splitlines():
+        line = line.strip()
+        match = _CUE_TIMING_RE.search(line)
+        if match:
+            groups = match.groups()
+            cue = (_time_to_ms(*groups[:4]), _time_to_ms(*groups[4:]), [])
+            cues.append(cue)
+        elif not line:
+            cue = None
+        elif cue is not None:
+            cue[2].append(_MARKUP_RE.sub('', line))
+    return [(start, end, '\n'.join(lines)) for start, end, lines in cues]
+
+
+def _parse_ass_events(text):
+    """Return list of (timestamp_ms, end_ms, text) from ASS/SSA Dialogue lines."""
+    events = []
+    for line in text.splitlines():
+        if not line.startswith('Dialogue:'):
+            continue
+        # Layer/Marked, Start, End, Style, Name, MarginL, MarginR, MarginV,
+        # Effect, Text
+        fields = line[9:].split(',', 9)
+        if len(fields) < 10:
+            continue
+        start = _ASS_TIME_RE.match(fields[1].strip())
+        end = _ASS_TIME_RE.match(fields[2].strip())
+        if not start or not end:
+            continue
+        event_text = _MARKUP_RE.sub('', fields[9])
+        event_text = event_text.replace('\\N', '\n').replace('\\n', '\n')
+        events.append((
+            _time_to_ms(*start.groups()), _time_to_ms(*end.groups()),
+            event_text.strip()
+        ))
+    events.sort()
+    return events
+
+
+def find_sidecar_subtitles(file_path):
+    """Return sorted list of (path, tags) of subtitle files next to the video
+    file_path, e.g. video.srt or video.en.sdh.srt, where tags is the list of
+    name parts between the video name and the extension."""
+    if not file_path or file_path.startswith(('plugin://', 'stack://')):
+        return []
+
+    filename = os.path.basename(file_path)
+    base = os.path.splitext(filename)[0].lower()
+    directory = file_path[:-len(filename)] if filename else ''
+    if not directory or not base:
+        return []
+
+    try:
+        _, files = xbmcvfs.listdir(directory)
+    except (RuntimeError, TypeError):
+        return []
+
+    prefix = base + '.'
+    sidecars = []
+    for name in files:
+        name_lower = name.lower()
+        ext = os.path.splitext(name_lower)[1]
+        if ext not in _SIDECAR_CODECS or not name_lower.startswith(prefix):
+            continue
+        tags = name_lower[len(prefix):-len(ext)].split('.')
+        sidecars.append((directory + name, [tag for tag in tags if tag]))
+    sidecars.sort()
+    return sidecars
+
+
+class SidecarEndParser(SubtitleEndParser):
+    """
+    Parse subtitle files stored next to the video (.srt, .ass, .ssa, .vtt) to
+    find the timestamp of the last subtitle entry.
+
+    Each file is handled as a separate track. Entries are stored in order of
+    time, so only the last _SIDECAR_TAIL_SIZE bytes of each file are read.
+    """
+
+    def __init__(self, sidecars):
+        super(SidecarEndParser, self).__init__()
+        self._paths = {}
+        for track_number, (path, tags) in enumerate(sidecars, 1):
+            ext = os.path.splitext(path.lower())[1]
+            sdh = any(tag in _SIDECAR_SDH_TAGS for tag in tags)
+            self._paths[track_number] = path
+            self._tracks.append((
+                track_number,
+                _SIDECAR_CODECS.get(ext),
+                'sdh' if sdh else '.'.join(tags),
+                'forced' in tags
+            ))
+
+    def _cache_entry(self, cache, file_path):
+        """
+        Results are stored for the video file_path, with a fingerprint of the
+        path, size and modification time of all its sidecar files, so that
+        adding, removing or replacing any of them invalidates the result.
+        """
+        total_size = 0
+        fingerprints = []
+        for path in sorted(self._paths.values()):
+            fingerprint = cache.fingerprint(path)
+            if not fingerprint:
+                return None, None
+            total_size += fingerprint[0]
+            fingerprints.append('{0}:{1}:{2}'.format(path, *fingerprint))
+        checksum = zlib.crc32('\n'.join(fingerprints).encode('utf-8')) & 0xffffffff
+        return _SIDECAR_CACHE_KEY.format(file_path), (total_size, checksum)
+
+    def _find_last_subtitle(self, file_path):
+        """
+        Return the end timestamp in seconds of the last subtitle entry in the
+        sidecar files, or None. file_path of the video is only used for logging.
+        """
+        self._complete = True
+        if not self._tracks:
+            self._log('No sidecar subtitles found', utils.LOGWARNING)
+            return None
+
+        subtitle_track_numbers, track_meta = self._select_tracks()
+
+        all_blocks = []
+        for track_number, codec, _, _ in self._tracks:
+            if track_number not in subtitle_track_numbers:
+                continue
+            path = self._paths[track_number]
+            try:
+                with self._stats.phase('sidecar'):
+                    text = self._read_tail(path)
+            except Exception as exc:
+                self._complete = False
+                self._log('Error reading {0}: {1}'.format(path, exc), utils.LOGERROR)
+                continue
+            if codec in ('S_TEXT/ASS', 'S_TEXT/SSA'):
+                entries = _parse_ass_events(text)
+            else:
+                entries = _parse_text_cues(text)
+            all_blocks.extend(
+                (track_number, ts_ms, end_ms, entry_text)
+                for ts_ms, end_ms, entry_text in entries
+            )
+
+        if not all_blocks:
+            self._log('No subtitle entries found for {0}'.format(file_path), utils.LOGWARNING)
+            return None
+
+        all_blocks.sort(key=lambda b: b[1])
+        with self._stats.phase('select'):
+            return self._select_end_time(all_blocks, subtitle_track_numbers, track_meta)
+
+    def _read_tail(self, path):
+        """Return the decoded text of the last _SIDECAR_TAIL_SIZE bytes of
+        path, without the first partial line if the whole file wasn't read."""
+        reader = self._stats.add_reader(_open_reader(path))
+        try:
+            file_size = reader.size()
+            bom = bytes(reader.read(3))
+            if bom.startswith(codecs.BOM_UTF16_LE):
+                encoding, char_size = 'utf-16-le', 2
+            elif bom.startswith(codecs.BOM_UTF16_BE):
+                encoding, char_size = 'utf-16-be', 2
+            else:
+                encoding, char_size = 'utf-8', 1
+
+            start = max(0, file_size - _SIDECAR_TAIL_SIZE)
+            start -= start % char_size
+            reader.seek(start)
+            data = bytes(reader.read(file_size - start))
+            if reader.short_reads:
+                raise IOError('Read failed')
+        finally:
+            reader.close()
+
+        text = data.decode(encoding, errors='replace').lstrip('\ufeff')
+        if start:
+            text = text.split('\n', 1)[-1]
+        return text
+
+
+# ── MP4 text tracks ──────────────────────────────────────────────────────────
+
+def _iter_boxes(data, pos=0, end=None):
+    """Yield (box_type, payload_start, box_end) of MP4 boxes in data."""
+    end = len(data) if end is None else end
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, pos)
+        header_size = 8
+        if size == 1:
+            if pos + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - pos
+        if size < header_size or pos + size > end:
+            return
+        yield bytes(box_type), pos + header_size, pos + size
+        pos += size
+
+
+def _find_box(data, path, pos=0, end=None):
+    """Return (payload_start, box_end) of the box at path, a sequence of
+    nested box types, or (None, None) if not found."""
+    for box_type in path:
+        for child_type, child_start, child_end in _iter_boxes(data, pos, end):
+            if child_type == box_type:
+                pos, end = child_start, child_end
+                break
+        else:
+            return None, None
+    return pos, end
+
+
+def _read_box_table(data, pos, fmt):
+    """Return list of entries of a full box table (version/flags, entry count,
+    then entries of struct fmt) starting at pos."""
+    count = struct.unpack_from('>I', data, pos + 4)[0]
+    entry_size = struct.calcsize(fmt)
+    pos += 8
+    count = min(count, (len(data) - pos) // entry_size)
+    return [struct.unpack_from(fmt, data, pos + i * entry_size) for i in range(count)]
+
+
+def _read_timescale_duration(data, pos):
+    """Return (timescale, duration) from a mvhd or mdhd box payload."""
+    if data[pos] == 1:
+        return struct.unpack_from('>IQ', data, pos + 20)
+    return struct.unpack_from('>II', data, pos + 12)
+
+
+class MP4EndParser(SubtitleEndParser):
+    """
+    Parse an MP4 file to find the timestamp of the last tx3g or wvtt subtitle
+    sample.
+
+    Sample times, sizes and offsets are calculated from the sample tables of
+    the moov box, so only the moov box and the last samples of each selected
+    track are read. Fragmented MP4 files are not supported.
+    """
+
+    def __init__(self):
+        super(MP4EndParser, self).__init__()
+        self._samples = {}  # track_number -> list of (start_ms, end_ms, offset, size)
+
+    def _find_last_subtitle(self, file_path):
+        """
+        Return the end timestamp in seconds of the last subtitle sample, or
+        None.
+
+        Args:
+            file_path:    Path accepted by xbmcvfs.File (local, smb://, …).
+
+        Returns:
+            float (seconds) or None.
+        """
+        reader = None
+        self._complete = True
+        try:
+            with self._stats.phase('moov'):
+                reader = self._stats.add_reader(_open_reader(file_path))
+
+                moov = self._read_moov(reader)
+                if moov is None:
+                    self._complete = False
+                    self._log('moov box not found', utils.LOGWARNING)
+                    return None
+                self._parse_moov(moov)
+
+            if not self._tracks:
+                self._log('No subtitle tracks found', utils.LOGWARNING)
+                return None
+
+            subtitle_track_numbers, track_meta = self._select_tracks()
+            with self._stats.phase('samples'):
+                all_blocks = self._read_last_samples(reader, subtitle_track_numbers)
+
+            if not all_blocks:
+                self._log('No subtitle samples found', utils.LOGWARNING)
+                return None
+
+            all_blocks.sort(key=lambda b: b[1])
+            with self._stats.phase('select'):
+                return self._select_end_time(all_blocks, subtitle_track_numbers, track_meta)
+
+        except Exception as exc:
+            self._complete = False
+            self._log('Error: {0}'.format(exc), utils.LOGERROR)
+            import traceback
+            self._log(traceback.format_exc(), utils.LOGERROR)
+            return None
+        finally:
+            if reader:
+                self._log('Read {0} bytes using {1} read(s) and {2} seek(s)'.format(
+                    reader.bytes_read, reader.read_requests, reader.seek_requests
+                ), utils.LOGDEBUG)
+                # Failed reads return no data, don't store results of a
+                # partially read file
+                if reader.short_reads:
+                    self._complete = False
+                    self._log('{0} read(s) failed'.format(reader.short_reads),
+                              utils.LOGWARNING)
+                try:
+                    reader.close()
+                except Exception:
+                    pass
+
+    def _read_moov(self, reader):
+        """Walk top level boxes and return the contents of the moov box."""
+        file_size = reader.size()
+        pos = 0
+        while pos + 8 <= file_size:
+            reader.seek(pos)
+            header = bytes(reader.read(16))
+            if len(header) < 8:
+                break
+            size, box_type = struct.unpack_from('>I4s', header)
+            header_size = 8
+            if size == 1 and len(header) == 16:
+                size = struct.unpack_from('>Q', header, 8)[0]
+                header_size = 16
+            elif size == 0:
+                size = file_size - pos
+            if size < header_size:
+                break
+            if box_type == b'moov':
+                if size > _MP4_MAX_MOOV_SIZE:
+                    self._log('moov box too large: {0}'.format(size), utils.LOGWARNING)
+                    return None
+                reader.seek(pos + header_size)
+                return bytes(reader.read(size - header_size))
+            pos += size
+        return None
+
+    def _parse_moov(self, moov):
+        for box_type, start, end in _iter_boxes(moov):
+            if box_type == b'mvhd':
+                timescale, duration = _read_timescale_duration(moov, start)
+                if timescale:
+                    self._duration = duration / timescale
+            elif box_type == b'trak':
+                self._parse_trak(moov, start, end)
+
+    def _parse_trak(self, data, pos, end):
+        hdlr, _ = _find_box(data, (b'mdia', b'hdlr'), pos, end)
+        if hdlr is None or data[hdlr + 8:hdlr + 12] not in _MP4_HANDLERS:
+            return
+        stbl, stbl_end = _find_box(data, (b'mdia', b'minf', b'stbl'), pos, end)
+        stsd, _ = _find_box(data, (b'stsd', ), stbl, stbl_end)
+        if stsd is None:
+            return
+        sample_format = bytes(data[stsd + 12:stsd + 16])
+        if sample_format not in _MP4_TEXT_FORMATS:
+            return
+
+        tkhd, _ = _find_box(data, (b'tkhd', ), pos, end)
+        mdhd, _ = _find_box(data, (b'mdia', b'mdhd'), pos, end)
+        if tkhd is None or mdhd is None:
+            return
+        track_number = struct.unpack_from(
+            '>I', data, tkhd + (20 if data[tkhd] == 1 else 12)
+        )[0]
+        timescale, _ = _read_timescale_duration(data, mdhd)
+        if not timescale:
+            return
+        hdlr_end = _find_box(data, (b'mdia', b'hdlr'), pos, end)[1]
+        name = bytes(data[hdlr + 24:hdlr_end]).strip(b'\x00').decode('utf-8', errors='replace')
+
+        samples = self._parse_sample_table(data, stbl, stbl_end, timescale)
+        if not samples:
+            return
+        self._tracks.append((
+            track_number,
+            sample_format.decode('ascii').upper(),
+            name,
+            'forced' in name.lower()
+        ))
+        self._samples[track_number] = samples
+
+    @staticmethod
+    def _parse_sample_table(data, pos, end, timescale):
+        """Return list of (start_ms, end_ms, offset, size) for all samples."""
+        boxes = {
+            box_type: start
+            for box_type, start, _ in _iter_boxes(data, pos, end)
+            if box_type in (b'stts', b'stsz', b'stsc', b'stco', b'co64')
+        }
+        if (b'stts' not in boxes or b'stsz' not in boxes
+                or b'stsc' not in boxes):
+            return []
+
+        stsz = boxes[b'stsz']
+        sample_size, sample_count = struct.unpack_from('>II', data, stsz + 4)
+        if sample_size:
+            sizes = [sample_size] * sample_count
+        else:
+            sizes = [size for size, in _read_box_table(data, stsz + 4, '>I')]
+
+        if b'co64' in boxes:
+            chunk_offsets = [offset for offset, in _read_box_table(data, boxes[b'co64'], '>Q')]
+        elif b'stco' in boxes:
+            chunk_offsets = [offset for offset, in _read_box_table(data, boxes[b'stco'], '>I')]
+        else:
+            return []
+
+        offsets = []
+        stsc = _read_box_table(data, boxes[b'stsc'], '>III')
+        for idx, (first_chunk, samples_per_chunk, _) in enumerate(stsc):
+            last_chunk = stsc[idx + 1][0] - 1 if idx + 1 < len(stsc) else len(chunk_offsets)
+            for chunk in range(first_chunk, min(last_chunk, len(chunk_offsets)) + 1):
+                offset = chunk_offsets[chunk - 1]
+                for _ in range(samples_per_chunk):
+                    if len(offsets) >= len(sizes):
+                        break
+                    offsets.append(offset)
+                    offset += sizes[len(offsets) - 1]
+
+        samples = []
+        timestamp = 0
+        for count, delta in _read_box_table(data, boxes[b'stts'], '>II'):
+            for _ in range(count):
+                idx = len(samples)
+                if idx >= len(offsets):
+                    break
+                samples.append((
+                    timestamp * 1000 // timescale,
+                    (timestamp + delta) * 1000 // timescale,
+                    offsets[idx],
+                    sizes[idx]
+                ))
+                timestamp += delta
+        return samples
+
+    def _read_last_samples(self, reader, target_track_nums):
+        """Return list of (track_num, timestamp_ms, end_ms, text) for the last
+        non-empty samples of the target tracks."""
+        to_read = []
+        for track_number in target_track_nums:
+            samples = self._samples.get(track_number, [])
+            # Empty samples are used for gaps between subtitles
+            samples = [sample for sample in samples if sample[3] > _MP4_EMPTY_SAMPLE_SIZE]
+            to_read.extend((track_number, sample) for sample in samples[-_MP4_LAST_N_SAMPLES:])
+
+        blocks = []
+        # Read samples in file order to minimise seeks
+        for track_number, (ts_ms, end_ms, offset, size) in sorted(to_read, key=lambda s: s[1][2]):
+            reader.seek(offset)
+            text = self._decode_sample(bytes(reader.read(size)))
+            if text:
+                blocks.append((track_number, ts_ms, end_ms, text))
+        return blocks
+
+    @staticmethod
+    def _decode_sample(data):
+        # wvtt samples consist of vttc boxes containing a payl box with the
+        # cue text, or a vtte box for an empty cue
+        if data[4:8] in (b'vttc', b'vtte', b'vtta'):
+            text = []
+            for box_type, start, end in _iter_boxes(data):
+                if box_type != b'vttc':
+                    continue
+                payl, payl_end = _find_box(data, (b'payl', ), start, end)
+                if payl is not None:
+                    text.append(data[payl:payl_end].decode('utf-8', errors='replace'))
+            text = '\n'.join(text)
+        # tx3g samples start with the 16 bit length of the text
+        elif len(data) >= 2:
+            length = struct.unpack_from('>H', data)[0]
+            text = data[2:2 + length]
+            if text.startswith(codecs.BOM_UTF16_BE):
+                text = text[2:].decode('utf-16-be', errors='replace')
+            else:
+                text = text.decode('utf-8', errors='replace')
+        else:
+            return None
+        return _MARKUP_RE.sub('', text).strip()
+
+
+_PARSERS = {
+    '.mkv': MKVEndParser,
+    '.mk3d': MKVEndParser,
+    '.webm': MKVEndParser,
+    '.mp4': MP4EndParser,
+    '.m4v': MP4EndParser,
+    '.mov': MP4EndParser,
+}
+
+
+def get_parser(file_path):
+    """Return a parser for embedded subtitles of file_path based on its file
+    extension, or None if not supported. Paths without an extension, e.g.
+    resolved stream URLs, are parsed as MKV."""
+    path = file_path.split('|', 1)[0].split('?', 1)[0]
+    ext = os.path.splitext(path.lower())[1]
+    if not ext:
+        return MKVEndParser()
+    parser_class = _PARSERS.get(ext)
+    return parser_class() if parser_class else None
+
+
+def find_last_subtitle_timestamp(file_path, duration=None, use_cache=True):
+    """Return the end timestamp in seconds of the last subtitle of file_path,
+    using embedded subtitle tracks or else sidecar subtitle files, or None."""
+    timestamp = None
+    parser = get_parser(file_path)
+    if parser:
+        timestamp = parser.get_last_subtitle_timestamp(
+            file_path, use_cache=use_cache, duration=duration
+        )
+    if timestamp is None:
+        sidecars = find_sidecar_subtitles(file_path)
+        if sidecars:
+            timestamp = SidecarEndParser(sidecars).get_last_subtitle_timestamp(
+                file_path, use_cache=use_cache, duration=duration
+            )
+    return timestamp
+
+
 # ── Public API ────────────────────────────────────────────────────────────────
 
 class SubtitleEndDetector(object):
     """
-    Detects end-of-content time using the last subtitle timestamp in an MKV.
+    Detects end-of-content time using the last subtitle timestamp in an MKV
+    or MP4 file, or in sidecar subtitle files.
 
     Integrates with UpNext's state/player: on success calls
     ``state.set_detected_popup_time()`` and fires the
@@ -842,14 +2015,13 @@ class SubtitleEndDetector(object):
             self.log('detect() called with empty file_path', utils.LOGWARNING)
             return False
 
-        file_lower = file_path.lower()
-        # If the playing item is not a direct MKV path (eg. plugin://), try to
-        # resolve the underlying stream URL from the player a few times. This
-        # helps when inputstream/input add-ons proxy/resolve a real HTTP MKV
-        # after playback starts.
-        if not file_lower.endswith('.mkv'):
+        # If the playing item is not a supported video file (eg. plugin://),
+        # try to resolve the underlying stream URL from the player a few times.
+        # This helps when inputstream/input add-ons proxy/resolve a real HTTP
+        # MKV after playback starts.
+        if file_path.lower().startswith('plugin://') or not get_parser(file_path):
             self.log(
-                'File not a direct MKV ({0}), attempting to resolve stream URL'.format(
+                'File not a direct MKV/MP4 ({0}), attempting to resolve stream URL'.format(
                     file_path
                 ),
                 utils.LOGINFO
@@ -874,14 +2046,16 @@ class SubtitleEndDetector(object):
                 time.sleep(1)
             else:
                 self.log(
-                    'Not an MKV file ({0}), skipping subtitle end detection'.format(
+                    'Not a video file ({0}), skipping subtitle end detection'.format(
                         file_path
                     ),
                     utils.LOGINFO
                 )
                 return False
 
-        timestamp = MKVEndParser().get_last_subtitle_timestamp(file_path)
+        total_time = getattr(self.state, 'total_time', 0) if self.state else 0
+        # Embedded subtitles are used if available, otherwise sidecar files
+        timestamp = find_last_subtitle_timestamp(file_path, duration=total_time)
         if timestamp is None:
             self.log(
                 'Subtitle end detection: no usable timestamp found',
@@ -891,7 +2065,6 @@ class SubtitleEndDetector(object):
 
         # Sanity check: reject timestamps before the configured detection
         # threshold to avoid setting an early popup from sparse subtitle tracks.
-        total_time = getattr(self.state, 'total_time', 0) if self.state else 0
         threshold_pct = SETTINGS.detect_subtitles_threshold
         if total_time > 0:
             min_time = total_time * threshold_pct / 100.0
@@ -0,0 +1,488 @@
+# -*- coding: utf-8 -*-
+# GNU General Public License v2.0 (see COPYING or https://www.gnu.org/licenses/gpl-2.0.txt)
+"""Offline benchmark for UpNextDetector, run outside of Kodi, which replays a
+   directory of captured frames through the detector using stubbed Kodi
+   modules, and reports throughput, per-stage timing, peak memory usage, and
+   the detected credits timestamp compared to a known timestamp.
+
+   Frames are read in order of the number at the start of their filename,
+   which is converted to a play time using --fps. Supported frames are:
+     - Raw RenderCapture data, named <number>_<width>x<height>.raw
+     - Any image format supported by PIL, e.g. as extracted from a local video
+       using: ffmpeg -i video.mkv -vf fps=1 frames/%05d.png
+
+   An optional corpus.json file in the frames directory can be used to store
+   default options, e.g. {"credits": 1234.5, "fps": 1, "total_time": 1300}
+
+   Frames can't be captured at other play times, so the capture scheduler is
+   not updated during replay, and the capture interval used to count match
+   hits and misses is fixed at the frame interval of 1 / fps.
+
+   Usage: python tools/detector_benchmark.py FRAMES_DIR [options]"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import gc
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+import types
+from xml.etree import ElementTree
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from PIL import Image
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+
+_LIB_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'service.upnext', 'resources', 'lib'
+)
+_SETTINGS_PATH = os.path.join(os.path.dirname(_LIB_PATH), 'settings.xml')
+_FRAME_NAME = re.compile(r'^(\d+(?:\.\d+)?)(?:_(\d+)x(\d+))?\.(\w+)$')
+_STAGES = ('capture', 'images', 'similarity', 'frame')
+
+
+def _setting_defaults(overrides):
+    settings = {}
+    for setting in ElementTree.parse(_SETTINGS_PATH).iter('setting'):
+        default = setting.find('default')
+        if setting.get('id') and default is not None:
+            settings[setting.get('id')] = default.text or ''
+    settings.update(overrides)
+    return settings
+
+
+def _install_stubs(settings, profile_path, video_size, verbose=False):
+    """Install minimal replacements for the Kodi Python modules used by the
+       detector, that return default or overridden addon settings, the video
+       resolution of the replayed frames, and store window properties"""
+
+    properties = {}
+
+    xbmc = types.ModuleType(str('xbmc'))
+    for level, name in enumerate(('LOGDEBUG', 'LOGINFO', 'LOGWARNING',
+                                  'LOGERROR', 'LOGFATAL', 'LOGNONE')):
+        setattr(xbmc, name, level)
+
+    def _log(msg, level=xbmc.LOGDEBUG):
+        if verbose or level >= xbmc.LOGWARNING:
+            print(msg, file=sys.stderr)
+
+    def _execute_jsonrpc(request):
+        request = json.loads(request)
+        if isinstance(request, list):
+            return json.dumps([{'id': i.get('id'), 'result': {}}
+                               for i in request])
+        if request.get('method') == 'Application.GetProperties':
+            result = {'version': {'major': 19, 'minor': 0}}
+        elif request.get('method') == 'Settings.GetSettingValue':
+            result = {'value': verbose}
+        else:
+            result = {}
+        return json.dumps({'id': request.get('id'), 'result': result})
+
+    def _translate_path(path):
+        return path.replace('special://profile/', profile_path)
+
+    class Monitor(object):  # pylint: disable=too-few-public-methods
+        @staticmethod
+        def abortRequested():  # pylint: disable=invalid-name
+            return False
+
+        @staticmethod
+        def waitForAbort(timeout=None):  # pylint: disable=invalid-name
+            if timeout:
+                threading.Event().wait(timeout)
+            return False
+
+    xbmc.log = _log
+    xbmc.executeJSONRPC = _execute_jsonrpc
+    xbmc.getInfoLabel = {
+        'Player.Process(VideoWidth)': str(video_size[0]),
+        'Player.Process(VideoHeight)': str(video_size[1]),
+    }.get
+    xbmc.getRegion = lambda _: ''
+    xbmc.translatePath = _translate_path
+    xbmc.makeLegalFilename = lambda path: path
+    xbmc.Monitor = Monitor
+
+    xbmcaddon = types.ModuleType(str('xbmcaddon'))
+
+    class Addon(object):
+        def __init__(self, addon_id=None):
+            self.addon_id = addon_id
+
+        def getAddonInfo(self, key):  # pylint: disable=invalid-name
+            return {'id': 'service.upnext', 'path': _LIB_PATH}.get(key, '')
+
+        def getSetting(self, key):  # pylint: disable=invalid-name
+            return settings.get(key, '')
+
+        def getSettingBool(self, key):  # pylint: disable=invalid-name
+            return self.getSetting(key).lower() == 'true'
+
+        def getSettingInt(self, key):  # pylint: disable=invalid-name
+            return int(float(self.getSetting(key) or 0))
+
+    xbmcaddon.Addon = Addon
+
+    xbmcgui = types.ModuleType(str('xbmcgui'))
+
+    class Window(object):
+        def __init__(self, window_id=None):
+            self.window_id = window_id
+
+        @staticmethod
+        def getProperty(key):  # pylint: disable=invalid-name
+            return properties.get(key, '')
+
+        @staticmethod
+        def setProperty(key, value):  # pylint: disable=invalid-name
+            properties[key] = value
+
+        @staticmethod
+        def clearProperty(key):  # pylint: disable=invalid-name
+            properties.pop(key, None)
+
+    xbmcgui.Window = Window
+    xbmcgui.NOTIFICATION_INFO = 'info'
+
+    xbmcvfs = types.ModuleType(str('xbmcvfs'))
+    xbmcvfs.exists = os.path.exists
+    xbmcvfs.mkdirs = lambda path: os.makedirs(path) or True
+    xbmcvfs.translatePath = _translate_path
+    xbmcvfs.makeLegalFilename = xbmc.makeLegalFilename
+
+    for module in (xbmc, xbmcaddon, xbmcgui, xbmcvfs):
+        sys.modules[module.__name__] = module
+
+
+def _list_frames(path, fps):
+    frames = []
+    for filename in os.listdir(path):
+        match = _FRAME_NAME.match(filename)
+        if not match:
+            continue
+        number, width, height, extension = match.groups()
+        if extension.lower() == 'raw' and not (width and height):
+            continue
+        size = (int(width), int(height)) if width and height else None
+        frames.append((float(number) / fps, os.path.join(path, filename), size))
+    frames.sort()
+    return frames
+
+
+def _read_frame(filename, size):
+    if size:
+        with open(filename, mode='rb') as frame_file:
+            data = bytearray(frame_file.read())
+        return Image.frombuffer('RGBA', size, data, 'raw', 'RGBA', 0, 1)
+
+    return Image.open(filename).convert('RGBA')
+
+
+class _Player(object):  # pylint: disable=too-few-public-methods
+    @staticmethod
+    def get_speed():
+        return 1
+
+
+class _State(object):  # pylint: disable=too-few-public-methods
+    def __init__(self, group_name, group_idx):
+        self.current_item = {'group_name': group_name, 'group_idx': group_idx}
+        self.detected_time = None
+
+    def set_detected_popup_time(self, detected_time):
+        self.detected_time = detected_time
+
+
+class Benchmark(object):
+    """Class to replay frames through UpNextDetector and collect timings"""
+
+    def __init__(self, detector_class, player, state,
+                 frames, total_time, data_limit, interval=1):
+        self.timings = {stage: [] for stage in _STAGES}
+        self._lock = threading.Lock()
+
+        timed = self._timed
+
+        class _BenchmarkDetector(detector_class):
+            """UpNextDetector with timing of image processing stages"""
+
+            __slots__ = ()
+
+            def _create_images(self, image_data, pipelines):
+                return timed('images', detector_class._create_images,  # pylint: disable=protected-access
+                             image_data, pipelines)
+
+            def _evaluate_similarity(self, *args):
+                return timed('similarity', detector_class._evaluate_similarity,  # pylint: disable=protected-access
+                             self, *args)
+
+        self.detector = _BenchmarkDetector(player, state)
+        self.detector._init_hashes()  # pylint: disable=protected-access
+        # Match hits and misses are counted in seconds of play time, using the
+        # capture interval, which is fixed at the interval between frames
+        self.detector.scheduler.interval = interval
+        self.frames = frames
+        self.total_time = total_time
+        self.capture_size = self.detector._get_video_capture_resolution(  # pylint: disable=protected-access
+            max_size=data_limit
+        )
+        self.detected_frame = None
+
+    def _timed(self, stage, func, *args):
+        start = timeit.default_timer()
+        result = func(*args)
+        elapsed = timeit.default_timer() - start
+        with self._lock:
+            self.timings[stage].append(elapsed)
+        return result
+
+    def _capture(self, filename, size):
+        # Approximates Kodi scaling the render buffer to the capture size
+        image = _read_frame(filename, size)
+        if image.size != self.capture_size:
+            image = image.resize(self.capture_size, resample=Image.BILINEAR)
+        return bytearray(image.tobytes())
+
+    def process(self, play_time, filename, size):
+        detector = self.detector
+        current_index = (
+            int(self.total_time - play_time),
+            int(play_time),
+            detector.hashes.group_idx
+        )
+        detector.hash_index['current'] = current_index
+
+        image_data = self._timed('capture', self._capture, filename, size)
+        self._timed('frame', detector._process_frame,  # pylint: disable=protected-access
+                    image_data, self.capture_size, play_time, current_index)
+
+        if self.detected_frame is None and detector.match_counts['detected']:
+            self.detected_frame = os.path.basename(filename)
+
+    def run(self, threads=1):
+        if threads <= 1:
+            for frame in self.frames:
+                self.process(*frame)
+            return
+
+        # Frames are processed out of order by multiple workers, as they are
+        # when the detector is running in Kodi
+        queue = Queue(maxsize=threads)
+
+        def _worker():
+            while True:
+                frame = queue.get()
+                if frame is None:
+                    break
+                self.process(*frame)
+
+        workers = [threading.Thread(target=_worker) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for frame in self.frames:
+            queue.put(frame)
+        for worker in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+
+
+def _parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Replay captured frames through the UpNext detector'
+    )
+    parser.add_argument('frames', help='directory of captured frames')
+    parser.add_argument('--fps', type=float,
+                        help='frame rate of captured frames (default: 1)')
+    parser.add_argument('--credits', type=float,
+                        help='known play time that end credits start (s)')
+    parser.add_argument('--total-time', type=float,
+                        help='video duration (default: last frame time)')
+    parser.add_argument('--video-size',
+                        help='video resolution as WIDTHxHEIGHT '
+                             '(default: first frame size)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='number of worker threads (default: 1)')
+    parser.add_argument('--data-limit', type=int,
+                        help='capture data limit in kB '
+                             '(default: detectorDataLimit setting)')
+    parser.add_argument('--set', action='append', default=[],
+                        metavar='SETTING=VALUE',
+                        help='override an addon setting, e.g. '
+                             'detectorFilter=false')
+    parser.add_argument('--profile',
+                        help='directory used to store hashes, so that '
+                             'episodes of a show can be compared across runs '
+                             '(default: temporary directory)')
+    parser.add_argument('--group', default='benchmark',
+                        help='show/season name used to group stored hashes')
+    parser.add_argument('--episode', type=int, default=1,
+                        help='episode number used to group stored hashes')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='report peak memory allocated by Python objects')
+    parser.add_argument('--json', action='store_true',
+                        help='output results as JSON')
+    parser.add_argument('--verbose', action='store_true',
+                        help='output detector log messages')
+    return parser.parse_args(argv)
+
+
+def _stats(values):
+    if not values:
+        return {'mean': 0, 'max': 0, 'total': 0}
+    total = sum(values)
+    return {
+        'mean': 1000 * total / len(values),
+        'max': 1000 * max(values),
+        'total': total,
+    }
+
+
+def _report(results):
+    print('Frames:     {frames} ({video_size[0]}x{video_size[1]} captured at'
+          ' {capture_size[0]}x{capture_size[1]})'.format(**results))
+    print('Threads:    {threads}'.format(**results))
+    print('Throughput: {fps:.2f} frames/s ({elapsed:.2f}s)'.format(**results))
+    for stage in _STAGES:
+        print('  {0:<11} mean {1[mean]:8.2f}ms  max {1[max]:8.2f}ms'.format(
+            stage, results['stages'][stage]
+        ))
+    if results['traced_peak'] is not None:
+        print('Peak traced memory: {0:.1f} MiB'.format(
+            results['traced_peak'] / 1048576
+        ))
+    if results['max_rss'] is not None:
+        print('Peak RSS:   {0:.1f} MiB'.format(results['max_rss'] / 1048576))
+
+    detected = results['detected']
+    print('Detected:   {0}'.format(
+        '{0:.1f}s ({1})'.format(detected, results['detected_frame'])
+        if detected is not None else 'not detected'
+    ))
+    if results['credits'] is not None:
+        print('Expected:   {0:.1f}s'.format(results['credits']))
+        if detected is not None:
+            print('Error:      {0:+.1f}s'.format(detected - results['credits']))
+
+
+def main(argv=None):  # pylint: disable=too-many-locals
+    args = _parse_args(sys.argv[1:] if argv is None else argv)
+
+    corpus = {}
+    corpus_file = os.path.join(args.frames, 'corpus.json')
+    if os.path.exists(corpus_file):
+        with open(corpus_file, mode='r', encoding='utf-8') as corpus_data:
+            corpus = json.load(corpus_data)
+    fps = args.fps or corpus.get('fps') or 1
+    credits_time = corpus.get('credits') if args.credits is None else (
+        args.credits
+    )
+
+    frames = _list_frames(args.frames, fps)
+    if not frames:
+        print('No frames found in {0}'.format(args.frames), file=sys.stderr)
+        return 1
+    total_time = (args.total_time or corpus.get('total_time')
+                  or frames[-1][0] + 1 / fps)
+
+    if args.video_size:
+        video_size = tuple(int(i) for i in args.video_size.split('x'))
+    elif corpus.get('video_size'):
+        video_size = tuple(corpus['video_size'])
+    else:
+        video_size = _read_frame(*frames[0][1:]).size
+
+    overrides = dict(setting.split('=', 1) for setting in args.set)
+    if args.data_limit:
+        overrides['detectorDataLimit'] = str(args.data_limit)
+    if args.verbose:
+        overrides.setdefault('logLevel', '2')
+    settings = _setting_defaults(overrides)
+
+    profile_path = args.profile or tempfile.mkdtemp()
+    profile_path = os.path.join(os.path.abspath(profile_path), '')
+    _install_stubs(settings, profile_path, video_size, args.verbose)
+
+    # Detector modules read settings when imported, so can only be imported
+    # once Kodi modules have been stubbed and settings overridden
+    sys.path.insert(0, _LIB_PATH)
+    import detector  # pylint: disable=import-error,import-outside-toplevel
+    from settings import SETTINGS  # pylint: disable=import-error,import-outside-toplevel
+
+    state = _State(args.group, args.episode)
+    benchmark = Benchmark(detector.UpNextDetector, _Player(), state,
+                          frames, total_time, SETTINGS.detector_data_limit,
+                          interval=1 / fps)
+
+    # Tracing memory allocations slows down processing, so is not enabled
+    # unless requested
+    trace_memory = args.trace_memory and tracemalloc
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    start = timeit.default_timer()
+    benchmark.run(args.threads)
+    elapsed = timeit.default_timer() - start
+    traced_peak = None
+    if trace_memory:
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    max_rss = None
+    if resource:
+        # Reported in kB on Linux and in bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        max_rss *= 1 if sys.platform == 'darwin' else 1024
+
+    if args.profile:
+        benchmark.detector.store_data()
+    else:
+        shutil.rmtree(profile_path, ignore_errors=True)
+
+    results = {
+        'frames': len(frames),
+        'video_size': list(video_size),
+        'capture_size': list(benchmark.capture_size),
+        'threads': args.threads,
+        'elapsed': elapsed,
+        'fps': len(frames) / elapsed if elapsed else 0,
+        'stages': {stage: _stats(benchmark.timings[stage])
+                   for stage in _STAGES},
+        'traced_peak': traced_peak,
+        'max_rss': max_rss,
+        'detected': state.detected_time,
+        'detected_frame': benchmark.detected_frame,
+        'credits': credits_time,
+    }
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        _report(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())